@@ -0,0 +1,317 @@
+import time
+
+import numpy as np
+
+class IVFIndex:
+    """
+    Inverted file (IVF) index for approximate nearest neighbour search.
+
+    Vectors are normalized and clustered around n_lists centroids with
+    spherical k-means. A query is only compared to the vectors of its
+    n_probe nearest centroids, so search cost grows with roughly
+    n_probe * n / n_lists rather than n. Scores are cosine similarities.
+
+    Attributes:
+        centroids (np.ndarray): n_lists x d matrix of unit-length centroids
+        list_ids (list): Per-list arrays of vector ids
+        list_vectors (list): Per-list matrices of unit-length vectors
+        n_probe (int): Default number of lists searched per query
+        metadata (dict): Free-form string metadata saved with the index
+    """
+
+    def __init__(self, n_probe=8):
+        self.centroids = None
+        self.list_ids = []
+        self.list_vectors = []
+        self.id_to_list = {}
+        self.n_probe = n_probe
+        self.metadata = {}
+
+    def __len__(self):
+        return len(self.id_to_list)
+
+    def __contains__(self, id):
+        return int(id) in self.id_to_list
+
+    @staticmethod
+    def normalize(vectors):
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return vectors / norms
+
+    def build(self, vectors, ids, n_lists=None, iterations=10, seed=0):
+        """
+        Train centroids on vectors with spherical k-means and add them.
+
+        n_lists defaults to about sqrt(n).
+        """
+
+        vectors = self.normalize(vectors)
+        ids = np.asarray(ids, dtype=np.int64)
+        rng = np.random.default_rng(seed)
+
+        if n_lists is None:
+            n_lists = int(np.sqrt(len(vectors)))
+
+        n_lists = max(1, min(n_lists, len(vectors)))
+
+        # Train on a sample; more points per centroid adds little
+        sample = vectors
+        if len(vectors) > n_lists * 256:
+            sample = vectors[rng.choice(len(vectors), n_lists * 256, replace=False)]
+
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)]
+
+        for _ in range(iterations):
+            assignments = self.assign(sample, centroids)
+
+            for list_index in range(n_lists):
+                members = sample[assignments == list_index]
+
+                # Re-seed empty clusters with a random point
+                if len(members) == 0:
+                    centroids[list_index] = sample[rng.integers(len(sample))]
+                else:
+                    centroids[list_index] = members.sum(axis=0)
+
+            centroids = self.normalize(centroids)
+
+        self.centroids = centroids
+        self.list_ids = [np.zeros(0, dtype=np.int64) for _ in range(n_lists)]
+        self.list_vectors = [np.zeros((0, vectors.shape[1]), dtype=np.float32)
+                             for _ in range(n_lists)]
+        self.id_to_list = {}
+
+        self.add(vectors, ids)
+
+    @staticmethod
+    def assign(vectors, centroids, chunk_size=4096):
+        """
+        Return the index of the nearest centroid for each vector.
+        """
+
+        assignments = np.empty(len(vectors), dtype=np.int64)
+
+        for i in range(0, len(vectors), chunk_size):
+            scores = vectors[i:i + chunk_size] @ centroids.T
+            assignments[i:i + chunk_size] = scores.argmax(axis=1)
+
+        return assignments
+
+    def add(self, vectors, ids):
+        """
+        Insert vectors into their nearest lists without retraining.
+
+        Ids that are already indexed are replaced.
+        """
+
+        if self.centroids is None:
+            raise ValueError("Index has not been built.")
+
+        vectors = self.normalize(vectors)
+        ids = np.asarray(ids, dtype=np.int64)
+
+        if len(ids) == 0:
+            return
+
+        self.remove([id for id in ids if id in self])
+
+        assignments = self.assign(vectors, self.centroids)
+
+        for list_index in np.unique(assignments):
+            members = assignments == list_index
+
+            self.list_ids[list_index] = np.concatenate(
+                [self.list_ids[list_index], ids[members]]
+            )
+            self.list_vectors[list_index] = np.vstack(
+                [self.list_vectors[list_index], vectors[members]]
+            )
+
+            for id in ids[members]:
+                self.id_to_list[int(id)] = int(list_index)
+
+    def remove(self, ids):
+        """
+        Remove vectors by id. Unknown ids are ignored.
+        """
+
+        by_list = {}
+        for id in ids:
+            list_index = self.id_to_list.pop(int(id), None)
+            if list_index is not None:
+                by_list.setdefault(list_index, []).append(int(id))
+
+        for list_index, list_removed in by_list.items():
+            keep = ~np.isin(self.list_ids[list_index], list_removed)
+            self.list_ids[list_index] = self.list_ids[list_index][keep]
+            self.list_vectors[list_index] = self.list_vectors[list_index][keep]
+
+    def search(self, queries, k=10, n_probe=None):
+        """
+        Find the approximate k nearest neighbours of each query.
+
+        Returns (ids, scores), both len(queries) x k and sorted by descending
+        score. Missing neighbours are padded with id -1 and score -inf.
+        """
+
+        if self.centroids is None:
+            raise ValueError("Index has not been built.")
+
+        queries = self.normalize(queries)
+        n_probe = min(n_probe or self.n_probe, len(self.centroids))
+
+        best_ids = np.full((len(queries), k), -1, dtype=np.int64)
+        best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+
+        # Pick the lists each query probes
+        centroid_scores = queries @ self.centroids.T
+        probes = np.argpartition(-centroid_scores, n_probe - 1, axis=1)[:, :n_probe]
+
+        # Score each list once against all queries that probe it
+        for list_index in np.unique(probes):
+            if len(self.list_ids[list_index]) == 0:
+                continue
+
+            query_rows = np.nonzero((probes == list_index).any(axis=1))[0]
+            scores = queries[query_rows] @ self.list_vectors[list_index].T
+
+            # Merge with the running top k
+            candidate_scores = np.hstack([best_scores[query_rows], scores])
+            candidate_ids = np.hstack([
+                best_ids[query_rows],
+                np.broadcast_to(self.list_ids[list_index],
+                                (len(query_rows), len(self.list_ids[list_index]))),
+            ])
+
+            top = np.argpartition(-candidate_scores, k - 1, axis=1)[:, :k]
+
+            best_scores[query_rows] = np.take_along_axis(candidate_scores, top, axis=1)
+            best_ids[query_rows] = np.take_along_axis(candidate_ids, top, axis=1)
+
+        # Sort each row by descending score
+        order = np.argsort(-best_scores, axis=1, kind="stable")
+
+        return (np.take_along_axis(best_ids, order, axis=1),
+                np.take_along_axis(best_scores, order, axis=1))
+
+    def save(self, path):
+        """
+        Save the index to an .npz file.
+        """
+
+        list_lengths = np.array([len(ids) for ids in self.list_ids], dtype=np.int64)
+        dimensions = self.centroids.shape[1]
+
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                centroids=self.centroids,
+                list_lengths=list_lengths,
+                ids=np.concatenate(self.list_ids) if self.list_ids \
+                        else np.zeros(0, dtype=np.int64),
+                vectors=np.vstack(self.list_vectors) if self.list_vectors \
+                        else np.zeros((0, dimensions), dtype=np.float32),
+                n_probe=np.array(self.n_probe),
+                metadata_keys=np.array(list(self.metadata.keys()), dtype=str),
+                metadata_values=np.array(list(self.metadata.values()), dtype=str),
+            )
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load an index saved with save().
+        """
+
+        with np.load(path) as data:
+            index = cls(n_probe=int(data["n_probe"]))
+            index.centroids = data["centroids"]
+            index.metadata = dict(zip(data["metadata_keys"].tolist(),
+                                      data["metadata_values"].tolist()))
+
+            offsets = np.concatenate([[0], np.cumsum(data["list_lengths"])])
+            ids = data["ids"]
+            vectors = data["vectors"]
+
+        for list_index in range(len(index.centroids)):
+            start, end = offsets[list_index], offsets[list_index + 1]
+            index.list_ids.append(ids[start:end])
+            index.list_vectors.append(vectors[start:end])
+
+            for id in ids[start:end]:
+                index.id_to_list[int(id)] = list_index
+
+        return index
+
+def exact_search(queries, vectors, ids, k=10, chunk_size=1024):
+    """
+    Find the exact k nearest neighbours of each query by brute force.
+
+    Returns (ids, scores) in the same layout as IVFIndex.search.
+    """
+
+    queries = IVFIndex.normalize(queries)
+    vectors = IVFIndex.normalize(vectors)
+    ids = np.asarray(ids, dtype=np.int64)
+    k = min(k, len(ids))
+
+    result_ids = np.empty((len(queries), k), dtype=np.int64)
+    result_scores = np.empty((len(queries), k), dtype=np.float32)
+
+    for i in range(0, len(queries), chunk_size):
+        scores = queries[i:i + chunk_size] @ vectors.T
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind="stable")
+
+        result_ids[i:i + chunk_size] = ids[np.take_along_axis(top, order, axis=1)]
+        result_scores[i:i + chunk_size] = np.take_along_axis(top_scores, order, axis=1)
+
+    return result_ids, result_scores
+
+def benchmark_recall(vectors, ids, k=10, n_probes=(1, 2, 4, 8, 16),
+                     n_lists=None, sample_size=1000, seed=0):
+    """
+    Measure recall@k of an IVFIndex against exact search.
+
+    A sample of the vectors is used as queries. Returns a list of dicts with
+    n_probe, recall and per-query search time in milliseconds, plus the
+    build time and exact search time.
+    """
+
+    rng = np.random.default_rng(seed)
+    ids = np.asarray(ids, dtype=np.int64)
+
+    start = time.perf_counter()
+    index = IVFIndex()
+    index.build(vectors, ids, n_lists=n_lists, seed=seed)
+    build_seconds = time.perf_counter() - start
+
+    sample = rng.choice(len(ids), min(sample_size, len(ids)), replace=False)
+    queries = np.asarray(vectors)[sample]
+
+    start = time.perf_counter()
+    exact_ids, _ = exact_search(queries, vectors, ids, k)
+    exact_ms = (time.perf_counter() - start) * 1000 / len(sample)
+
+    results = []
+    for n_probe in n_probes:
+        start = time.perf_counter()
+        approximate_ids, _ = index.search(queries, k, n_probe=n_probe)
+        search_ms = (time.perf_counter() - start) * 1000 / len(sample)
+
+        hits = sum(len(np.intersect1d(a, e)) for a, e in zip(approximate_ids, exact_ids))
+
+        results.append({
+            "n_probe": n_probe,
+            "recall": hits / exact_ids.size,
+            "search_ms": search_ms,
+        })
+
+    return {
+        "n_lists": len(index.centroids),
+        "build_seconds": build_seconds,
+        "exact_ms": exact_ms,
+        "results": results,
+    }
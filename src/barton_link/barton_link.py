@@ -1,11 +1,46 @@
-from typing import Optional
-# import spacy
-from sentence_transformers import SentenceTransformer, util
-from .gdocs_parser import GDocsParser
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from threading import Lock, Thread
+from typing import Optional, TYPE_CHECKING
+import numpy as np
 
-gdocs: Optional[GDocsParser] = None
+from .embedding_backends import get_embedding_backend
+
+# The ML and Google API stacks take seconds to import, so they are imported
+# when first used rather than by every management command
+if TYPE_CHECKING:
+    # import spacy
+    from sentence_transformers import SentenceTransformer
+    from .embedding_worker import EmbeddingClient
+    from .gdocs_parser import GDocsParser
+
+gdocs: Optional["GDocsParser"] = None
 # spacy_model: Optional[spacy.Language] = None
-sbert: Optional[SentenceTransformer] = None
+sbert: Optional["SentenceTransformer"] = None
+
+# Client of the out-of-process embedding worker, if one is used
+embedding_worker: Optional["EmbeddingClient"] = None
+
+SBERT_MODEL_NAME = "all-MiniLM-L6-v2"
+
+# How the model is run: "torch", "int8" or "onnx". Chosen at startup, since
+# embeddings are stored under the backend's model name
+EMBEDDING_BACKEND = os.environ.get("BARTON_EMBEDDING_BACKEND", "torch")
+embedding_backend = get_embedding_backend(EMBEDDING_BACKEND, SBERT_MODEL_NAME)
+
+# Model name stored with embeddings made by this process
+EMBEDDING_MODEL_NAME = embedding_backend.model_name
+
+# Keep concurrent callers from loading the model twice
+sbert_lock = Lock()
+models_thread: Optional[Thread] = None
+
+# Process pool of encode_parallel, each worker with its own model copy
+encode_pool: Optional[ProcessPoolExecutor] = None
+encode_pool_workers = 0
+encode_pool_lock = Lock()
 
 # def load_spacy(self):
 #     if not self.spacy_model:
@@ -15,18 +50,59 @@ sbert: Optional[SentenceTransformer] = None
 
 def load_sbert():
     global sbert
-    if not sbert:
-        try:
-            # Load the SentenceTransformer model
-            print("Loading SentenceTransformer model...")
-            # self.sbert = SentenceTransformer("all-mpnet-base-v2")
-            sbert = SentenceTransformer("all-MiniLM-L6-v2")
 
-        except Exception as e:
-            #@REVISIT
-            print(e)
-            print("Failed to load SentenceTransformer model.")
-            return
+    with sbert_lock:
+        if not sbert:
+            try:
+                # Load the SentenceTransformer model
+                print(f"Loading SentenceTransformer model ({embedding_backend.name})...")
+                # self.sbert = SentenceTransformer("all-mpnet-base-v2")
+                sbert = embedding_backend.load()
+
+            except Exception as e:
+                #@REVISIT
+                print(e)
+                print("Failed to load SentenceTransformer model.")
+                return
+
+    return sbert
+
+def is_encoder_ready():
+    """
+    Whether encode_sbert can run without first loading a model.
+    """
+
+    return embedding_worker is not None or sbert is not None
+
+def use_embedding_worker(address=None, authkey=None):
+    """
+    Send encode_sbert calls to the embedding worker at address (default:
+    embedding_worker.WORKER_ADDRESS) instead of encoding in this process.
+    """
+
+    global embedding_worker
+
+    from .embedding_worker import EmbeddingClient, WORKER_ADDRESS
+
+    # Only accept embeddings from a worker running the same backend, as
+    # they are stored under this process's EMBEDDING_MODEL_NAME
+    embedding_worker = EmbeddingClient(address or WORKER_ADDRESS,
+                                       authkey,
+                                       model_name=EMBEDDING_MODEL_NAME)
+
+def load_models_in_background():
+    """
+    Load the models in a daemon thread, so the first request that needs
+    them doesn't have to.
+    """
+
+    global models_thread
+
+    if models_thread is None or not models_thread.is_alive():
+        models_thread = Thread(target=load_sbert, daemon=True)
+        models_thread.start()
+
+    return models_thread
 
 def measure_excerpt_similarity(excerpt1, excerpt2, engine="sbert"):
     """
@@ -56,6 +132,8 @@ def measure_excerpt_similarity(excerpt1, excerpt2, engine="sbert"):
 #     return similarity
 
 def measure_excerpt_similarity_sbert(excerpt1, excerpt2):
+    from sentence_transformers import util
+
     if not sbert:
         load_sbert()
 
@@ -70,6 +148,8 @@ def measure_excerpt_similarity_sbert(excerpt1, excerpt2):
     return cosine_scores[0][0]
 
 def compare_lists_sbert(a, b): #@REVISIT naming
+    from sentence_transformers import util
+
     if not sbert:
         load_sbert()
 
@@ -83,7 +163,133 @@ def compare_lists_sbert(a, b): #@REVISIT naming
 
     return cosine_scores
 
+def encode_sbert(texts, batch_size=64):
+    """
+    Encode a list of texts into a float32 matrix of embeddings.
+
+    Uses the embedding worker if one is configured, falling back to
+    encoding in this process if it can't be reached or encodes with another
+    model.
+    """
+
+    if embedding_worker is not None:
+        from .embedding_worker import EmbeddingModelMismatch
+
+        try:
+            return embedding_worker.encode(texts)
+
+        except (OSError, EOFError, EmbeddingModelMismatch) as e:
+            #@REVISIT
+            print(e)
+            print("Embedding worker unavailable, encoding in process.")
+
+    return encode_local(texts, batch_size)
+
+def encode_local(texts, batch_size=64):
+    """
+    Encode a list of texts with the model loaded in this process.
+    """
+
+    if not sbert:
+        load_sbert()
+
+    if len(texts) == 0:
+        dimensions = sbert.get_sentence_embedding_dimension()
+        return np.zeros((0, dimensions), dtype=np.float32)
+
+    embeddings = sbert.encode(texts,
+                              batch_size=batch_size,
+                              convert_to_numpy=True)
+
+    return np.asarray(embeddings, dtype=np.float32).reshape(len(texts), -1)
+
+def init_encode_worker(threads):
+    """
+    Set up an encode_parallel worker process.
+    """
+
+    import torch
+
+    # Split the cores between workers instead of each using all of them
+    torch.set_num_threads(threads)
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+    load_sbert()
+
+def get_encode_pool(workers):
+    """
+    Get the encode_parallel process pool, starting it if needed.
+    """
+
+    global encode_pool, encode_pool_workers
+
+    with encode_pool_lock:
+        if encode_pool is not None and encode_pool_workers != workers:
+            encode_pool.shutdown()
+            encode_pool = None
+
+        if encode_pool is None:
+            threads = max(1, (os.cpu_count() or 1) // workers)
+
+            # Spawn rather than fork, which isn't safe with torch threads
+            encode_pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=init_encode_worker,
+                initargs=(threads,),
+            )
+            encode_pool_workers = workers
+
+    return encode_pool
+
+def encode_parallel(texts, workers, batch_size=64):
+    """
+    Encode a list of texts across a pool of worker processes.
+
+    The texts are split into shards that are encoded in parallel and
+    reassembled in order. Small lists, or workers <= 1, are encoded by
+    encode_sbert instead. The pool is kept for later calls, so each worker
+    loads the model once.
+    """
+
+    if workers <= 1 or len(texts) < 2 * batch_size:
+        return encode_sbert(texts, batch_size)
+
+    # Several shards per worker so slow shards don't hold up the rest,
+    # each a whole number of batches
+    shard_size = math.ceil(len(texts) / (workers * 4) / batch_size) * batch_size
+    shards = [texts[i:i + shard_size] for i in range(0, len(texts), shard_size)]
+
+    pool = get_encode_pool(workers)
+    embeddings = list(pool.map(encode_local, shards, [batch_size] * len(shards)))
+
+    return np.vstack(embeddings).astype(np.float32, copy=False)
+
+def normalize_embeddings(embeddings):
+    """
+    Scale each row of an embedding matrix to unit length.
+    """
+
+    embeddings = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+    # Leave all-zero rows alone rather than dividing by zero
+    norms[norms == 0] = 1
+
+    return embeddings / norms
+
+def compare_embeddings(a, b):
+    """
+    Compute cosine similarities between two sets of precomputed embeddings.
+
+    Returns a len(a) x len(b) matrix, like compare_lists_sbert.
+    """
+
+    return normalize_embeddings(a) @ normalize_embeddings(b).T
+
 def load_google_doc(document_id):
+    from .gdocs_parser import GDocsParser
+
     if not gdocs:
         # Initialize Google Docs API
         gdocs = GDocsParser()
@@ -86,6 +86,9 @@ class BaseParser:
         if diff > 0:
             self.state['working_excerpts'] += [None] * diff
 
+        # Excerpts deeper than this one can no longer receive children
+        self.state['working_excerpts'] = self.state['working_excerpts'][:level + 1]
+
         # Insert excerpt into working_excerpts
         self.state['working_excerpts'][level] = excerpt
 
@@ -113,6 +116,31 @@ class BaseParser:
         # # Add excerpt to working_excerpts stack
         # self.state['working_excerpts'].append(excerpt)
 
+    def close_excerpts(self):
+        """
+        Close all open excerpts, so that following excerpts are not added
+        as their children.
+        """
+
+        self.state['working_excerpts'] = []
+
+    def pop_finished_excerpts(self):
+        """
+        Remove and return the top-level excerpts that can no longer receive
+        children, in order.
+        """
+
+        excerpts = self.state['excerpts']
+
+        # The last top-level excerpt is still open while any excerpt is on
+        # the working stack, since the next line may nest under it
+        open_count = 1 if any(self.state['working_excerpts']) else 0
+        finished_count = max(0, len(excerpts) - open_count)
+
+        self.state['excerpts'] = excerpts[finished_count:]
+
+        return excerpts[:finished_count]
+
     def reset_state(self):
         self.state = {
             # 'document_id': None,
@@ -0,0 +1,152 @@
+import importlib.util
+
+import numpy as np
+
+class EmbeddingBackend:
+    """
+    Way of running a SentenceTransformer model.
+
+    load() returns an object with SentenceTransformer's encode() and
+    get_sentence_embedding_dimension(). Backends whose vectors differ from
+    the reference PyTorch model store their embeddings under their own
+    model_name, so vectors from different backends are never mixed.
+    """
+
+    name: str = None
+
+    # Modules the backend needs beyond sentence-transformers, and the extra
+    # that installs them
+    required_modules: list = []
+    extra: str = None
+
+    def __init__(self, model_id):
+        self.model_id = model_id
+
+    @property
+    def model_name(self):
+        return f"{self.model_id}@{self.name}"
+
+    def load(self):
+        raise NotImplementedError
+
+class TorchBackend(EmbeddingBackend):
+    """
+    Full-precision PyTorch model.
+    """
+
+    name = "torch"
+
+    @property
+    def model_name(self):
+        # Embeddings stored before backends existed came from this backend
+        return self.model_id
+
+    def load(self):
+        from sentence_transformers import SentenceTransformer
+
+        return SentenceTransformer(self.model_id)
+
+class QuantizedBackend(EmbeddingBackend):
+    """
+    PyTorch model with its linear layers dynamically quantized to int8.
+
+    Runs on CPU only; faster and smaller than the full-precision model at
+    a small cost in accuracy.
+    """
+
+    name = "int8"
+
+    def load(self):
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        model = SentenceTransformer(self.model_id, device="cpu")
+
+        return torch.ao.quantization.quantize_dynamic(
+            model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+
+class OnnxBackend(EmbeddingBackend):
+    """
+    ONNX Runtime model. Requires sentence-transformers[onnx].
+    """
+
+    name = "onnx"
+    required_modules = ["onnxruntime", "optimum"]
+    extra = "onnx"
+
+    def load(self):
+        from sentence_transformers import SentenceTransformer
+
+        return SentenceTransformer(self.model_id, device="cpu", backend="onnx")
+
+EMBEDDING_BACKENDS = {
+    backend.name: backend
+    for backend in [TorchBackend, QuantizedBackend, OnnxBackend]
+}
+
+def get_embedding_backend(name, model_id):
+    """
+    Create the named backend for a model.
+
+    Raises ImportError if the backend's dependencies aren't installed, so a
+    misconfigured backend fails on startup rather than on first encode.
+    """
+
+    if name not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Invalid embedding backend: {name}")
+
+    backend = EMBEDDING_BACKENDS[name]
+
+    missing = [module for module in backend.required_modules
+               if importlib.util.find_spec(module) is None]
+
+    if missing:
+        raise ImportError(
+            f"The {name} embedding backend needs {', '.join(missing)}; "
+            f"install them with pip install barton-link[{backend.extra}]"
+        )
+
+    return backend(model_id)
+
+def compare_similarity_scores(reference, candidate, k=10):
+    """
+    Measure how far a backend's similarity scores are from the reference
+    backend's, for embeddings of the same texts in the same order.
+
+    Returns a dict of the mean and max absolute error of all pairwise
+    cosine similarities, the mean cosine similarity between each text's two
+    embeddings, and the fraction of each text's k nearest neighbours that
+    both backends agree on.
+    """
+
+    from .barton_link import normalize_embeddings
+
+    reference = normalize_embeddings(reference)
+    candidate = normalize_embeddings(candidate)
+
+    reference_scores = reference @ reference.T
+    candidate_scores = candidate @ candidate.T
+    errors = np.abs(reference_scores - candidate_scores)
+
+    # Nearest neighbours, leaving out each text itself
+    k = min(k, len(reference) - 1)
+    np.fill_diagonal(reference_scores, -np.inf)
+    np.fill_diagonal(candidate_scores, -np.inf)
+
+    overlap = 0
+    if k > 0:
+        reference_neighbours = np.argpartition(-reference_scores, k - 1, axis=1)[:, :k]
+        candidate_neighbours = np.argpartition(-candidate_scores, k - 1, axis=1)[:, :k]
+
+        overlap = np.mean([
+            len(np.intersect1d(a, b)) / k
+            for a, b in zip(reference_neighbours, candidate_neighbours)
+        ])
+
+    return {
+        "mean_error": float(errors.mean()),
+        "max_error": float(errors.max()),
+        "vector_similarity": float(np.mean(np.sum(reference * candidate, axis=1))),
+        "neighbour_overlap": float(overlap),
+    }
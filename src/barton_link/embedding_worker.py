@@ -0,0 +1,241 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing.connection import Client, Listener
+
+import appdirs
+import numpy as np
+
+from . import barton_link
+
+WORKER_ADDRESS = appdirs.user_cache_dir('barton-link', 'barton-link') \
+        + '/embedding_worker.sock'
+
+# Encode once this many texts are queued...
+MAX_BATCH_SIZE = 64
+
+# ...or once the oldest queued request has waited this many seconds
+MAX_WAIT = 0.01
+
+class EmbeddingModelMismatch(Exception):
+    """
+    The worker encodes with a different model or backend than the client
+    stores embeddings under.
+    """
+
+class EmbeddingWorker:
+    """
+    Encodes texts for other processes over a Unix socket.
+
+    Each connection sends {"texts": [...]} and receives {"embeddings":
+    float32 matrix, "model_name": model_name} or {"error": message}. Requests from all connections
+    are coalesced into batches of up to max_batch_size texts; a batch is
+    encoded once it is full or its first request has waited max_wait
+    seconds.
+    """
+
+    def __init__(self,
+                 address=WORKER_ADDRESS,
+                 authkey=None,
+                 encode=None,
+                 model_name=None,
+                 max_batch_size=MAX_BATCH_SIZE,
+                 max_wait=MAX_WAIT):
+        self.address = address
+        self.authkey = authkey
+        self.encode = encode or barton_link.encode_local
+        self.model_name = model_name or barton_link.EMBEDDING_MODEL_NAME
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        self.requests = queue.Queue()
+        self.listener = None
+        self.running = False
+
+        # Set once the socket is accepting connections
+        self.ready = threading.Event()
+
+    def serve_forever(self):
+        """
+        Accept connections until close() is called.
+        """
+
+        # Remove a socket left behind by a worker that didn't exit cleanly
+        if os.path.exists(self.address):
+            os.remove(self.address)
+
+        os.makedirs(os.path.dirname(self.address), exist_ok=True)
+
+        self.listener = Listener(self.address, family="AF_UNIX", authkey=self.authkey)
+        self.running = True
+
+        threading.Thread(target=self.run_batches, daemon=True).start()
+        self.ready.set()
+
+        try:
+            while self.running:
+                try:
+                    connection = self.listener.accept()
+
+                # Refused handshake or closed listener
+                except Exception:
+                    continue
+
+                threading.Thread(target=self.handle_connection,
+                                 args=(connection,),
+                                 daemon=True).start()
+
+        finally:
+            self.listener.close()
+
+    def close(self):
+        """
+        Stop serving.
+        """
+
+        if not self.running:
+            return
+
+        self.running = False
+
+        # Wake up accept() so serve_forever sees the flag
+        try:
+            Client(self.address, family="AF_UNIX", authkey=self.authkey).close()
+        except OSError:
+            pass
+
+    def handle_connection(self, connection):
+        """
+        Answer one client's requests in order until it disconnects.
+        """
+
+        with connection:
+            while self.running:
+                try:
+                    request = connection.recv()
+                except (EOFError, OSError):
+                    return
+
+                future = Future()
+                self.requests.put((list(request["texts"]), future))
+
+                try:
+                    reply = {
+                        "embeddings": future.result(),
+                        "model_name": self.model_name,
+                    }
+                except Exception as e:
+                    reply = {"error": str(e)}
+
+                try:
+                    connection.send(reply)
+                except OSError:
+                    return
+
+    def run_batches(self):
+        """
+        Collect queued requests into batches and encode them.
+        """
+
+        while self.running:
+            try:
+                batch = [self.requests.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+
+            size = len(batch[0][0])
+            deadline = time.monotonic() + self.max_wait
+
+            # Wait for more requests until the batch is full or the oldest
+            # request has used up its latency budget
+            while size < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+
+                if remaining <= 0:
+                    break
+
+                try:
+                    request = self.requests.get(timeout=remaining)
+                except queue.Empty:
+                    break
+
+                batch.append(request)
+                size += len(request[0])
+
+            self.encode_batch(batch)
+
+    def encode_batch(self, batch):
+        """
+        Encode a batch of requests at once and hand each its rows.
+        """
+
+        texts = [text for request_texts, _ in batch for text in request_texts]
+
+        try:
+            embeddings = np.asarray(self.encode(texts), dtype=np.float32)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        offset = 0
+        for request_texts, future in batch:
+            future.set_result(embeddings[offset:offset + len(request_texts)])
+            offset += len(request_texts)
+
+class EmbeddingClient:
+    """
+    Client of an EmbeddingWorker.
+
+    Each thread gets its own connection, so concurrent callers' requests
+    can be batched together by the worker. If model_name is given, replies
+    encoded under another model name are rejected.
+    """
+
+    def __init__(self, address=WORKER_ADDRESS, authkey=None, model_name=None):
+        self.address = address
+        self.authkey = authkey
+        self.model_name = model_name
+        self.local = threading.local()
+
+    def get_connection(self):
+        connection = getattr(self.local, "connection", None)
+
+        if connection is None:
+            connection = Client(self.address, family="AF_UNIX", authkey=self.authkey)
+            self.local.connection = connection
+
+        return connection
+
+    def encode(self, texts):
+        """
+        Encode a list of texts into a float32 matrix of embeddings.
+
+        Raises OSError or EOFError if the worker can't be reached, and
+        EmbeddingModelMismatch if it encodes with another model.
+        """
+
+        connection = self.get_connection()
+
+        try:
+            connection.send({"texts": list(texts)})
+            reply = connection.recv()
+
+        # Reconnect on the next call
+        except (OSError, EOFError):
+            self.local.connection = None
+            connection.close()
+            raise
+
+        if "error" in reply:
+            raise RuntimeError(f"Embedding worker failed: {reply['error']}")
+
+        if self.model_name is not None and reply.get("model_name") != self.model_name:
+            raise EmbeddingModelMismatch(
+                f"Embedding worker encodes with {reply.get('model_name')}, "
+                f"expected {self.model_name}"
+            )
+
+        return reply["embeddings"]
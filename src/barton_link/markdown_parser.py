@@ -9,14 +9,27 @@ class MarkdownParser(BaseParser):
         Parse Markdown text.
         """
 
+        # Split file_content on "\n"
+        lines = text.split("\n")
+
+        return list(self.parse_lines(lines, default_tags))
+
+    def parse_lines(self, lines, default_tags = []):
+        """
+        Parse Markdown lines, yielding each top-level excerpt (with its
+        children) as soon as it is complete.
+
+        lines can be any iterable of strings, such as a file object, so
+        large documents are never held in memory as a whole. A top-level
+        excerpt is complete once another top-level excerpt, a heading or a
+        page break follows it.
+        """
+
         self.default_tags = default_tags
 
         # Reset state
         self.reset_state()
 
-        # Split file_content on "\n"
-        lines = text.split("\n")
-
         # For each line in file_lines
         for line in lines:
             # Get indentation
@@ -36,6 +49,9 @@ class MarkdownParser(BaseParser):
                 heading = line.lstrip("#").strip()
                 heading_level = len(line) - len(heading)
 
+                # Excerpts don't nest across headings
+                self.close_excerpts()
+
                 # Update heading
                 self.update_heading(heading, heading_level)
 
@@ -43,6 +59,7 @@ class MarkdownParser(BaseParser):
             #@REVISIT
             elif line.startswith("---") or line.startswith("==="):
                 # Close heading
+                self.close_excerpts()
                 self.close_heading()
 
             # If line is not a header
@@ -67,11 +84,15 @@ class MarkdownParser(BaseParser):
 
                 self.add_excerpt(excerpt_instance, indent_level)
 
+            # Yield excerpts that can no longer change
+            yield from self.pop_finished_excerpts()
+
         # Close heading
+        self.close_excerpts()
         self.close_heading()
 
-        # Return excerpts
-        return self.state['excerpts']
+        # Yield remaining excerpts
+        yield from self.pop_finished_excerpts()
 
     def get_indent_level(self, line):
         """
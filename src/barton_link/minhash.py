@@ -0,0 +1,84 @@
+import hashlib
+import zlib
+
+import numpy as np
+
+# Characters per shingle
+SHINGLE_SIZE = 5
+
+# Hash functions per signature, split into LSH bands of equal size
+NUM_PERMUTATIONS = 64
+LSH_BANDS = 16
+
+# Prime just above 2**32, the range of the shingle hashes
+HASH_PRIME = np.uint64(4294967311)
+
+# Random (a, b) of the hash functions (a * x + b) % HASH_PRIME. Fixed
+# seed, so signatures stay comparable across processes and restarts; a and
+# b are below 2**31 so a * x can't overflow
+_rng = np.random.default_rng(0)
+PERMUTATION_A = _rng.integers(1, 2**31, size=NUM_PERMUTATIONS, dtype=np.uint64)
+PERMUTATION_B = _rng.integers(0, 2**31, size=NUM_PERMUTATIONS, dtype=np.uint64)
+
+def shingles(text, size=SHINGLE_SIZE):
+    """
+    Return the set of overlapping size-character substrings of text. Texts
+    shorter than size are a single shingle.
+    """
+
+    if len(text) <= size:
+        return {text}
+
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+def minhash_signature(text):
+    """
+    Return the MinHash signature of text's shingles, a uint64 vector of
+    NUM_PERMUTATIONS values.
+
+    The fraction of equal values in two signatures estimates the Jaccard
+    similarity of the texts' shingle sets.
+    """
+
+    hashes = np.fromiter(
+        (zlib.crc32(shingle.encode("utf-8")) for shingle in shingles(text)),
+        dtype=np.uint64,
+    )
+
+    permuted = (np.outer(PERMUTATION_A, hashes) + PERMUTATION_B[:, None]) \
+            % HASH_PRIME
+
+    return permuted.min(axis=1)
+
+def lsh_buckets(signature, bands=LSH_BANDS):
+    """
+    Return one bucket key per band of a signature, as signed 64-bit ints.
+
+    Texts that share any bucket are near-duplicate candidates. With 16 bands
+    of 4 values, texts with a Jaccard similarity of 0.7 share a bucket 99% of
+    the time, and those below 0.3 under 13% of the time.
+    """
+
+    buckets = []
+
+    for band, values in enumerate(np.split(np.asarray(signature, dtype=np.uint64), bands)):
+        digest = hashlib.blake2b(values.tobytes(),
+                                 digest_size=8,
+                                 person=band.to_bytes(16, "little")).digest()
+
+        buckets.append(int.from_bytes(digest, "little", signed=True))
+
+    return buckets
+
+def estimate_similarity(signature1, signature2):
+    """
+    Estimate the Jaccard similarity of two texts from their signatures.
+    """
+
+    return float(np.mean(np.asarray(signature1) == np.asarray(signature2)))
+
+def signature_to_blob(signature):
+    return np.asarray(signature, dtype=np.uint64).tobytes()
+
+def blob_to_signature(blob):
+    return np.frombuffer(bytes(blob), dtype=np.uint64)
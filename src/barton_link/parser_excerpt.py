@@ -14,6 +14,8 @@ class ParserExcerpt:
         indent_level (int): The indentation level indicating hierarchy
         children (list): List of child ParserExcerpt objects
         is_duplicate (bool): Flag indicating if this excerpt is a duplicate
+        near_duplicate (dict): The id, content and similarity of an existing
+            excerpt this excerpt nearly duplicates, or None
     """
 
     def __init__(self,
@@ -21,7 +23,8 @@ class ParserExcerpt:
                  metadata = None,
                  tags = None,
                  indent_level = 0,
-                 is_duplicate = False
+                 is_duplicate = False,
+                 near_duplicate = None
                  ):
         self.content = content
 
@@ -37,6 +40,7 @@ class ParserExcerpt:
         self.indent_level = indent_level
         self.original_indent_level = indent_level  # Store the original indent level for debugging
         self.is_duplicate = is_duplicate
+        self.near_duplicate = near_duplicate
 
     def __repr__(self):
         return "<Excerpt: {}>".format(self.content)
@@ -56,7 +60,8 @@ class ParserExcerpt:
             'children': [child.to_dict() for child in self.children],
             'indent_level': self.indent_level,
             'original_indent_level': getattr(self, 'original_indent_level', self.indent_level),
-            'is_duplicate': self.is_duplicate
+            'is_duplicate': self.is_duplicate,
+            'near_duplicate': self.near_duplicate
         }
 
     @staticmethod
@@ -69,7 +74,8 @@ class ParserExcerpt:
                                 metadata = data['metadata'],
                                 tags = data['tags'],
                                 indent_level = data['indent_level'],
-                                is_duplicate = data.get('is_duplicate', False)
+                                is_duplicate = data.get('is_duplicate', False),
+                                near_duplicate = data.get('near_duplicate')
                                 )
         
         # Set original_indent_level if it exists in the data
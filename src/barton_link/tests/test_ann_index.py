@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+from ..ann_index import IVFIndex, exact_search, benchmark_recall
+
+@pytest.fixture
+def clustered_vectors():
+    """Random vectors grouped around cluster centres."""
+    rng = np.random.default_rng(1)
+    centres = rng.standard_normal((20, 32))
+    vectors = centres[rng.integers(20, size=2000)] \
+            + 0.3 * rng.standard_normal((2000, 32))
+    return vectors.astype(np.float32), np.arange(1, 2001)
+
+def test_search_recall(clustered_vectors):
+    """Test that approximate search mostly agrees with exact search."""
+    vectors, ids = clustered_vectors
+    index = IVFIndex()
+    index.build(vectors, ids)
+
+    approximate_ids, _ = index.search(vectors[:200], k=10, n_probe=8)
+    exact_ids, _ = exact_search(vectors[:200], vectors, ids, k=10)
+
+    hits = sum(len(np.intersect1d(a, e)) for a, e in zip(approximate_ids, exact_ids))
+    assert hits / exact_ids.size > 0.9
+
+def test_search_all_lists_is_exact(clustered_vectors):
+    """Test that probing every list gives the exact neighbours."""
+    vectors, ids = clustered_vectors
+    index = IVFIndex()
+    index.build(vectors, ids, n_lists=10)
+
+    approximate_ids, approximate_scores = index.search(vectors[:50], k=5, n_probe=10)
+    exact_ids, exact_scores = exact_search(vectors[:50], vectors, ids, k=5)
+
+    assert np.allclose(approximate_scores, exact_scores, atol=1e-5)
+    assert approximate_ids[:, 0].tolist() == ids[:50].tolist()
+
+def test_search_pads_missing_neighbours():
+    """Test that search pads results when fewer than k vectors exist."""
+    index = IVFIndex()
+    index.build(np.eye(3), [1, 2, 3], n_lists=1)
+
+    neighbour_ids, scores = index.search(np.eye(3)[:1], k=5)
+
+    assert neighbour_ids[0, 0] == 1
+    assert neighbour_ids[0, 3:].tolist() == [-1, -1]
+    assert np.isinf(scores[0, 3:]).all()
+
+def test_add_and_remove(clustered_vectors):
+    """Test incremental insertion, replacement and removal."""
+    vectors, ids = clustered_vectors
+    index = IVFIndex()
+    index.build(vectors[:1000], ids[:1000])
+
+    index.add(vectors[1000:], ids[1000:])
+    assert len(index) == 2000
+
+    neighbour_ids, _ = index.search(vectors[1500:1501], k=1)
+    assert neighbour_ids[0, 0] == ids[1500]
+
+    # Re-adding an id replaces its vector
+    index.add(vectors[:1], ids[1500:1501])
+    assert len(index) == 2000
+    neighbour_ids, _ = index.search(vectors[:1], k=2)
+    assert set(neighbour_ids[0].tolist()) == {ids[0], ids[1500]}
+
+    index.remove([ids[0], 999999])
+    assert len(index) == 1999
+    assert ids[0] not in index
+
+def test_save_and_load(clustered_vectors, tmp_path):
+    """Test that a saved index loads with the same contents."""
+    vectors, ids = clustered_vectors
+    index = IVFIndex(n_probe=4)
+    index.build(vectors, ids)
+    index.metadata["model_name"] = "test-model"
+
+    index.save(tmp_path / "index.npz")
+    loaded = IVFIndex.load(tmp_path / "index.npz")
+
+    assert len(loaded) == len(index)
+    assert loaded.n_probe == 4
+    assert loaded.metadata == {"model_name": "test-model"}
+    assert np.array_equal(loaded.search(vectors[:20], k=5)[0],
+                          index.search(vectors[:20], k=5)[0])
+
+def test_benchmark_recall(clustered_vectors):
+    """Test that recall does not drop as more lists are probed."""
+    vectors, ids = clustered_vectors
+    report = benchmark_recall(vectors, ids, k=5, n_probes=(1, 4, 44),
+                              sample_size=100)
+
+    recalls = [result["recall"] for result in report["results"]]
+    assert recalls == sorted(recalls)
+    assert recalls[-1] == 1.0
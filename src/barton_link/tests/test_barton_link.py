@@ -0,0 +1,58 @@
+import subprocess
+import sys
+
+def test_import_does_not_load_ml_stack():
+    """Test that importing barton_link leaves the ML imports for first use."""
+    code = "import sys; import barton_link.barton_link; " \
+            "print('sentence_transformers' in sys.modules or 'torch' in sys.modules)"
+    result = subprocess.run([sys.executable, "-c", code],
+                            capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "False"
+
+def test_encode_falls_back_when_worker_is_down(monkeypatch, tmp_path):
+    """Test that encode_sbert encodes in process if the worker can't be reached."""
+    from .. import barton_link
+
+    monkeypatch.setattr(barton_link, "embedding_worker", None)
+    barton_link.use_embedding_worker(str(tmp_path / "missing.sock"))
+    monkeypatch.setattr(barton_link, "encode_local", lambda texts, batch_size=64: "local")
+
+    assert barton_link.encode_sbert(["a"]) == "local"
+
+def test_encode_falls_back_on_model_mismatch(monkeypatch):
+    """Test that encode_sbert encodes in process if the worker runs another model."""
+    from .. import barton_link
+    from ..embedding_worker import EmbeddingModelMismatch
+
+    class OtherModelWorker:
+        def encode(self, texts):
+            raise EmbeddingModelMismatch("other model")
+
+    monkeypatch.setattr(barton_link, "embedding_worker", OtherModelWorker())
+    monkeypatch.setattr(barton_link, "encode_local", lambda texts, batch_size=64: "local")
+
+    assert barton_link.encode_sbert(["a"]) == "local"
+
+def test_encode_parallel_keeps_order(monkeypatch):
+    """Test that encode_parallel reassembles shards in input order."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    import numpy as np
+    from .. import barton_link
+
+    shards = []
+
+    def encode_local(texts, batch_size=64):
+        shards.append(len(texts))
+        return np.array([[int(text)] for text in texts], dtype=np.float32)
+
+    monkeypatch.setattr(barton_link, "encode_local", encode_local)
+    monkeypatch.setattr(barton_link, "get_encode_pool",
+                        lambda workers: ThreadPoolExecutor(workers))
+
+    texts = [str(i) for i in range(1000)]
+    embeddings = barton_link.encode_parallel(texts, workers=3, batch_size=16)
+
+    assert embeddings[:, 0].tolist() == list(range(1000))
+    assert len(shards) > 3
+    assert all(size % 16 == 0 for size in shards[:-1])
@@ -0,0 +1,36 @@
+import importlib.util
+
+import numpy as np
+import pytest
+from ..embedding_backends import compare_similarity_scores, get_embedding_backend
+
+def test_backend_model_names():
+    """Test that only the reference backend keeps the plain model name."""
+    assert get_embedding_backend("torch", "model").model_name == "model"
+    assert get_embedding_backend("int8", "model").model_name == "model@int8"
+
+    with pytest.raises(ValueError):
+        get_embedding_backend("missing", "model")
+
+def test_backend_dependencies_are_checked(monkeypatch):
+    """Test that a backend with missing dependencies fails with an install hint."""
+    monkeypatch.setattr(importlib.util, "find_spec", lambda name: None)
+
+    with pytest.raises(ImportError, match=r"barton-link\[onnx\]"):
+        get_embedding_backend("onnx", "model")
+
+    assert get_embedding_backend("int8", "model").model_name == "model@int8"
+
+def test_compare_similarity_scores():
+    """Test that identical embeddings agree and noisy ones less so."""
+    rng = np.random.default_rng(0)
+    reference = rng.standard_normal((50, 16))
+
+    same = compare_similarity_scores(reference, reference * 2, k=5)
+    assert same["max_error"] < 1e-5
+    assert same["neighbour_overlap"] == 1.0
+    assert same["vector_similarity"] == pytest.approx(1.0, abs=1e-5)
+
+    noisy = compare_similarity_scores(reference, reference + rng.standard_normal((50, 16)), k=5)
+    assert noisy["mean_error"] > same["mean_error"]
+    assert noisy["neighbour_overlap"] < 1.0
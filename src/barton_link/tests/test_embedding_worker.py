@@ -0,0 +1,89 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+from ..embedding_worker import EmbeddingClient, EmbeddingModelMismatch, EmbeddingWorker
+
+def fake_encode(texts):
+    return np.array([[len(text), 1.0] for text in texts], dtype=np.float32).reshape(-1, 2)
+
+@pytest.fixture
+def worker(tmp_path):
+    """Worker serving on a temporary socket."""
+    calls = []
+
+    def encode(texts):
+        calls.append(len(texts))
+        if "fail" in texts:
+            raise ValueError("bad text")
+        return fake_encode(texts)
+
+    worker = EmbeddingWorker(address=str(tmp_path / "worker.sock"),
+                             authkey=b"test",
+                             encode=encode,
+                             model_name="test-model@int8",
+                             max_batch_size=8,
+                             max_wait=0.2)
+    worker.calls = calls
+
+    thread = threading.Thread(target=worker.serve_forever, daemon=True)
+    thread.start()
+    worker.ready.wait(5)
+
+    yield worker
+
+    worker.close()
+    thread.join(5)
+
+def test_encode(worker):
+    """Test that a client gets its own rows back as float32."""
+    client = EmbeddingClient(worker.address, b"test")
+
+    embeddings = client.encode(["a", "bbb"])
+
+    assert embeddings.dtype == np.float32
+    assert embeddings.tolist() == [[1, 1], [3, 1]]
+    assert client.encode([]).shape[0] == 0
+
+def test_concurrent_requests_are_batched(worker):
+    """Test that requests from several threads are encoded together."""
+    client = EmbeddingClient(worker.address, b"test")
+    results = {}
+
+    def encode(index):
+        results[index] = client.encode(["x" * index] * 2)
+
+    threads = [threading.Thread(target=encode, args=(index,)) for index in range(1, 5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(worker.calls) < 4
+    assert sum(worker.calls) == 8
+    for index in range(1, 5):
+        assert results[index][:, 0].tolist() == [index, index]
+
+def test_encode_errors_are_returned(worker):
+    """Test that a failed encode raises in the client and the worker keeps serving."""
+    client = EmbeddingClient(worker.address, b"test")
+
+    with pytest.raises(RuntimeError, match="bad text"):
+        client.encode(["fail"])
+
+    assert client.encode(["ok"]).tolist() == [[2, 1]]
+
+def test_unreachable_worker(tmp_path):
+    """Test that a missing worker raises OSError so callers can fall back."""
+    client = EmbeddingClient(str(tmp_path / "missing.sock"), b"test")
+
+    with pytest.raises(OSError):
+        client.encode(["a"])
+
+def test_model_mismatch_is_rejected(worker):
+    """Test that a client refuses embeddings from a worker with another model."""
+    assert EmbeddingClient(worker.address, b"test", "test-model@int8").encode(["a"]).shape == (1, 2)
+
+    with pytest.raises(EmbeddingModelMismatch, match="test-model@int8"):
+        EmbeddingClient(worker.address, b"test", "test-model").encode(["a"])
@@ -167,4 +167,53 @@ def test_tab_indentation():
     assert excerpts[1].content == "Indented with tab"
     assert excerpts[1].indent_level == 4  # tab_size = 4
     assert excerpts[2].content == "Double indented with tab"
-    assert excerpts[2].indent_level == 8  # 2 * tab_size 
\ No newline at end of file
+    assert excerpts[2].indent_level == 8  # 2 * tab_size 
+
+def test_parse_lines_yields_finished_excerpts():
+    """Test that top-level excerpts are yielded as soon as they are complete."""
+    parser = MarkdownParser()
+    consumed = []
+
+    def lines():
+        for line in ["- First", "    - Child", "- Second", "# Heading", "- Third"]:
+            consumed.append(line)
+            yield line
+
+    excerpts = parser.parse_lines(lines())
+
+    first = next(excerpts)
+    assert first.content == "First"
+    assert [child.content for child in first.children] == ["Child"]
+    assert consumed[-1] == "- Second"
+
+    second = next(excerpts)
+    assert second.content == "Second"
+    assert consumed[-1] == "# Heading"
+
+    third = next(excerpts)
+    assert third.content == "Third"
+    assert "Heading" in third.tags
+    assert list(excerpts) == []
+
+def test_parse_lines_matches_parse_text(tmp_path):
+    """Test that parsing a file object gives the same tree as parsing text."""
+    text = "# Notes\n- One\n    - Nested\n        - Deeper\n- Two\n\n---\nThree\n"
+    path = tmp_path / "notes.md"
+    path.write_text(text)
+
+    with open(path) as f:
+        streamed = [excerpt.to_dict() for excerpt in MarkdownParser().parse_lines(f)]
+
+    parsed = [excerpt.to_dict() for excerpt in MarkdownParser().parse_text(text)]
+    assert streamed == parsed
+    assert [excerpt["excerpt"] for excerpt in parsed] == ["One", "Two", "Three"]
+
+def test_new_root_closes_deeper_excerpts():
+    """Test that deeply indented excerpts attach to the latest root."""
+    parser = MarkdownParser()
+    text = "- A\n        - A1\n- B\n            - B1"
+
+    excerpts = parser.parse_text(text)
+    assert [excerpt.content for excerpt in excerpts] == ["A", "B"]
+    assert [child.content for child in excerpts[1].children] == ["B1"]
+    assert [child.content for child in excerpts[0].children] == ["A1"]
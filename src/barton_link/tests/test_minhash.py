@@ -0,0 +1,24 @@
+import pytest
+from ..minhash import (LSH_BANDS, blob_to_signature, estimate_similarity, lsh_buckets,
+                       minhash_signature, shingles, signature_to_blob)
+
+def jaccard(a, b):
+    return len(shingles(a) & shingles(b)) / len(shingles(a) | shingles(b))
+
+def test_signature_estimates_jaccard():
+    """Test that signature agreement tracks the shingle Jaccard similarity."""
+    text = "The lighthouse keeper climbed the stairs every evening at dusk."
+    edited = "The lighthouse keeper climbed the stairs each evening at dusk."
+    other = "A completely different sentence about ships in bottles."
+
+    assert estimate_similarity(minhash_signature(text), minhash_signature(edited)) \
+            == pytest.approx(jaccard(text, edited), abs=0.15)
+    assert estimate_similarity(minhash_signature(text), minhash_signature(other)) < 0.1
+
+def test_buckets_are_stable():
+    """Test that equal texts share every bucket and signatures round-trip."""
+    signature = minhash_signature("short")
+
+    assert len(lsh_buckets(signature)) == LSH_BANDS
+    assert lsh_buckets(signature) == lsh_buckets(minhash_signature("short"))
+    assert (blob_to_signature(signature_to_blob(signature)) == signature).all()
@@ -0,0 +1,22 @@
+from ..text_delta import apply_delta, make_delta
+
+def test_delta_round_trips():
+    """Test that applying a delta to the old text rebuilds the new text."""
+    old = "The lighthouse keeper climbed the stairs every evening at dusk."
+
+    for new in [
+        "The lighthouse keeper climbed the stairs each evening at dusk.",
+        "Keeper: " + old + " Then slept.",
+        "",
+        "Ünïcode ☃ text",
+    ]:
+        assert apply_delta(old, make_delta(old, new)) == new
+
+    assert apply_delta("", make_delta("", old)) == old
+
+def test_small_edit_gives_small_delta():
+    """Test that a one-word edit of a long text is stored as much less than the text."""
+    old = " ".join(f"word{i}" for i in range(500))
+    new = old.replace("word250", "changed")
+
+    assert len(make_delta(old, new)) < len(new) // 20
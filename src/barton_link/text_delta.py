@@ -0,0 +1,35 @@
+import difflib
+import json
+import zlib
+
+def make_delta(old, new):
+    """
+    Return a compressed delta that rebuilds new from old.
+
+    The delta is a list of operations: [start, end] copies old[start:end],
+    and a string is inserted as is.
+    """
+
+    operations = []
+
+    matcher = difflib.SequenceMatcher(None, old, new, autojunk=False)
+
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            operations.append([i1, i2])
+        elif j2 > j1:
+            operations.append(new[j1:j2])
+
+    return zlib.compress(json.dumps(operations, separators=(",", ":")).encode("utf-8"))
+
+def apply_delta(old, delta):
+    """
+    Rebuild the text a delta from make_delta was made for, from old.
+    """
+
+    operations = json.loads(zlib.decompress(bytes(delta)).decode("utf-8"))
+
+    return "".join(
+        old[operation[0]:operation[1]] if isinstance(operation, list) else operation
+        for operation in operations
+    )
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 class ExcerptsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'excerpts'
+
+    def ready(self):
+        from . import signals
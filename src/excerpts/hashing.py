@@ -0,0 +1,47 @@
+import hashlib
+import re
+
+# Markdown emphasis around non-space text: *a*, **a**, ~~a~~, or _a_ and
+# __a__ outside words, so snake_case is left alone
+EMPHASIS_REGEX = re.compile(r'(\*{1,3}|~~)(?=\S)(.+?)(?<=\S)\1'
+                            r'|(?<!\w)(_{1,3})(?=\S)(.+?)(?<=\S)\3(?!\w)')
+
+WHITESPACE_REGEX = re.compile(r'\s+')
+
+def content_hash(content):
+    """
+    Return the SHA-256 hex digest of an excerpt's content.
+    """
+
+    return hashlib.sha256((content or "").encode("utf-8")).hexdigest()
+
+def normalize_content(content):
+    """
+    Return content without markdown emphasis, with runs of whitespace
+    collapsed to single spaces, and casefolded.
+    """
+
+    content = content or ""
+
+    # Strip nested emphasis from the inside out
+    while True:
+        stripped = EMPHASIS_REGEX.sub(
+            lambda match: match.group(2) if match.group(1) else match.group(4),
+            content,
+        )
+
+        if stripped == content:
+            break
+
+        content = stripped
+
+    return WHITESPACE_REGEX.sub(" ", content).strip().casefold()
+
+def normalized_content_hash(content):
+    """
+    Return the SHA-256 hex digest of an excerpt's normalized content, which
+    is equal for contents that differ only in whitespace, case and
+    emphasis.
+    """
+
+    return content_hash(normalize_content(content))
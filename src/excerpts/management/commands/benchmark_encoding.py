@@ -0,0 +1,63 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from barton_link import barton_link
+from excerpts.models import Excerpt
+
+class Command(BaseCommand):
+    help = 'Measures encoding throughput across numbers of worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=str,
+            default='1,2,4',
+            help='Comma-separated worker counts to compare',
+        )
+        parser.add_argument(
+            '--texts',
+            type=int,
+            default=2000,
+            help='Number of excerpts to encode',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=64,
+            help='Texts per encode batch',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            worker_counts = [int(workers) for workers in options['workers'].split(',')]
+        except ValueError:
+            raise CommandError('--workers must be comma-separated integers')
+
+        texts = list(Excerpt.objects.order_by('id')
+                     .values_list('content', flat=True)[:options['texts']])
+
+        # Repeat excerpts up to the requested size on small databases
+        if texts:
+            texts = (texts * (options['texts'] // len(texts) + 1))[:options['texts']]
+        else:
+            texts = [f'Benchmark sentence number {i}.' for i in range(options['texts'])]
+
+        if barton_link.load_sbert() is None:
+            raise CommandError('Failed to load SentenceTransformer model.')
+
+        for workers in worker_counts:
+            # Start the pool and load its models outside the timing
+            if workers > 1:
+                barton_link.encode_parallel(texts[:options['batch_size'] * 2 * workers],
+                                            workers,
+                                            options['batch_size'])
+
+            start = time.perf_counter()
+            barton_link.encode_parallel(texts, workers, options['batch_size'])
+            seconds = time.perf_counter() - start
+
+            self.stdout.write(
+                f'workers={workers:>2}: {len(texts) / seconds:,.0f} texts/s '
+                f'({seconds:.2f}s for {len(texts)} texts)'
+            )
@@ -0,0 +1,100 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from excerpts.models import Excerpt, ExcerptAutoTag, ExcerptTag, Tag
+
+# Indexes that can be dropped to show the plans without them
+BENCHMARKED_INDEXES = [
+    'excerpt_live_root_idx',
+    'excerpt_live_normalized_idx',
+    'tag_live_name_idx',
+]
+
+class Command(BaseCommand):
+    help = 'Shows query plans and timings of hot lookups with and without their indexes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=100,
+            help='Number of times each query is timed',
+        )
+        parser.add_argument(
+            '--page-size',
+            type=int,
+            default=50,
+            help='Number of excerpts in the listing query',
+        )
+
+    def handle(self, *args, **options):
+        queries = self.hot_queries(options['page_size'])
+
+        if not queries:
+            self.stdout.write('Not enough excerpts and tags to benchmark')
+            return
+
+        before = {}
+
+        # Drop the indexes in a transaction that is rolled back afterwards
+        #@REVISIT relies on transactional DDL (SQLite, PostgreSQL)
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                for name in BENCHMARKED_INDEXES:
+                    cursor.execute(f"DROP INDEX {connection.ops.quote_name(name)}")
+
+            for label, queryset in queries.items():
+                before[label] = self.measure(queryset, options['repeat'])
+
+            transaction.set_rollback(True)
+
+        for label, queryset in queries.items():
+            after = self.measure(queryset, options['repeat'])
+
+            self.stdout.write(self.style.MIGRATE_HEADING(label))
+
+            for state, (plan, ms) in [('before', before[label]), ('after', after)]:
+                self.stdout.write(f"  {state}: {ms:.3f} ms/query")
+
+                for line in plan.splitlines():
+                    self.stdout.write(f"    {line}")
+
+    def hot_queries(self, page_size):
+        """
+        Return the benchmarked querysets by label, using values from the
+        database.
+        """
+
+        excerpt = Excerpt.objects.order_by('-id').first()
+        tag = Tag.objects.order_by('-id').first()
+
+        if excerpt is None or tag is None:
+            return {}
+
+        hashes = list(Excerpt.objects.order_by('-id')
+                      .values_list('normalized_hash', flat=True)[:page_size])
+
+        return {
+            'Root excerpt listing': Excerpt.objects.filter(is_root=True)
+                    .order_by('-id')[:page_size],
+            'Excerpt duplicate check': Excerpt.objects.filter(normalized_hash__in=hashes),
+            'Tag by name': Tag.objects.filter(name=tag.name),
+            'Excerpt tag pair': ExcerptTag.objects.filter(excerpt=excerpt, tag=tag),
+            'Excerpt autotag pair': ExcerptAutoTag.objects.filter(excerpt=excerpt, tag=tag),
+        }
+
+    def measure(self, queryset, repeat):
+        """
+        Return the query plan of a queryset and its mean time in ms.
+        """
+
+        plan = queryset.explain()
+
+        start = time.perf_counter()
+
+        for _ in range(repeat):
+            list(queryset.all())
+
+        return plan, (time.perf_counter() - start) / repeat * 1000
@@ -0,0 +1,79 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from barton_link import barton_link
+from barton_link.embedding_backends import \
+        EMBEDDING_BACKENDS,\
+        compare_similarity_scores,\
+        get_embedding_backend
+from excerpts.models import Excerpt
+
+class Command(BaseCommand):
+    help = 'Compares the speed and similarity-score accuracy of embedding backends'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--backends',
+            type=str,
+            default='torch,int8',
+            help=f'Comma-separated backends to compare ({", ".join(EMBEDDING_BACKENDS)}); '
+                 'the first is the reference',
+        )
+        parser.add_argument(
+            '--excerpts',
+            type=int,
+            default=1000,
+            help='Number of excerpts to encode',
+        )
+        parser.add_argument(
+            '--k',
+            type=int,
+            default=10,
+            help='Number of nearest neighbours compared',
+        )
+
+    def handle(self, *args, **options):
+        names = options['backends'].split(',')
+
+        texts = list(Excerpt.objects.order_by('id')
+                     .values_list('content', flat=True)[:options['excerpts']])
+
+        if len(texts) < 2:
+            raise CommandError('Not enough excerpts to compare')
+
+        reference = None
+
+        for name in names:
+            try:
+                backend = get_embedding_backend(name, barton_link.SBERT_MODEL_NAME)
+                model = backend.load()
+            except Exception as e:
+                self.stderr.write(f'{name}: failed to load ({e})')
+                continue
+
+            # Warm up outside the timing
+            model.encode(texts[:8])
+
+            start = time.perf_counter()
+            embeddings = model.encode(texts, batch_size=64, convert_to_numpy=True)
+            seconds = time.perf_counter() - start
+
+            line = f'{name:>6}: {len(texts) / seconds:,.0f} texts/s'
+
+            if reference is None:
+                reference = embeddings
+                line += ' (reference)'
+
+            else:
+                report = compare_similarity_scores(reference, embeddings, k=options['k'])
+                line += (
+                    f", score error mean {report['mean_error']:.4f}"
+                    f" max {report['max_error']:.4f}"
+                    f", vector similarity {report['vector_similarity']:.4f}"
+                    f", top-{options['k']} overlap {report['neighbour_overlap']:.3f}"
+                )
+
+            self.stdout.write(line)
+
+            del model
@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from barton_link import barton_link
+from barton_link.embedding_worker import EmbeddingWorker, MAX_BATCH_SIZE, MAX_WAIT
+
+class Command(BaseCommand):
+    help = 'Runs the embedding worker that encodes texts for the server process'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=MAX_BATCH_SIZE,
+            help='Number of texts to collect before encoding',
+        )
+        parser.add_argument(
+            '--max-wait',
+            type=float,
+            default=MAX_WAIT * 1000,
+            help='Milliseconds a request may wait for its batch to fill',
+        )
+
+    def handle(self, *args, **options):
+        # Encode in this process, never through another worker
+        barton_link.embedding_worker = None
+
+        if barton_link.load_sbert() is None:
+            raise CommandError('Failed to load SentenceTransformer model.')
+
+        worker = EmbeddingWorker(
+            address=settings.EMBEDDING_WORKER_ADDRESS,
+            authkey=settings.SECRET_KEY.encode(),
+            max_batch_size=options['batch_size'],
+            max_wait=options['max_wait'] / 1000,
+        )
+
+        self.stdout.write(f'Embedding worker listening on {worker.address}')
+
+        try:
+            worker.serve_forever()
+        except KeyboardInterrupt:
+            pass
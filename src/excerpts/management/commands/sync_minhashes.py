@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from excerpts.services import sync_minhashes
+
+class Command(BaseCommand):
+    help = 'Stores near-duplicate signatures for excerpts that are missing them or out of date'
+
+    def handle(self, *args, **options):
+        updated = sync_minhashes()
+
+        self.stdout.write(self.style.SUCCESS(f'Updated signatures of {updated} excerpts'))
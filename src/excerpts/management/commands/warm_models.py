@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from barton_link import barton_link
+from excerpts.services import get_embedding_matrix
+
+class Command(BaseCommand):
+    help = 'Loads the language models and embedding matrix, downloading the models if needed'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--skip-embeddings',
+            action='store_true',
+            help='Only load the models, not the stored excerpt embeddings',
+        )
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+
+        if barton_link.load_sbert() is None:
+            raise CommandError('Failed to load SentenceTransformer model.')
+
+        # Run one encode so lazy initialization happens here too
+        barton_link.encode_sbert(["Warm-up sentence."])
+
+        self.stdout.write(
+            f'Loaded {barton_link.EMBEDDING_MODEL_NAME} in {time.perf_counter() - start:.1f}s'
+        )
+
+        if not options['skip_embeddings']:
+            start = time.perf_counter()
+            matrix = get_embedding_matrix()
+
+            self.stdout.write(
+                f'Loaded {len(matrix)} excerpt embeddings in {time.perf_counter() - start:.1f}s'
+            )
+
+        self.stdout.write(self.style.SUCCESS('Models are ready'))
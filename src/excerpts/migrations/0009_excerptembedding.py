@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:08
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('excerpts', '0008_remove_excerpt_entities_entityrelationship_created_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExcerptEmbedding',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_name', models.TextField()),
+                ('content_hash', models.CharField(max_length=64)),
+                ('vector', models.BinaryField()),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('excerpt', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='embeddings', to='excerpts.excerpt')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='excerptembedding',
+            constraint=models.UniqueConstraint(fields=('excerpt', 'model_name'), name='unique_excerpt_embedding'),
+        ),
+    ]
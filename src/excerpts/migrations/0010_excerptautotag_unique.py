@@ -0,0 +1,36 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:17
+
+from django.db import migrations, models
+
+
+def delete_duplicate_autotags(apps, schema_editor):
+    """
+    Keep only the newest ExcerptAutoTag of each (excerpt, tag) pair.
+    """
+
+    ExcerptAutoTag = apps.get_model('excerpts', 'ExcerptAutoTag')
+
+    duplicates = ExcerptAutoTag.objects.values('excerpt_id', 'tag_id') \
+            .annotate(count=models.Count('id'), newest=models.Max('id')) \
+            .filter(count__gt=1)
+
+    for duplicate in duplicates:
+        ExcerptAutoTag.objects.filter(
+            excerpt_id=duplicate['excerpt_id'],
+            tag_id=duplicate['tag_id'],
+        ).exclude(id=duplicate['newest']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('excerpts', '0009_excerptembedding'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_autotags, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='excerptautotag',
+            constraint=models.UniqueConstraint(fields=('excerpt', 'tag'), name='unique_excerpt_autotag'),
+        ),
+    ]
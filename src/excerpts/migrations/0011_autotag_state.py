@@ -0,0 +1,42 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:18
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('excerpts', '0010_excerptautotag_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TagAutotagState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_name', models.TextField()),
+                ('name_hash', models.CharField(max_length=64)),
+                ('sequence', models.IntegerField()),
+                ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='autotag_states', to='excerpts.tag')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ExcerptAutotagState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_name', models.TextField()),
+                ('content_hash', models.CharField(max_length=64)),
+                ('tag_sequence', models.IntegerField(default=0)),
+                ('excerpt', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='autotag_states', to='excerpts.excerpt')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='tagautotagstate',
+            constraint=models.UniqueConstraint(fields=('tag', 'model_name'), name='unique_tag_autotag_state'),
+        ),
+        migrations.AddConstraint(
+            model_name='excerptautotagstate',
+            constraint=models.UniqueConstraint(fields=('excerpt', 'model_name'), name='unique_excerpt_autotag_state'),
+        ),
+    ]
@@ -0,0 +1,82 @@
+from django.db import migrations
+
+# Full-text index of excerpt content. The triggers keep it in sync with
+# every insert, update and delete, including bulk_create, queryset.update()
+# and soft deletes; soft-deleted excerpts are left out of the index.
+CREATE_FTS_SQL = [
+    """
+    CREATE VIRTUAL TABLE excerpts_excerpt_fts USING fts5(
+        content,
+        content='excerpts_excerpt',
+        content_rowid='id'
+    )
+    """,
+    """
+    CREATE TRIGGER excerpts_excerpt_fts_insert
+    AFTER INSERT ON excerpts_excerpt
+    WHEN new.is_deleted = 0
+    BEGIN
+        INSERT INTO excerpts_excerpt_fts(rowid, content)
+        VALUES (new.id, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER excerpts_excerpt_fts_delete
+    AFTER DELETE ON excerpts_excerpt
+    WHEN old.is_deleted = 0
+    BEGIN
+        INSERT INTO excerpts_excerpt_fts(excerpts_excerpt_fts, rowid, content)
+        VALUES ('delete', old.id, old.content);
+    END
+    """,
+    """
+    CREATE TRIGGER excerpts_excerpt_fts_update
+    AFTER UPDATE OF content, is_deleted ON excerpts_excerpt
+    BEGIN
+        INSERT INTO excerpts_excerpt_fts(excerpts_excerpt_fts, rowid, content)
+        SELECT 'delete', old.id, old.content WHERE old.is_deleted = 0;
+
+        INSERT INTO excerpts_excerpt_fts(rowid, content)
+        SELECT new.id, new.content WHERE new.is_deleted = 0;
+    END
+    """,
+    """
+    INSERT INTO excerpts_excerpt_fts(rowid, content)
+    SELECT id, content FROM excerpts_excerpt WHERE is_deleted = 0
+    """,
+]
+
+DROP_FTS_SQL = [
+    "DROP TRIGGER IF EXISTS excerpts_excerpt_fts_insert",
+    "DROP TRIGGER IF EXISTS excerpts_excerpt_fts_delete",
+    "DROP TRIGGER IF EXISTS excerpts_excerpt_fts_update",
+    "DROP TABLE IF EXISTS excerpts_excerpt_fts",
+]
+
+
+def create_fts_index(apps, schema_editor):
+    # FTS5 is SQLite-only; other databases fall back to icontains search
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+
+    for sql in CREATE_FTS_SQL:
+        schema_editor.execute(sql)
+
+
+def drop_fts_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+
+    for sql in DROP_FTS_SQL:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('excerpts', '0011_autotag_state'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_index, drop_fts_index),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:42
+
+from django.db import migrations, models
+
+
+def delete_duplicate_similarities(apps, schema_editor):
+    """
+    Keep only the newest ExcerptSimilarity of each (excerpt1, excerpt2) pair.
+    """
+
+    ExcerptSimilarity = apps.get_model('excerpts', 'ExcerptSimilarity')
+
+    duplicates = ExcerptSimilarity.objects.values('excerpt1_id', 'excerpt2_id') \
+            .annotate(count=models.Count('id'), newest=models.Max('id')) \
+            .filter(count__gt=1)
+
+    for duplicate in duplicates:
+        ExcerptSimilarity.objects.filter(
+            excerpt1_id=duplicate['excerpt1_id'],
+            excerpt2_id=duplicate['excerpt2_id'],
+        ).exclude(id=duplicate['newest']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('excerpts', '0012_excerpt_fts'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_similarities, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='excerptsimilarity',
+            index=models.Index(fields=['excerpt1', '-sbert_similarity'], name='excerpt_sim_excerpt1_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='excerptsimilarity',
+            index=models.Index(fields=['excerpt2', '-sbert_similarity'], name='excerpt_sim_excerpt2_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='excerptsimilarity',
+            constraint=models.UniqueConstraint(fields=('excerpt1', 'excerpt2'), name='unique_excerpt_similarity'),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:47
+
+import importlib
+
+from django.db import migrations, models
+
+fts = importlib.import_module('excerpts.migrations.0012_excerpt_fts')
+
+
+def set_root_flags(apps, schema_editor):
+    """
+    Mark excerpts with parents, i.e. those in an ExcerptRelationship's parent
+    column, as not roots.
+    """
+
+    Excerpt = apps.get_model('excerpts', 'Excerpt')
+    ExcerptRelationship = apps.get_model('excerpts', 'ExcerptRelationship')
+
+    Excerpt.objects.filter(
+        id__in=ExcerptRelationship.objects.values('parent_id')
+    ).update(is_root=False)
+
+
+def rebuild_fts_index(apps, schema_editor):
+    """
+    Recreate the full-text index, whose triggers SQLite drops when adding the
+    column rebuilds excerpts_excerpt.
+    """
+
+    fts.drop_fts_index(apps, schema_editor)
+    fts.create_fts_index(apps, schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('excerpts', '0013_excerptsimilarity_top_k'),
+    ]
+
+    operations = [
+        # Rebuild after removing the column too, when migrating backwards
+        migrations.RunPython(migrations.RunPython.noop, rebuild_fts_index),
+        migrations.AddField(
+            model_name='excerpt',
+            name='is_root',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.RunPython(set_root_flags, migrations.RunPython.noop),
+        migrations.RunPython(rebuild_fts_index, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='excerpt',
+            index=models.Index(fields=['is_root', 'is_deleted', '-id'], name='excerpt_root_idx'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:49
+
+from django.db import migrations, models
+
+
+def delete_duplicate_excerpt_tags(apps, schema_editor):
+    """
+    Keep only the oldest ExcerptTag of each (excerpt, tag) pair.
+    """
+
+    ExcerptTag = apps.get_model('excerpts', 'ExcerptTag')
+
+    duplicates = ExcerptTag.objects.values('excerpt_id', 'tag_id') \
+            .annotate(count=models.Count('id'), oldest=models.Min('id')) \
+            .filter(count__gt=1)
+
+    for duplicate in duplicates:
+        ExcerptTag.objects.filter(
+            excerpt_id=duplicate['excerpt_id'],
+            tag_id=duplicate['tag_id'],
+        ).exclude(id=duplicate['oldest']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('excerpts', '0014_excerpt_is_root'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_excerpt_tags, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='excerpt',
+            name='excerpt_root_idx',
+        ),
+        migrations.AddIndex(
+            model_name='excerpt',
+            index=models.Index(condition=models.Q(('is_deleted', False), ('is_root', True)), fields=['-id'], name='excerpt_live_root_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='excerpt',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['content'], name='excerpt_live_content_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['name'], name='tag_live_name_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='excerpttag',
+            constraint=models.UniqueConstraint(fields=('excerpt', 'tag'), name='unique_excerpt_tag'),
+        ),
+    ]
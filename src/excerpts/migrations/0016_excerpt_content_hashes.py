@@ -0,0 +1,64 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:52
+
+from django.db import migrations, models
+
+from excerpts import hashing
+
+CHUNK_SIZE = 500
+
+
+def set_content_hashes(apps, schema_editor):
+    """
+    Hash the content of every excerpt, deleted or not.
+    """
+
+    Excerpt = apps.get_model('excerpts', 'Excerpt')
+
+    excerpts = Excerpt.objects.only('id', 'content').order_by('id')
+    last_id = 0
+
+    while True:
+        chunk = list(excerpts.filter(id__gt=last_id)[:CHUNK_SIZE])
+
+        if not chunk:
+            break
+
+        for excerpt in chunk:
+            excerpt.content_hash = hashing.content_hash(excerpt.content)
+            excerpt.normalized_hash = hashing.normalized_content_hash(excerpt.content)
+
+        Excerpt.objects.bulk_update(chunk, ['content_hash', 'normalized_hash'])
+        last_id = chunk[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('excerpts', '0015_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='excerpt',
+            name='excerpt_live_content_idx',
+        ),
+        migrations.AddField(
+            model_name='excerpt',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='excerpt',
+            name='normalized_hash',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.RunPython(set_content_hashes, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='excerpt',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['content_hash'], name='excerpt_live_hash_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='excerpt',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['normalized_hash'], name='excerpt_live_normalized_idx'),
+        ),
+    ]
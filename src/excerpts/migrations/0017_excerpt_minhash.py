@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('excerpts', '0016_excerpt_content_hashes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExcerptMinHash',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64)),
+                ('signature', models.BinaryField()),
+                ('excerpt', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='minhash', to='excerpts.excerpt')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ExcerptLSHBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.BigIntegerField()),
+                ('excerpt', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lsh_buckets', to='excerpts.excerpt')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['bucket', 'excerpt'], name='excerpt_lsh_bucket_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:58
+
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('excerpts', '0017_excerpt_minhash'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='entity',
+            index=models.Index(django.db.models.functions.text.Lower('name'), condition=models.Q(('is_deleted', False)), name='entity_live_name_idx'),
+        ),
+    ]
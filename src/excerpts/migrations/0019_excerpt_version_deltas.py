@@ -0,0 +1,137 @@
+from itertools import groupby
+
+from django.db import migrations, models
+
+from barton_link import text_delta
+
+CHUNK_SIZE = 500
+
+# services.version_history.VERSION_SNAPSHOT_INTERVAL when this was written
+SNAPSHOT_INTERVAL = 10
+
+
+def excerpt_id_chunks(Excerpt):
+    """
+    Yield the ids of every excerpt, deleted or not, in chunks.
+    """
+
+    excerpt_ids = Excerpt.objects.order_by('id').values_list('id', flat=True)
+    last_id = 0
+
+    while True:
+        chunk = list(excerpt_ids.filter(id__gt=last_id)[:CHUNK_SIZE])
+
+        if not chunk:
+            break
+
+        yield chunk
+        last_id = chunk[-1]
+
+
+def compress_versions(apps, schema_editor):
+    """
+    Number the versions of each excerpt in the order they were created and
+    keep the content of every SNAPSHOT_INTERVAL-th version, storing a delta
+    for the others. Excerpts without versions get their current content as
+    version 1.
+    """
+
+    Excerpt = apps.get_model('excerpts', 'Excerpt')
+    ExcerptVersion = apps.get_model('excerpts', 'ExcerptVersion')
+
+    for chunk in excerpt_id_chunks(Excerpt):
+        versions = ExcerptVersion.objects.filter(excerpt_id__in=chunk) \
+                .order_by('excerpt_id', 'created', 'id')
+
+        updated = []
+        versioned_ids = set()
+
+        for excerpt_id, excerpt_versions in groupby(versions, lambda v: v.excerpt_id):
+            versioned_ids.add(excerpt_id)
+            previous = None
+
+            for number, version in enumerate(excerpt_versions, start=1):
+                content = version.content
+                version.number = number
+
+                if (number - 1) % SNAPSHOT_INTERVAL:
+                    version.content = None
+                    version.delta = text_delta.make_delta(previous, content)
+
+                previous = content
+                updated.append(version)
+
+        ExcerptVersion.objects.bulk_update(updated,
+                                           ['number', 'content', 'delta'],
+                                           batch_size=CHUNK_SIZE)
+
+        ExcerptVersion.objects.bulk_create(
+            [
+                ExcerptVersion(excerpt_id=excerpt.id, number=1, content=excerpt.content)
+                for excerpt in Excerpt.objects.filter(id__in=chunk).only('id', 'content')
+                if excerpt.id not in versioned_ids
+            ],
+            batch_size=CHUNK_SIZE,
+        )
+
+
+def expand_versions(apps, schema_editor):
+    """
+    Rebuild the full content of every delta version.
+    """
+
+    Excerpt = apps.get_model('excerpts', 'Excerpt')
+    ExcerptVersion = apps.get_model('excerpts', 'ExcerptVersion')
+
+    for chunk in excerpt_id_chunks(Excerpt):
+        versions = ExcerptVersion.objects.filter(excerpt_id__in=chunk) \
+                .order_by('excerpt_id', 'number')
+
+        updated = []
+
+        for _, excerpt_versions in groupby(versions, lambda v: v.excerpt_id):
+            text = ""
+
+            for version in excerpt_versions:
+                if version.content is None:
+                    version.content = text_delta.apply_delta(text, version.delta)
+                    updated.append(version)
+
+                text = version.content
+
+        ExcerptVersion.objects.bulk_update(updated, ['content'], batch_size=CHUNK_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('excerpts', '0018_entity_name_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='excerptversion',
+            name='number',
+            field=models.PositiveIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='excerptversion',
+            name='delta',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='excerptversion',
+            name='content',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.RunPython(compress_versions, expand_versions),
+        migrations.AlterField(
+            model_name='excerptversion',
+            name='number',
+            field=models.PositiveIntegerField(),
+        ),
+        migrations.AddConstraint(
+            model_name='excerptversion',
+            constraint=models.UniqueConstraint(fields=('excerpt', 'number'), name='unique_excerpt_version'),
+        ),
+    ]
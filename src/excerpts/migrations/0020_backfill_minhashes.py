@@ -0,0 +1,61 @@
+from django.db import migrations
+
+from barton_link import minhash
+from excerpts.hashing import normalize_content
+
+CHUNK_SIZE = 500
+
+
+def store_minhashes(apps, schema_editor):
+    """
+    Sign every excerpt, deleted or not, so near-duplicate checks don't have
+    to backfill signatures themselves.
+    """
+
+    Excerpt = apps.get_model('excerpts', 'Excerpt')
+    ExcerptMinHash = apps.get_model('excerpts', 'ExcerptMinHash')
+    ExcerptLSHBucket = apps.get_model('excerpts', 'ExcerptLSHBucket')
+
+    ExcerptMinHash.objects.all().delete()
+    ExcerptLSHBucket.objects.all().delete()
+
+    excerpts = Excerpt.objects.only('id', 'content', 'content_hash').order_by('id')
+    last_id = 0
+
+    while True:
+        chunk = list(excerpts.filter(id__gt=last_id)[:CHUNK_SIZE])
+
+        if not chunk:
+            break
+
+        minhashes = []
+        buckets = []
+
+        for excerpt in chunk:
+            signature = minhash.minhash_signature(normalize_content(excerpt.content))
+
+            minhashes.append(ExcerptMinHash(
+                excerpt_id=excerpt.id,
+                content_hash=excerpt.content_hash,
+                signature=minhash.signature_to_blob(signature),
+            ))
+
+            buckets += [
+                ExcerptLSHBucket(excerpt_id=excerpt.id, bucket=bucket)
+                for bucket in set(minhash.lsh_buckets(signature))
+            ]
+
+        ExcerptMinHash.objects.bulk_create(minhashes, batch_size=CHUNK_SIZE)
+        ExcerptLSHBucket.objects.bulk_create(buckets, batch_size=CHUNK_SIZE)
+        last_id = chunk[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('excerpts', '0019_excerpt_version_deltas'),
+    ]
+
+    operations = [
+        migrations.RunPython(store_minhashes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('excerpts', '0020_backfill_minhashes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='excerptembedding',
+            index=models.Index(fields=['model_name', 'updated'], name='embedding_model_updated_idx'),
+        ),
+    ]
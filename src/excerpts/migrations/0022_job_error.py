@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('excerpts', '0021_embedding_signature_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='error',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
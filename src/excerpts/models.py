@@ -1,5 +1,9 @@
 from datetime import datetime
+from django.conf import settings
 from django.db import models
+from django.db.models.functions import Lower
+
+from . import hashing
 
 class SoftDeleteManager(models.Manager):
     def get_queryset(self):
@@ -37,6 +41,14 @@ class Tag(SoftDeleteModel):
                              default=1,
                              related_name="tags")
 
+    class Meta:
+        # Tag lookups by name go through SoftDeleteManager
+        indexes = [
+            models.Index(fields=['name'],
+                         condition=models.Q(is_deleted=False),
+                         name='tag_live_name_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -127,6 +139,14 @@ class Entity(SoftDeleteModel):
                                              through='EntityExcerptRelationship',
                                              related_name='related_entities')
 
+    class Meta:
+        # Typeahead lookups by name prefix; see search_names
+        indexes = [
+            models.Index(Lower('name'),
+                         condition=models.Q(is_deleted=False),
+                         name='entity_live_name_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -135,6 +155,12 @@ class ExcerptTag(models.Model):
     tag = models.ForeignKey(Tag, on_delete=models.CASCADE)
     is_autotag = models.BooleanField(default=False)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['excerpt', 'tag'],
+                                    name='unique_excerpt_tag'),
+        ]
+
     def __str__(self):
         return f"{self.excerpt} - {self.tag}"
 
@@ -178,9 +204,34 @@ class Excerpt(SoftDeleteModel):
 
     metadata = models.TextField(null=True, blank=True)
 
+    # Hashes of the content and of its normalized form, for duplicate
+    # checks; see set_content_hashes
+    content_hash = models.CharField(max_length=64, null=True, blank=True)
+    normalized_hash = models.CharField(max_length=64, null=True, blank=True)
+
+    # Whether the excerpt has no parents; kept current by excerpts.signals
+    # and bulk imports so listings don't need to join ExcerptRelationship
+    is_root = models.BooleanField(default=True)
+
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        # Root excerpts, newest first. SQLite only searches an index on
+        # Django's bare boolean terms through a matching partial index.
+        indexes = [
+            models.Index(fields=['-id'],
+                         condition=models.Q(is_root=True, is_deleted=False),
+                         name='excerpt_live_root_idx'),
+            # Duplicate checks on import, which go through SoftDeleteManager
+            models.Index(fields=['content_hash'],
+                         condition=models.Q(is_deleted=False),
+                         name='excerpt_live_hash_idx'),
+            models.Index(fields=['normalized_hash'],
+                         condition=models.Q(is_deleted=False),
+                         name='excerpt_live_normalized_idx'),
+        ]
+
     def unused_tags(self):
         """
         Return all tags that are not associated with this excerpt.
@@ -188,26 +239,40 @@ class Excerpt(SoftDeleteModel):
 
         return Tag.objects.exclude(excerpttag__excerpt=self)
 
-    def similar_excerpts(self):
+    def similar_excerpts(self, limit=None):
         """
-        Return all ExcerptSimilarity objects that include this excerpt.
+        Return the excerpts most similar to this excerpt, most similar first,
+        as dicts of 'excerpt' and 'sbert_similarity'.
+
+        At most limit (default settings.SIMILAR_EXCERPTS_LIMIT) are returned.
+        The similarities and their excerpts are loaded in one query and
+        cached on the instance.
         """
 
-        # Retrieve all ExcerptSimilarity objects that include this excerpt
-        similarity_objects = ExcerptSimilarity.objects.filter(excerpt1=self) \
-            | ExcerptSimilarity.objects.filter(excerpt2=self)
+        if limit is None:
+            limit = settings.SIMILAR_EXCERPTS_LIMIT
+
+        if not hasattr(self, '_similar_excerpts_cache'):
+            self._similar_excerpts_cache = {}
 
-        # Order by similarity
-        similarity_objects = similarity_objects.order_by('-sbert_similarity')
+        if limit in self._similar_excerpts_cache:
+            return self._similar_excerpts_cache[limit]
+
+        # Retrieve ExcerptSimilarity objects that include this excerpt, with
+        # both excerpts joined in, leaving out deleted excerpts
+        similarity_objects = ExcerptSimilarity.objects \
+            .filter(models.Q(excerpt1_id=self.id) | models.Q(excerpt2_id=self.id)) \
+            .exclude(excerpt1__is_deleted=True) \
+            .exclude(excerpt2__is_deleted=True) \
+            .select_related('excerpt1', 'excerpt2') \
+            .order_by('-sbert_similarity')[:limit]
 
         similarities = []
 
         # For each matching similarity
         for similarity in similarity_objects:
-            excerpt = None
-
             # Add the other excerpt to the list
-            if similarity.excerpt1 == self:
+            if similarity.excerpt1_id == self.id:
                 excerpt = similarity.excerpt2
             else:
                 excerpt = similarity.excerpt1
@@ -218,26 +283,85 @@ class Excerpt(SoftDeleteModel):
                 # 'spacy_similarity': similarity.spacy_similarity
             })
 
+        self._similar_excerpts_cache[limit] = similarities
+
         return similarities
 
+    def set_content_hashes(self):
+        """
+        Compute content_hash and normalized_hash from the content. save()
+        calls this; code that bypasses save(), like bulk_create, must too.
+        """
+
+        self.content_hash = hashing.content_hash(self.content)
+        self.normalized_hash = hashing.normalized_content_hash(self.content)
+
     def save(self, *args, **kwargs):
+        previous_hash = self.content_hash
+        self.set_content_hashes()
+
+        # Read by excerpts.signals to re-sign the excerpt for near-duplicate
+        # detection
+        self._content_changed = self._state.adding \
+                or self.content_hash != previous_hash
+
+        update_fields = kwargs.get('update_fields')
+
+        # Leave is_root to excerpts.signals; this instance's copy may be stale
+        if not self._state.adding and update_fields is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'is_root'
+            ]
+
+        # Keep the hashes in step with the content
+        elif update_fields is not None and 'content' in update_fields:
+            kwargs['update_fields'] = set(update_fields) \
+                    | {'content_hash', 'normalized_hash'}
+
+        adding = self._state.adding
+
         super(Excerpt, self).save(*args, **kwargs)
 
-        # Create version if this is a new excerpt
+        # Give a new excerpt its first version; ignore_conflicts covers an
+        # "adding" save that turned out to update an existing row
         #@REVISIT placement
-        if not self.versions.exists():
-            ExcerptVersion.objects.create(excerpt=self, content=self.content)
+        if adding:
+            ExcerptVersion.objects.bulk_create(
+                [ExcerptVersion(excerpt=self, number=1, content=self.content)],
+                ignore_conflicts=True,
+            )
 
     def __str__(self):
         return self.content
 
 class ExcerptVersion(models.Model):
+    """
+    Numbered version of an excerpt's content.
+
+    A snapshot version stores its full content; the others store only a
+    compressed delta from the version before them, and are rebuilt from the
+    nearest snapshot. See services.version_history.
+    """
+
     excerpt = models.ForeignKey(Excerpt,
                                 on_delete=models.CASCADE,
                                 related_name='versions')
-    content = models.TextField()
+    number = models.PositiveIntegerField()
+    content = models.TextField(null=True, blank=True)
+    delta = models.BinaryField(null=True, blank=True)
     created = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['excerpt', 'number'],
+                                    name='unique_excerpt_version'),
+        ]
+
+    @property
+    def is_snapshot(self):
+        return self.content is not None
+
     def __str__(self):
         return f"{self.excerpt} - {self.created}"
 
@@ -252,9 +376,93 @@ class ExcerptSimilarity(models.Model):
     sbert_similarity = models.FloatField()
     # spacy_similarity = models.FloatField()
 
+    class Meta:
+        # Each pair is stored once, with excerpt1 < excerpt2
+        constraints = [
+            models.UniqueConstraint(fields=['excerpt1', 'excerpt2'],
+                                    name='unique_excerpt_similarity'),
+        ]
+
+        # Most similar excerpts first, from either side of the pair
+        indexes = [
+            models.Index(fields=['excerpt1', '-sbert_similarity'],
+                         name='excerpt_sim_excerpt1_idx'),
+            models.Index(fields=['excerpt2', '-sbert_similarity'],
+                         name='excerpt_sim_excerpt2_idx'),
+        ]
+
     def __str__(self):
         return f"{self.excerpt1} - {self.excerpt2}: {self.sbert_similarity}"
 
+class ExcerptEmbedding(models.Model):
+    """
+    Stored sentence embedding of an excerpt's content.
+
+    The vector is a raw float32 blob; content_hash records which version of
+    the content it was computed from so stale rows can be detected.
+    """
+
+    excerpt = models.ForeignKey(Excerpt,
+                                on_delete=models.CASCADE,
+                                related_name='embeddings')
+    model_name = models.TextField()
+    content_hash = models.CharField(max_length=64)
+    vector = models.BinaryField()
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['excerpt', 'model_name'],
+                                    name='unique_excerpt_embedding'),
+        ]
+
+        # Covers the (count, latest update) signature of a model's embeddings
+        indexes = [
+            models.Index(fields=['model_name', 'updated'],
+                         name='embedding_model_updated_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.excerpt} - {self.model_name}"
+
+class ExcerptMinHash(models.Model):
+    """
+    MinHash signature of an excerpt's normalized content, for near-duplicate
+    detection; see barton_link.minhash.
+
+    The signature is a raw uint64 blob; content_hash records which version
+    of the content it was computed from so stale rows can be detected.
+    """
+
+    excerpt = models.OneToOneField(Excerpt,
+                                   on_delete=models.CASCADE,
+                                   related_name='minhash')
+    content_hash = models.CharField(max_length=64)
+    signature = models.BinaryField()
+
+    def __str__(self):
+        return f"{self.excerpt}"
+
+class ExcerptLSHBucket(models.Model):
+    """
+    One LSH band bucket of an ExcerptMinHash signature. Excerpts sharing a
+    bucket are near-duplicate candidates.
+    """
+
+    excerpt = models.ForeignKey(Excerpt,
+                                on_delete=models.CASCADE,
+                                related_name='lsh_buckets')
+    bucket = models.BigIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['bucket', 'excerpt'],
+                         name='excerpt_lsh_bucket_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.excerpt} - {self.bucket}"
+
 class ExcerptAutoTag(models.Model):
     excerpt = models.ForeignKey(Excerpt,
                                 on_delete=models.CASCADE,
@@ -262,9 +470,64 @@ class ExcerptAutoTag(models.Model):
     tag = models.ForeignKey(Tag, on_delete=models.CASCADE)
     sbert_similarity = models.FloatField()
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['excerpt', 'tag'],
+                                    name='unique_excerpt_autotag'),
+        ]
+
     def __str__(self):
         return f"{self.excerpt} - {self.tag}: {self.sbert_similarity}"
 
+class TagAutotagState(models.Model):
+    """
+    Autotag bookkeeping for a tag under one embedding model.
+
+    sequence increases whenever the tag is added or renamed; excerpts have
+    been scored against every tag whose sequence is at most their
+    ExcerptAutotagState.tag_sequence.
+    """
+
+    tag = models.ForeignKey(Tag,
+                            on_delete=models.CASCADE,
+                            related_name='autotag_states')
+    model_name = models.TextField()
+    name_hash = models.CharField(max_length=64)
+    sequence = models.IntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['tag', 'model_name'],
+                                    name='unique_tag_autotag_state'),
+        ]
+
+    def __str__(self):
+        return f"{self.tag} - {self.model_name}: {self.sequence}"
+
+class ExcerptAutotagState(models.Model):
+    """
+    Autotag bookkeeping for an excerpt under one embedding model.
+
+    content_hash records the content that was scored, and tag_sequence the
+    highest TagAutotagState.sequence it was scored against.
+    """
+
+    excerpt = models.ForeignKey(Excerpt,
+                                on_delete=models.CASCADE,
+                                related_name='autotag_states')
+    model_name = models.TextField()
+    content_hash = models.CharField(max_length=64)
+    tag_sequence = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['excerpt', 'model_name'],
+                                    name='unique_excerpt_autotag_state'),
+        ]
+
+    def __str__(self):
+        return f"{self.excerpt} - {self.model_name}: {self.tag_sequence}"
+
 class Concept(models.Model):
     # name = models.TextField()
     description = models.TextField()
@@ -284,6 +547,9 @@ class Job(models.Model):
     subprogress = models.IntegerField(default=0)
     total = models.IntegerField(default=0)
 
+    # Message of the exception that stopped the job, if it failed
+    error = models.TextField(blank=True, default="")
+
     def __str__(self):
         return self.name
 
@@ -0,0 +1,154 @@
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db.models import QuerySet
+
+class KeysetPage:
+    """
+    Page of a queryset ordered by -id, found from a cursor id rather than an
+    offset.
+
+    Provides the parts of Django's Page that excerpt lists use. There is no
+    page number or total count; next_cursor and previous_cursor are the ids
+    to pass as after and before for the neighbouring pages, and after and
+    before are the cursors that found this page.
+    """
+
+    paginator = None
+
+    def __init__(self, object_list, has_next, has_previous, after=None, before=None):
+        self.object_list = object_list
+        self._has_next = has_next
+        self._has_previous = has_previous
+        self.after = after
+        self.before = before
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next and bool(self.object_list)
+
+    def has_previous(self):
+        return self._has_previous and bool(self.object_list)
+
+    @property
+    def next_cursor(self):
+        return self.object_list[-1].id
+
+    @property
+    def previous_cursor(self):
+        return self.object_list[0].id
+
+def supports_keyset(queryset):
+    """
+    Whether a queryset can be keyset paginated, i.e. it is ordered by -id
+    only.
+    """
+
+    return isinstance(queryset, QuerySet) \
+            and tuple(queryset.query.order_by) == ("-id",) \
+            and not queryset.query.extra_order_by
+
+def keyset_paginate(queryset, page_size, after=None, before=None):
+    """
+    Return the KeysetPage of page_size items of queryset, ordered by -id,
+    that follow the id after, or precede the id before. Without a cursor,
+    returns the first page.
+
+    Each page is one indexed range query; no COUNT and no OFFSET.
+    """
+
+    if before is not None:
+        # Walk backwards from the cursor, then restore the -id order
+        rows = list(queryset.filter(id__gt=before).order_by("id")[:page_size + 1])
+
+        has_previous = len(rows) > page_size
+        object_list = rows[:page_size][::-1]
+
+        # The cursor's excerpt may have been deleted or filtered out since,
+        # so check for older items rather than assuming it is one
+        has_next = bool(object_list) \
+                and queryset.filter(id__lt=object_list[-1].id).exists()
+
+        return KeysetPage(object_list,
+                          has_next=has_next,
+                          has_previous=has_previous,
+                          before=before)
+
+    if after is not None:
+        queryset = queryset.filter(id__lt=after)
+
+    rows = list(queryset.order_by("-id")[:page_size + 1])
+
+    return KeysetPage(rows[:page_size],
+                      has_next=len(rows) > page_size,
+                      has_previous=after is not None,
+                      after=after)
+
+def paginate(request, items, page_size, url, link_params={}):
+    """
+    Paginate items for a list view.
+
+    Keyset pagination is used when it is enabled by the KEYSET_PAGINATION
+    setting or the request has an after or before cursor, and items is a
+    queryset ordered by -id; otherwise Django's Paginator is used.
+
+    Returns (page_obj, prev_page_url, next_page_url). The page links keep
+    link_params.
+    """
+
+    page_size = int(page_size)
+
+    after = request.GET.get("after", "")
+    before = request.GET.get("before", "")
+
+    use_keyset = (settings.KEYSET_PAGINATION or after or before) \
+            and supports_keyset(items)
+
+    prev_page_url = None
+    next_page_url = None
+
+    if use_keyset:
+        page_obj = keyset_paginate(items,
+                                   page_size,
+                                   after=int(after) if after.isdigit() else None,
+                                   before=int(before) if before.isdigit() else None)
+
+        if page_obj.has_previous():
+            prev_page_url = url + "?" + urlencode({
+                "before": page_obj.previous_cursor,
+                **link_params,
+            })
+
+        if page_obj.has_next():
+            next_page_url = url + "?" + urlencode({
+                "after": page_obj.next_cursor,
+                **link_params,
+            })
+
+        return page_obj, prev_page_url, next_page_url
+
+    paginator = Paginator(items, page_size)
+    page_obj = paginator.get_page(request.GET.get("page", 1))
+
+    if page_obj.has_previous():
+        prev_page_url = url + "?" + urlencode({
+            "page": page_obj.previous_page_number(),
+            **link_params,
+        })
+
+    if page_obj.has_next():
+        next_page_url = url + "?" + urlencode({
+            "page": page_obj.next_page_number(),
+            **link_params,
+        })
+
+    return page_obj, prev_page_url, next_page_url
@@ -1,2 +1,8 @@
 from .similarity_analysis import *
 from .autotag import *
+from .embedding_store import *
+from .similarity_index import *
+from .import_service import *
+from .search_index import *
+from .semantic_index import *
+from .near_duplicates import *
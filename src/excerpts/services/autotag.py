@@ -1,26 +1,60 @@
+from django.db.models import F
+
 from barton_link import barton_link
 
+from ..hashing import content_hash
 from ..models import Excerpt,\
     ExcerptAutoTag,\
+    ExcerptAutotagState,\
     Tag,\
+    TagAutotagState,\
     Job
 
+import numpy as np
+
 from .service import Service
+from .embedding_store import get_excerpt_embeddings, LOOKUP_CHUNK_SIZE
+
+# Number of excerpts whose embeddings are loaded at a time
+EXCERPT_CHUNK_SIZE = 256
+
+# Excerpt-tag pairs with an absolute similarity below this are not stored
+AUTOTAG_THRESHOLD = 0.5
 
 class AutotagService(Service):
     """
     Service for autotagging excerpts.
+
+    Engines:
+        per_excerpt: score one excerpt against every tag at a time.
+        batched: score chunks of excerpts as a matrix, only against the tags
+            they have not been scored against yet.
     """
 
-    def __init__(self):
+    engines = ["per_excerpt", "batched"]
+
+    def __init__(self, engine="per_excerpt"):
         super().__init__("autotag")
+        self.engine = engine
 
     def run(self):
+        """
+        Autotag excerpts using the selected engine.
+        """
+
+        if self.engine == "batched":
+            self.run_batched()
+        else:
+            self.run_per_excerpt()
+
+        self.running = False
+
+    def run_per_excerpt(self):
         job = self.get_job()
 
         if job == None:
             job = Job.objects.create(
-                name="autotag",
+                name=self.job_name,
                 total=Excerpt.objects.count(),
             )
 
@@ -54,11 +88,14 @@ class AutotagService(Service):
         tags = Tag.objects.all()
         tag_names = [tag.name for tag in tags]
 
+        # Encode tag names once for the whole run
+        tag_embeddings = barton_link.encode_sbert(tag_names)
+
         # Semantically compare excerpts to tags
         print(f"Comparing {len(excerpts)} excerpts to {len(tags)} tags...")
         # scores = barton_link.compare_lists_sbert(excerpt_texts, tag_names)
 
-        for excerpt in excerpts:
+        for excerpt, excerpt_embedding in self.iter_embeddings(excerpts):
             # autotag_obj = {
             #     "excerpt": excerpt,
             #     "tag_scores": [],
@@ -69,9 +106,9 @@ class AutotagService(Service):
             job.save()
 
             # Measure similarities between excerpt and tags
-            #@TODO only score unscored tags
-            tag_scores = barton_link.compare_lists_sbert([excerpt.content],
-                                                         tag_names)
+            #@REVISIT the batched engine only scores unscored tags
+            tag_scores = barton_link.compare_embeddings(excerpt_embedding,
+                                                        tag_embeddings)
 
             for j, tag in enumerate(tags):
                 # If service is no longer running
@@ -87,7 +124,7 @@ class AutotagService(Service):
 
                 # If score exceeds threshold
                 #@REVISIT do we want negative scores?
-                if sbert_score >= 0.5 or sbert_score <= -0.5:
+                if abs(sbert_score) >= AUTOTAG_THRESHOLD:
                     print(f"Excerpt {excerpt.id} is similar to tag {tag.id} " \
                             + f"with score {sbert_score}")
 
@@ -112,3 +149,232 @@ class AutotagService(Service):
                             sbert_similarity=sbert_score,
                         )
                         autotag.save()
+
+    def run_batched(self):
+        """
+        Autotag excerpts by scoring chunks of excerpts against tags.
+
+        Only missing (excerpt, tag) scores are computed: each excerpt is
+        scored against the tags added or renamed since it was last scored.
+        Excerpts whose content changed, and tags whose name changed, have
+        their autotags deleted first. Each chunk of EXCERPT_CHUNK_SIZE
+        excerpt embeddings is compared to the tags with matrix products and
+        the pairs above the threshold are upserted together. Job.progress
+        counts excerpts scored this run and Job.subprogress is the id of the
+        last one.
+        """
+
+        print("Running batched autotag...")
+
+        model_name = barton_link.EMBEDDING_MODEL_NAME
+
+        # Get all existing tags and their autotag sequence numbers
+        tags = list(Tag.objects.order_by("id"))
+        tag_ids = np.array([tag.id for tag in tags])
+        tag_sequences = np.array(self.sync_tag_states(tags, model_name))
+        max_sequence = int(tag_sequences.max()) if tags else 0
+
+        self.invalidate_changed_excerpts(model_name)
+
+        # Excerpts not yet scored against every tag
+        pending = Excerpt.objects.exclude(
+            id__in=ExcerptAutotagState.objects.filter(
+                model_name=model_name,
+                tag_sequence__gte=max_sequence,
+            ).values("excerpt_id")
+        ).order_by("id")
+
+        job = self.get_job()
+
+        if job == None:
+            job = Job.objects.create(name=self.job_name)
+
+        job.progress = 0
+        job.subprogress = 0
+        job.total = pending.count() if tags else 0
+        job.save()
+
+        if not tags:
+            return
+
+        # Tag embeddings, encoded the first time a tag is needed
+        tag_embeddings = np.zeros((len(tags), 0), dtype=np.float32)
+        encoded = np.zeros(len(tags), dtype=bool)
+
+        autotags_stored = 0
+
+        while True:
+            # If service is no longer running
+            if self.running == False:
+                return
+
+            # Load the next chunk of pending excerpts
+            excerpts = list(pending.filter(id__gt=job.subprogress)
+                            .only("id", "content", "content_hash")[:EXCERPT_CHUNK_SIZE])
+
+            if not excerpts:
+                break
+
+            watermarks = dict(ExcerptAutotagState.objects.filter(
+                model_name=model_name,
+                excerpt_id__in=[excerpt.id for excerpt in excerpts],
+            ).values_list("excerpt_id", "tag_sequence"))
+
+            excerpt_embeddings = barton_link.normalize_embeddings(
+                get_excerpt_embeddings(excerpts, workers=self.workers)
+            )
+
+            autotags = []
+
+            # Score excerpts with the same watermark against the same tags
+            row_watermarks = np.array([watermarks.get(excerpt.id, 0)
+                                       for excerpt in excerpts])
+
+            for watermark in np.unique(row_watermarks):
+                rows = np.nonzero(row_watermarks == watermark)[0]
+                columns = np.nonzero(tag_sequences > watermark)[0]
+
+                # Encode tag names not needed by earlier chunks
+                missing = columns[~encoded[columns]]
+                if len(missing):
+                    embeddings = barton_link.normalize_embeddings(
+                        barton_link.encode_sbert([tags[i].name for i in missing])
+                    )
+
+                    if tag_embeddings.shape[1] == 0:
+                        tag_embeddings = np.zeros((len(tags), embeddings.shape[1]),
+                                                  dtype=np.float32)
+
+                    tag_embeddings[missing] = embeddings
+                    encoded[missing] = True
+
+                scores = excerpt_embeddings[rows] @ tag_embeddings[columns].T
+
+                #@REVISIT do we want negative scores?
+                hit_rows, hit_columns = np.nonzero(np.abs(scores) >= AUTOTAG_THRESHOLD)
+
+                autotags += [
+                    ExcerptAutoTag(
+                        excerpt_id=excerpts[rows[row]].id,
+                        tag_id=int(tag_ids[columns[column]]),
+                        sbert_similarity=float(scores[row, column]),
+                    )
+                    for row, column in zip(hit_rows, hit_columns)
+                ]
+
+            # Insert new autotags and update the scores of existing ones
+            ExcerptAutoTag.objects.bulk_create(
+                autotags,
+                batch_size=LOOKUP_CHUNK_SIZE,
+                update_conflicts=True,
+                unique_fields=["excerpt", "tag"],
+                update_fields=["sbert_similarity"],
+            )
+
+            # Record that the chunk has been scored against every tag
+            ExcerptAutotagState.objects.bulk_create(
+                [
+                    ExcerptAutotagState(
+                        excerpt_id=excerpt.id,
+                        model_name=model_name,
+                        content_hash=excerpt.content_hash,
+                        tag_sequence=max_sequence,
+                    )
+                    for excerpt in excerpts
+                ],
+                batch_size=LOOKUP_CHUNK_SIZE,
+                update_conflicts=True,
+                unique_fields=["excerpt", "model_name"],
+                update_fields=["content_hash", "tag_sequence"],
+            )
+
+            autotags_stored += len(autotags)
+
+            # Update job progress
+            job.progress += len(excerpts)
+            job.subprogress = excerpts[-1].id
+            job.save()
+
+            print(f"Scored {job.progress} of {job.total} excerpts " \
+                    + f"(autotags stored: {autotags_stored})")
+
+    def sync_tag_states(self, tags, model_name):
+        """
+        Give new and renamed tags a new autotag sequence number.
+
+        The autotags of renamed tags are deleted. Returns the sequence
+        number of each tag, in order.
+        """
+
+        states = {
+            state.tag_id: state
+            for state in TagAutotagState.objects.filter(model_name=model_name)
+        }
+
+        # New and renamed tags in this run share a sequence number
+        next_sequence = max((state.sequence for state in states.values()),
+                            default=0) + 1
+
+        sequences = []
+
+        for tag in tags:
+            name_hash = content_hash(tag.name)
+            state = states.get(tag.id)
+
+            if state is None:
+                state = TagAutotagState.objects.create(
+                    tag=tag,
+                    model_name=model_name,
+                    name_hash=name_hash,
+                    sequence=next_sequence,
+                )
+
+            # If the tag was renamed, its old scores no longer apply
+            elif state.name_hash != name_hash:
+                print(f"Tag {tag.id} was renamed; rescoring it...")
+
+                ExcerptAutoTag.objects.filter(tag=tag).delete()
+
+                state.name_hash = name_hash
+                state.sequence = next_sequence
+                state.save()
+
+            sequences.append(state.sequence)
+
+        return sequences
+
+    def invalidate_changed_excerpts(self, model_name):
+        """
+        Delete the autotags and autotag state of excerpts whose content
+        changed since they were scored.
+        """
+
+        # Compare against the hash stored on the excerpt, so no content is
+        # loaded or hashed
+        changed_ids = list(ExcerptAutotagState.objects
+                           .filter(model_name=model_name)
+                           .exclude(content_hash=F("excerpt__content_hash"))
+                           .values_list("excerpt_id", flat=True))
+
+        if changed_ids:
+            print(f"{len(changed_ids)} excerpts were edited; rescoring them...")
+
+        for i in range(0, len(changed_ids), LOOKUP_CHUNK_SIZE):
+            chunk = changed_ids[i:i + LOOKUP_CHUNK_SIZE]
+
+            ExcerptAutoTag.objects.filter(excerpt_id__in=chunk).delete()
+            ExcerptAutotagState.objects.filter(
+                model_name=model_name,
+                excerpt_id__in=chunk,
+            ).delete()
+
+    def iter_embeddings(self, excerpts):
+        """
+        Yield (excerpt, embedding) pairs, loading stored embeddings in chunks.
+        """
+
+        excerpts = list(excerpts)
+
+        for i in range(0, len(excerpts), EXCERPT_CHUNK_SIZE):
+            chunk = excerpts[i:i + EXCERPT_CHUNK_SIZE]
+            yield from zip(chunk, get_excerpt_embeddings(chunk, workers=self.workers))
@@ -0,0 +1,142 @@
+import numpy as np
+
+from barton_link import barton_link
+
+from ..models import ExcerptEmbedding
+
+# Keep IN (...) lookups below SQLite's bound parameter limit
+LOOKUP_CHUNK_SIZE = 500
+
+# Number of texts handed to the model per encode call
+ENCODE_BATCH_SIZE = 256
+
+# Bumped when this process writes embeddings, or changes which excerpts are
+# deleted or have parents, so embedding matrices refresh without waiting for
+# their next periodic check; see semantic_index.EmbeddingMatrix.refresh
+embeddings_version = 0
+excerpt_flags_version = 0
+
+def invalidate_embeddings():
+    global embeddings_version
+    embeddings_version += 1
+
+def invalidate_excerpt_flags():
+    global excerpt_flags_version
+    excerpt_flags_version += 1
+
+def vector_to_blob(vector):
+    """
+    Serialize an embedding vector for ExcerptEmbedding.vector.
+    """
+
+    return np.asarray(vector, dtype=np.float32).tobytes()
+
+def blob_to_vector(blob):
+    """
+    Deserialize an ExcerptEmbedding.vector blob.
+    """
+
+    return np.frombuffer(bytes(blob), dtype=np.float32)
+
+def get_stored_embeddings(excerpt_ids, model_name=barton_link.EMBEDDING_MODEL_NAME):
+    """
+    Return a dict mapping excerpt id to (content_hash, vector) for every
+    stored embedding of the given excerpts.
+    """
+
+    excerpt_ids = list(excerpt_ids)
+    stored = {}
+
+    for i in range(0, len(excerpt_ids), LOOKUP_CHUNK_SIZE):
+        rows = ExcerptEmbedding.objects.filter(
+            excerpt_id__in=excerpt_ids[i:i + LOOKUP_CHUNK_SIZE],
+            model_name=model_name,
+        ).values_list("excerpt_id", "content_hash", "vector")
+
+        for excerpt_id, stored_hash, vector in rows:
+            stored[excerpt_id] = (stored_hash, blob_to_vector(vector))
+
+    return stored
+
+def store_embeddings(excerpts,
+                     embeddings,
+                     model_name=barton_link.EMBEDDING_MODEL_NAME):
+    """
+    Insert or replace the stored embeddings of excerpts.
+    """
+
+    entries = [
+        ExcerptEmbedding(
+            excerpt_id=excerpt.id,
+            model_name=model_name,
+            content_hash=excerpt.content_hash,
+            vector=vector_to_blob(vector),
+        )
+        for excerpt, vector in zip(excerpts, embeddings)
+    ]
+
+    ExcerptEmbedding.objects.bulk_create(
+        entries,
+        batch_size=LOOKUP_CHUNK_SIZE,
+        update_conflicts=True,
+        unique_fields=["excerpt", "model_name"],
+        update_fields=["content_hash", "vector", "updated"],
+    )
+
+    invalidate_embeddings()
+
+def get_excerpt_embeddings(excerpts,
+                           model_name=barton_link.EMBEDDING_MODEL_NAME,
+                           workers=1):
+    """
+    Return a float32 matrix with one embedding row per excerpt, in order.
+
+    Embeddings are read from the ExcerptEmbedding table. Excerpts without a
+    stored embedding, or whose content has changed since it was computed,
+    are encoded in batches and written back to the table. With workers > 1
+    each batch is encoded across that many processes.
+    """
+
+    excerpts = list(excerpts)
+    stored = get_stored_embeddings([excerpt.id for excerpt in excerpts],
+                                   model_name)
+
+    vectors = [None] * len(excerpts)
+    missing = []
+
+    # Use stored embeddings whose content hash still matches
+    for index, excerpt in enumerate(excerpts):
+        entry = stored.get(excerpt.id)
+
+        if entry and entry[0] == excerpt.content_hash:
+            vectors[index] = entry[1]
+        else:
+            missing.append(index)
+
+    # Give each worker a full batch
+    batch_size = ENCODE_BATCH_SIZE * max(1, workers)
+
+    # Encode and store the rest
+    for i in range(0, len(missing), batch_size):
+        batch = missing[i:i + batch_size]
+        batch_excerpts = [excerpts[index] for index in batch]
+
+        print(f"Encoding {len(batch)} excerpts " \
+                + f"({i + len(batch)} of {len(missing)} missing)...")
+
+        texts = [excerpt.content for excerpt in batch_excerpts]
+
+        if workers > 1:
+            embeddings = barton_link.encode_parallel(texts, workers)
+        else:
+            embeddings = barton_link.encode_sbert(texts)
+
+        store_embeddings(batch_excerpts, embeddings, model_name)
+
+        for index, vector in zip(batch, embeddings):
+            vectors[index] = vector
+
+    if not vectors:
+        return np.zeros((0, 0), dtype=np.float32)
+
+    return np.vstack(vectors).astype(np.float32, copy=False)
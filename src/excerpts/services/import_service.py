@@ -0,0 +1,553 @@
+import json
+import os
+import shutil
+import time
+import uuid
+from itertools import islice
+
+import appdirs
+
+from barton_link.markdown_parser import MarkdownParser
+from barton_link.parser_excerpt import ParserExcerpt
+
+from ..hashing import normalized_content_hash
+from ..models import Job
+
+from .service import Service
+from .similarity_index import index_new_excerpts_in_background
+
+IMPORT_DIR = appdirs.user_cache_dir('barton-link', 'barton-link') + '/imports'
+
+# Number of top-level excerpts checked for duplicates together when
+# previewing, and written per transaction when confirming
+IMPORT_CHUNK_SIZE = 100
+
+# Seconds after its last change that an import is deleted, if it was
+# never confirmed or cancelled
+IMPORT_MAX_AGE = 7 * 24 * 60 * 60
+
+# Running import services by import id, so progress can be polled across
+# requests; the rest are reloaded from their directories when needed
+import_services = {}
+
+class ImportService(Service):
+    """
+    Service for importing excerpts in the background.
+
+    An import runs in two stages. The preview stage parses each source and
+    checks the excerpts for duplicates in chunks; the confirm stage writes
+    each chunk to the database. Sources and the results of each chunk are
+    kept in the import's directory, so a stopped import can be resumed, even
+    after a restart. The directory and Jobs are deleted once the import is
+    confirmed or cancelled.
+
+    Sources:
+        markdown: a Markdown file saved in the import's directory.
+        gdocs: a Google Docs document id.
+    """
+
+    stages = ["preview", "confirm"]
+
+    # Whether to delete the import when its thread exits
+    cancelled = False
+
+    def __init__(self, import_id):
+        super().__init__(f"import_{import_id}")
+        self.import_id = import_id
+        self.directory = f"{IMPORT_DIR}/{import_id}"
+
+        self.manifest = {
+            "stage": "preview",
+            "sources": [],
+            "create_tags": [],
+            "chunks": [],
+        }
+
+        # Load the manifest of an existing import
+        if os.path.exists(self.path("manifest.json")):
+            self.manifest = self.read_json("manifest.json")
+
+    @property
+    def stage(self):
+        return self.manifest["stage"]
+
+    @property
+    def job_name(self):
+        # Each stage counts progress differently, so each gets its own Job
+        return f"{self.name}_{self.stage}"
+
+    def path(self, filename):
+        return f"{self.directory}/{filename}"
+
+    def read_json(self, filename):
+        with open(self.path(filename), "r") as f:
+            return json.load(f)
+
+    def write_json(self, filename, data):
+        """
+        Write data as JSON, replacing the file atomically.
+        """
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        with open(self.path(filename + ".tmp"), "w") as f:
+            json.dump(data, f)
+
+        os.replace(self.path(filename + ".tmp"), self.path(filename))
+
+    def save_manifest(self):
+        self.write_json("manifest.json", self.manifest)
+
+    def add_text_source(self, text, tags = []):
+        """
+        Add pasted Markdown text to the import.
+        """
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        filename = f"source_{len(self.manifest['sources'])}.md"
+        with open(self.path(filename), "w", encoding="utf-8") as f:
+            f.write(text)
+
+        self.manifest["sources"].append({
+            "type": "markdown",
+            "filename": filename,
+            "tags": list(tags),
+        })
+        self.save_manifest()
+
+    def add_file_source(self, file, tags = []):
+        """
+        Add an uploaded Markdown file to the import.
+        """
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        # Copy the upload chunk by chunk rather than reading it whole
+        filename = f"source_{len(self.manifest['sources'])}.md"
+        with open(self.path(filename), "wb") as f:
+            for chunk in file.chunks():
+                f.write(chunk)
+
+        self.manifest["sources"].append({
+            "type": "markdown",
+            "filename": filename,
+            "name": file.name,
+            "tags": list(tags),
+        })
+        self.save_manifest()
+
+    def add_gdocs_source(self, document_id, tags = []):
+        """
+        Add a Google Docs document to the import.
+        """
+
+        self.manifest["sources"].append({
+            "type": "gdocs",
+            "document_id": document_id,
+            "tags": list(tags),
+        })
+        self.save_manifest()
+
+    def confirm(self, create_tags):
+        """
+        Move the import to the confirm stage, creating only the given new
+        tags. Does nothing until the preview is finished.
+        """
+
+        if self.stage != "preview" or not self.is_finished() or self.running:
+            return
+
+        self.manifest["stage"] = "confirm"
+        self.manifest["create_tags"] = list(create_tags)
+        self.save_manifest()
+
+    def is_finished(self):
+        """
+        Whether the current stage has finished.
+        """
+
+        job = self.get_job()
+        return bool(job and job.description == "finished")
+
+    def get_status(self):
+        status = super().get_status()
+        status["import_id"] = self.import_id
+        status["stage"] = self.stage
+        status["finished"] = self.is_finished()
+        status["error"] = status["job"].error if status["job"] else ""
+        return status
+
+    def start(self):
+        """
+        Start the current stage, registering the import while it runs.
+
+        Does nothing while the thread of a stopped run is still finishing
+        its chunk, so two runs never write the same import.
+        """
+
+        if self.running or self.is_alive():
+            return
+
+        import_services[self.import_id] = self
+        super().start()
+
+    def cancel(self):
+        """
+        Stop the import and delete it, once its thread has exited.
+        """
+
+        self.cancelled = True
+        self.stop()
+
+        if not self.is_alive():
+            self.delete()
+
+    def delete(self):
+        """
+        Delete the import's directory and Jobs.
+        """
+
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+        Job.objects.filter(name__in=[f"{self.name}_{stage}"
+                                     for stage in self.stages]).delete()
+
+    def run(self):
+        """
+        Run the current stage of the import, recording an error on its Job
+        if it fails.
+        """
+
+        # Clear the error of a failed run being resumed
+        Job.objects.filter(name=self.job_name, description="failed") \
+                .update(description="", error="")
+
+        try:
+            if self.stage == "confirm":
+                self.run_confirm()
+            else:
+                self.run_preview()
+
+        except Exception as e:
+            print(f"Import {self.import_id} failed: {e!r}")
+
+            Job.objects.update_or_create(name=self.job_name, defaults={
+                "description": "failed",
+                "error": str(e) or type(e).__name__,
+            })
+
+        # Finished, stopped or failed; its state is in its directory and Job
+        finally:
+            self.running = False
+
+            if import_services.get(self.import_id) is self:
+                del import_services[self.import_id]
+
+            if self.cancelled:
+                self.delete()
+
+    def run_preview(self):
+        """
+        Parse each source, checking its excerpts for duplicates in chunks.
+
+        Each chunk of IMPORT_CHUNK_SIZE top-level excerpts is checked
+        against the database and the chunks before it as soon as it is
+        parsed, and its preview saved as preview_<number>.json.
+        Job.progress is the number of sources parsed and Job.subprogress the
+        number of top-level excerpts checked so far.
+        """
+
+        sources = self.manifest["sources"]
+        chunks = self.manifest["chunks"]
+
+        job = self.get_job()
+
+        if job == None:
+            job = Job.objects.create(name=self.job_name, total=len(sources))
+
+        # Don't count excerpts of a chunk that was stopped part way
+        job.subprogress = sum(chunk["parsed"] for chunk in chunks)
+
+        seen_hashes = self.checked_hashes()
+
+        for index in range(job.progress, len(sources)):
+            # Skip the excerpts of chunks checked before a stop
+            skipped = sum(chunk["parsed"] for chunk in chunks
+                          if chunk["source"] == index)
+
+            parser_excerpts = islice(self.parse_source(sources[index]), skipped, None)
+
+            while True:
+                # If service is no longer running, drop the partial chunk
+                if self.running == False:
+                    return
+
+                chunk = list(islice(parser_excerpts, IMPORT_CHUNK_SIZE))
+
+                if not chunk:
+                    break
+
+                self.preview_chunk(chunk, index, seen_hashes)
+
+                job.subprogress += len(chunk)
+                job.save()
+
+            # Update job progress
+            job.progress = index + 1
+            job.save()
+
+        if self.running == False:
+            return
+
+        job.description = "finished"
+        job.save()
+
+    def checked_hashes(self):
+        """
+        Return the normalized content hashes of the excerpts in chunks
+        already checked, including children.
+        """
+
+        hashes = set()
+
+        def add_hashes(data):
+            hashes.add(normalized_content_hash(data["excerpt"]))
+
+            for child in data["children"]:
+                add_hashes(child)
+
+        for number in range(len(self.manifest["chunks"])):
+            preview = self.read_json(f"preview_{number}.json")
+
+            for data in preview["excerpts"] + preview["duplicates"]:
+                add_hashes(data)
+
+        return hashes
+
+    def preview_chunk(self, parser_excerpts, source_index, seen_hashes):
+        """
+        Check a chunk of a source's top-level excerpts for duplicates and
+        save its preview.
+        """
+
+        from ..views.imports import utils
+
+        excerpts, duplicates = utils.check_for_duplicate_excerpts(parser_excerpts,
+                                                                  seen_hashes)
+
+        to_import = excerpts_to_import(excerpts, duplicates)
+
+        number = len(self.manifest["chunks"])
+
+        self.write_json(f"preview_{number}.json", {
+            "excerpts": [excerpt.to_dict() for excerpt in excerpts],
+            "duplicates": [duplicate.to_dict() for duplicate in duplicates],
+            "new_tags": sorted(utils.identify_new_tags(to_import)),
+        })
+
+        self.manifest["chunks"].append({
+            "source": source_index,
+            "parsed": len(parser_excerpts),
+            "to_import": len(to_import),
+        })
+        self.save_manifest()
+
+    def parse_source(self, source):
+        """
+        Yield the top-level ParserExcerpts of a source.
+        """
+
+        match source["type"]:
+            case "markdown":
+                parser = MarkdownParser()
+
+                with open(self.path(source["filename"]), "r", encoding="utf-8") as f:
+                    yield from parser.parse_lines(f, source["tags"])
+
+            case "gdocs":
+                from barton_link.gdocs_parser import GDocsParser
+
+                gdocs = GDocsParser()
+                gdocs.load_credentials()
+
+                document = gdocs.get_document(source["document_id"])
+                yield from gdocs.parse_document(document, source["tags"])
+
+            case _:
+                raise ValueError("Invalid import source type.")
+
+    def get_preview(self):
+        """
+        Return the preview as a dict of ParserExcerpt lists and new tags.
+        """
+
+        preview = {"excerpts": [], "duplicates": [], "new_tags": set()}
+
+        for number in range(len(self.manifest["chunks"])):
+            chunk = self.read_json(f"preview_{number}.json")
+
+            preview["excerpts"] += [ParserExcerpt.from_dict(data)
+                                    for data in chunk["excerpts"]]
+            preview["duplicates"] += [ParserExcerpt.from_dict(data)
+                                      for data in chunk["duplicates"]]
+            preview["new_tags"].update(chunk["new_tags"])
+
+        preview["new_tags"] = sorted(preview["new_tags"])
+
+        return preview
+
+    def run_confirm(self):
+        """
+        Write the previewed excerpts to the database.
+
+        Each chunk of the preview is written in its own transaction, and its
+        result saved as result_<number>.json. Job.progress is the number of
+        top-level excerpts written.
+        """
+
+        from ..views.imports import utils
+
+        chunks = self.manifest["chunks"]
+        create_tags = set(self.manifest["create_tags"])
+
+        job = self.get_job()
+
+        if job == None:
+            job = Job.objects.create(name=self.job_name,
+                                     total=sum(chunk["to_import"] for chunk in chunks))
+
+        written = 0
+
+        for number, chunk in enumerate(chunks):
+            # If service is no longer running
+            if self.running == False:
+                return
+
+            # Skip chunks written before a stop
+            written += chunk["to_import"]
+            if written <= job.progress:
+                continue
+
+            preview = self.read_json(f"preview_{number}.json")
+            new_tags = set(preview["new_tags"])
+
+            parser_excerpts = excerpts_to_import(
+                [ParserExcerpt.from_dict(data) for data in preview["excerpts"]],
+                [ParserExcerpt.from_dict(data) for data in preview["duplicates"]],
+            )
+
+            # Filter out tags that shouldn't be created
+            def filter_tags(parser_excerpt):
+                parser_excerpt.tags = [tag for tag in parser_excerpt.tags
+                                       if tag not in new_tags or tag in create_tags]
+
+                for child in parser_excerpt.children:
+                    filter_tags(child)
+
+            for parser_excerpt in parser_excerpts:
+                filter_tags(parser_excerpt)
+
+            created, duplicates = utils.bulk_actualize_parser_excerpts(parser_excerpts)
+
+            self.write_json(f"result_{number}.json", {
+                "created": [excerpt.to_dict() for excerpt in created],
+                "duplicates": [excerpt.to_dict() for excerpt in duplicates],
+            })
+
+            # Update job progress
+            job.progress = written
+            job.save()
+
+        if self.running == False:
+            return
+
+        job.description = "finished"
+        job.save()
+
+        # Add new excerpts to the similarity index, if one has been built
+        index_new_excerpts_in_background()
+
+    def get_result(self):
+        """
+        Return the created and duplicate ParserExcerpts of a confirmed import.
+        """
+
+        result = {"excerpts": [], "internal_duplicates": []}
+
+        for number in range(len(self.manifest["chunks"])):
+            # Chunks with nothing to import have no result
+            if not os.path.exists(self.path(f"result_{number}.json")):
+                continue
+
+            chunk = self.read_json(f"result_{number}.json")
+
+            result["excerpts"] += [ParserExcerpt.from_dict(data)
+                                   for data in chunk["created"]]
+            result["internal_duplicates"] += [ParserExcerpt.from_dict(data)
+                                              for data in chunk["duplicates"]]
+
+        return result
+
+def excerpts_to_import(excerpts, duplicates):
+    """
+    Return the checked excerpts to write: the non-duplicates, then the
+    duplicates that have unique children.
+    """
+
+    return list(excerpts) + [
+        duplicate for duplicate in duplicates
+        if any(not child.is_duplicate for child in duplicate.children)
+    ]
+
+def sweep_imports():
+    """
+    Delete imports that haven't changed for IMPORT_MAX_AGE seconds, unless
+    they are running.
+    """
+
+    if not os.path.isdir(IMPORT_DIR):
+        return
+
+    cutoff = time.time() - IMPORT_MAX_AGE
+
+    for import_id in os.listdir(IMPORT_DIR):
+        if import_id in import_services:
+            continue
+
+        import_service = ImportService(import_id)
+
+        if os.path.getmtime(import_service.directory) < cutoff:
+            import_service.delete()
+
+def create_import_service():
+    """
+    Create a new, empty import. It is registered once it is started.
+
+    Deletes stale imports first, so abandoned ones don't pile up.
+    """
+
+    sweep_imports()
+
+    return ImportService(uuid.uuid4().hex)
+
+def get_import_service(import_id):
+    """
+    Get a running import, or reload one from its directory.
+
+    Returns None if the import doesn't exist.
+    """
+
+    if import_id in import_services:
+        return import_services[import_id]
+
+    # Only accept ids we could have generated
+    if not import_id or not import_id.isalnum():
+        return None
+
+    import_service = ImportService(import_id)
+
+    if not os.path.exists(import_service.path("manifest.json")):
+        return None
+
+    return import_service
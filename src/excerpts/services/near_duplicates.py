@@ -0,0 +1,158 @@
+from django.db import connection, transaction
+from django.db.models import F
+
+from barton_link import minhash
+
+from ..hashing import normalize_content
+from ..models import Excerpt, ExcerptLSHBucket, ExcerptMinHash
+from .embedding_store import LOOKUP_CHUNK_SIZE
+
+# Estimated Jaccard similarity of shingles above which an excerpt is a near
+# duplicate; a one-word edit of a sentence scores about 0.7
+NEAR_DUPLICATE_THRESHOLD = 0.6
+
+BUCKET_INSERT_SQL = "INSERT INTO {} (excerpt_id, bucket) VALUES (%s, %s)".format(
+    connection.ops.quote_name(ExcerptLSHBucket._meta.db_table)
+)
+
+def content_signature(content):
+    """
+    Return the MinHash signature of content, ignoring the differences that
+    normalized duplicate checks ignore.
+    """
+
+    return minhash.minhash_signature(normalize_content(content))
+
+def store_minhashes(excerpts):
+    """
+    Store the signatures and LSH buckets of excerpts, replacing any they
+    had. Called when excerpts are created or their content changes.
+    """
+
+    excerpts = list(excerpts)
+
+    for i in range(0, len(excerpts), LOOKUP_CHUNK_SIZE):
+        chunk = excerpts[i:i + LOOKUP_CHUNK_SIZE]
+
+        minhashes = []
+        buckets = []
+
+        for excerpt in chunk:
+            signature = content_signature(excerpt.content)
+
+            minhashes.append(ExcerptMinHash(
+                excerpt_id=excerpt.id,
+                content_hash=excerpt.content_hash,
+                signature=minhash.signature_to_blob(signature),
+            ))
+
+            buckets += [(excerpt.id, bucket)
+                        for bucket in set(minhash.lsh_buckets(signature))]
+
+        with transaction.atomic():
+            ExcerptMinHash.objects.bulk_create(
+                minhashes,
+                batch_size=LOOKUP_CHUNK_SIZE,
+                update_conflicts=True,
+                unique_fields=['excerpt'],
+                update_fields=['content_hash', 'signature'],
+            )
+
+            ExcerptLSHBucket.objects.filter(
+                excerpt_id__in=[excerpt.id for excerpt in chunk]
+            ).delete()
+            # 16 rows per excerpt; bulk_create would split them into many
+            # INSERTs to stay under SQLite's parameter limit
+            with connection.cursor() as cursor:
+                cursor.executemany(BUCKET_INSERT_SQL, buckets)
+
+def sync_minhashes():
+    """
+    Store signatures and LSH buckets for excerpts that have none, or whose
+    content has changed since theirs were computed, e.g. by a queryset
+    update. Run by manage.py sync_minhashes.
+
+    Returns the number of excerpts updated.
+    """
+
+    stale_ids = list(Excerpt.all_objects
+                     .exclude(minhash__content_hash=F('content_hash'))
+                     .values_list('id', flat=True))
+
+    for i in range(0, len(stale_ids), LOOKUP_CHUNK_SIZE):
+        store_minhashes(Excerpt.all_objects
+                        .filter(id__in=stale_ids[i:i + LOOKUP_CHUNK_SIZE])
+                        .only('id', 'content', 'content_hash'))
+
+    return len(stale_ids)
+
+def find_near_duplicates(contents, threshold=NEAR_DUPLICATE_THRESHOLD):
+    """
+    Find the existing excerpt most similar to each of contents.
+
+    Returns a dict mapping each content with a match whose estimated
+    similarity is at least threshold to (excerpt, similarity). Only excerpts
+    sharing an LSH bucket with a content are compared, so the cost per
+    content doesn't grow with the number of excerpts. Only reads; signatures
+    are stored as excerpts are saved or imported.
+    """
+
+    signatures = {content: content_signature(content)
+                  for content in dict.fromkeys(contents)}
+
+    # Contents by the buckets they fall in
+    bucket_contents = {}
+    for content, signature in signatures.items():
+        for bucket in minhash.lsh_buckets(signature):
+            bucket_contents.setdefault(bucket, set()).add(content)
+
+    # Candidate excerpt ids of each content
+    candidates = {}
+    bucket_list = list(bucket_contents)
+
+    for i in range(0, len(bucket_list), LOOKUP_CHUNK_SIZE):
+        for bucket, excerpt_id in ExcerptLSHBucket.objects.filter(
+            bucket__in=bucket_list[i:i + LOOKUP_CHUNK_SIZE]
+        ).values_list('bucket', 'excerpt_id'):
+            for content in bucket_contents[bucket]:
+                candidates.setdefault(content, set()).add(excerpt_id)
+
+    # Compare each content to its candidates' signatures
+    candidate_ids = list(set().union(*candidates.values()))
+    candidate_signatures = {}
+
+    for i in range(0, len(candidate_ids), LOOKUP_CHUNK_SIZE):
+        for excerpt_id, blob in ExcerptMinHash.objects.filter(
+            excerpt_id__in=candidate_ids[i:i + LOOKUP_CHUNK_SIZE],
+            excerpt__is_deleted=False,
+        ).values_list('excerpt_id', 'signature'):
+            candidate_signatures[excerpt_id] = minhash.blob_to_signature(blob)
+
+    best_matches = {}
+
+    for content, excerpt_ids in candidates.items():
+        scores = [
+            (minhash.estimate_similarity(signatures[content],
+                                         candidate_signatures[excerpt_id]),
+             -excerpt_id)
+            for excerpt_id in excerpt_ids
+            if excerpt_id in candidate_signatures
+        ]
+
+        # Most similar, then oldest
+        if scores and max(scores)[0] >= threshold:
+            similarity, excerpt_id = max(scores)
+            best_matches[content] = (-excerpt_id, similarity)
+
+    # Load the matched excerpts
+    match_ids = list(set(excerpt_id for excerpt_id, _ in best_matches.values()))
+    excerpts = {}
+
+    for i in range(0, len(match_ids), LOOKUP_CHUNK_SIZE):
+        excerpts.update(Excerpt.objects.in_bulk(match_ids[i:i + LOOKUP_CHUNK_SIZE]))
+
+    return {
+        content: (excerpts[excerpt_id], similarity)
+        for content, (excerpt_id, similarity) in best_matches.items()
+        if excerpt_id in excerpts
+    }
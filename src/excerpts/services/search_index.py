@@ -0,0 +1,112 @@
+import re
+
+from django.db import connection
+from django.db.models import Value
+from django.db.models.functions import Concat, Lower
+
+FTS_TABLE = "excerpts_excerpt_fts"
+
+# Quoted phrases, or runs of non-whitespace
+QUERY_TOKEN_REGEX = re.compile(r'"([^"]*)"?|(\S+)')
+
+def fts_available():
+    """
+    Whether the excerpt full-text index exists in the current database.
+    """
+
+    if connection.vendor != "sqlite":
+        return False
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s",
+            [FTS_TABLE],
+        )
+        return cursor.fetchone() is not None
+
+def quote_fts_string(text):
+    return '"' + text.replace('"', '""') + '"'
+
+def build_fts_query(search, prefix=False):
+    """
+    Convert a search string into an FTS5 MATCH expression.
+
+    "quoted text" matches the exact phrase and a word ending in * matches
+    any word with that prefix. All terms must match. Everything else is
+    quoted, so user input can't produce FTS5 syntax errors. With prefix,
+    a final single word also matches as a prefix, for search as you type.
+
+    Returns None if the search has no terms.
+    """
+
+    terms = []
+    last_is_word = False
+
+    for phrase, word in QUERY_TOKEN_REGEX.findall(search or ""):
+        last_is_word = False
+
+        # Phrase query
+        if phrase.strip():
+            terms.append(quote_fts_string(phrase.strip()))
+
+        # Prefix query
+        elif word.endswith("*") and word.strip("*"):
+            terms.append(quote_fts_string(word.strip("*")) + "*")
+
+        # Single word
+        elif word.strip("*"):
+            terms.append(quote_fts_string(word))
+            last_is_word = True
+
+    if not terms:
+        return None
+
+    if prefix and last_is_word:
+        terms[-1] += "*"
+
+    return " ".join(terms)
+
+def search_excerpts(excerpts, search, prefix=False):
+    """
+    Filter an Excerpt queryset to those matching search, best matches first.
+
+    Uses the FTS5 index when it exists, ranked by bm25; otherwise falls back
+    to a case-insensitive substring match ordered by newest first. prefix is
+    passed to build_fts_query.
+    """
+
+    query = build_fts_query(search, prefix=prefix)
+
+    if query is None:
+        return excerpts.order_by("-id")
+
+    if not fts_available():
+        return excerpts.filter(content__icontains=search).order_by("-id")
+
+    #@REVISIT extra() is the simplest way to join the virtual table
+    return excerpts.extra(
+        tables=[FTS_TABLE],
+        where=[
+            f"{FTS_TABLE}.rowid = excerpts_excerpt.id",
+            f"{FTS_TABLE} MATCH %s",
+        ],
+        params=[query],
+        select={"search_rank": f"{FTS_TABLE}.rank"},
+        order_by=["search_rank", "-id"],
+    )
+
+def search_names(queryset, search, field="name"):
+    """
+    Filter a queryset to rows whose field starts with search, ignoring case,
+    in alphabetical order.
+
+    The prefix is matched as a range of Lower(field), so an index on that
+    expression is searched rather than scanned.
+    """
+
+    prefix = Lower(Value(search.strip()))
+
+    return queryset.annotate(lower_name=Lower(field)).filter(
+        lower_name__gte=prefix,
+        lower_name__lt=Concat(prefix, Value("\U0010ffff")),
+    ).order_by("lower_name", "id")
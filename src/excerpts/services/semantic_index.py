@@ -0,0 +1,272 @@
+import time
+from threading import Lock
+
+import numpy as np
+from django.db.models import Count, Max
+
+from barton_link import barton_link
+
+from ..models import Excerpt, ExcerptEmbedding, ExcerptTag
+from . import embedding_store
+from .embedding_store import blob_to_vector
+
+# Default number of ranked results returned by a semantic search
+SEMANTIC_SEARCH_LIMIT = 200
+
+# Seconds between checks for changes made by other processes; changes made
+# in this process are picked up on the next search
+MATRIX_CHECK_INTERVAL = 10
+
+class EmbeddingMatrix:
+    """
+    Memory-resident matrix of the stored excerpt embeddings of one model.
+
+    Rows are unit length, so a query's cosine similarity against every
+    excerpt is a single matrix-vector product. The matrix is refreshed from
+    the ExcerptEmbedding table when it changes; only rows updated since the
+    last refresh are read, unless embeddings have been removed.
+
+    Each row also has deleted and root flags, so searches filter by them
+    without querying excerpts.
+    """
+
+    def __init__(self, model_name=barton_link.EMBEDDING_MODEL_NAME):
+        self.model_name = model_name
+        self.clear()
+
+        # (count, latest update) of the embeddings the matrix was read from
+        self.signature = (0, None)
+
+        # embedding_store versions and time of the last check
+        self.checked_versions = (None, None)
+        self.checked_at = 0
+
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self.excerpt_ids)
+
+    def get_signature(self):
+        signature = ExcerptEmbedding.objects.filter(model_name=self.model_name) \
+                .aggregate(count=Count('id'), latest=Max('updated'))
+
+        return (signature['count'], signature['latest'])
+
+    def clear(self):
+        self.excerpt_ids = np.zeros(0, dtype=np.int64)
+        self.vectors = None
+        self.rows = {}
+        self.deleted = np.zeros(0, dtype=bool)
+        self.roots = np.zeros(0, dtype=bool)
+
+    def refresh(self):
+        """
+        Bring the matrix and its flags up to date with the database.
+
+        Embeddings and flags are each only checked when this process has
+        changed them, or MATRIX_CHECK_INTERVAL seconds after the last check.
+        """
+
+        with self.lock:
+            versions = (embedding_store.embeddings_version,
+                        embedding_store.excerpt_flags_version)
+
+            periodic = time.monotonic() - self.checked_at >= MATRIX_CHECK_INTERVAL
+
+            if not periodic and versions == self.checked_versions:
+                return
+
+            check_embeddings = periodic or versions[0] != self.checked_versions[0]
+            check_flags = periodic or versions[1] != self.checked_versions[1]
+
+            self.checked_versions = versions
+            if periodic:
+                self.checked_at = time.monotonic()
+
+            signature = self.get_signature() if check_embeddings else self.signature
+
+            if signature != self.signature:
+                embeddings = ExcerptEmbedding.objects.filter(model_name=self.model_name)
+
+                # Read only the embeddings written since the last refresh
+                if self.signature[1] is not None and signature[0] >= self.signature[0]:
+                    self.read_embeddings(embeddings.filter(updated__gte=self.signature[1]))
+
+                # If embeddings were removed, reread everything
+                if len(self.excerpt_ids) != signature[0]:
+                    self.clear()
+                    self.read_embeddings(embeddings)
+
+                self.signature = signature
+                check_flags = True
+
+            if check_flags:
+                self.read_flags()
+
+    def read_flags(self):
+        """
+        Set the deleted and root flags of every row. Only the ids of
+        excerpts that are deleted or have parents are read.
+        """
+
+        deleted_ids = np.fromiter(Excerpt.all_objects.filter(is_deleted=True)
+                                  .values_list('id', flat=True), dtype=np.int64)
+        child_ids = np.fromiter(Excerpt.all_objects.filter(is_root=False)
+                                .values_list('id', flat=True), dtype=np.int64)
+
+        self.deleted = np.isin(self.excerpt_ids, deleted_ids)
+        self.roots = ~np.isin(self.excerpt_ids, child_ids)
+
+    def read_embeddings(self, embeddings):
+        """
+        Add or replace the rows of an ExcerptEmbedding queryset.
+        """
+
+        new_ids = []
+        new_vectors = []
+
+        for excerpt_id, vector in embeddings.values_list('excerpt_id', 'vector') \
+                .iterator(chunk_size=2000):
+            vector = blob_to_vector(vector)
+
+            # Replace edited embeddings in place
+            if excerpt_id in self.rows:
+                self.vectors[self.rows[excerpt_id]] = normalize_vector(vector)
+            else:
+                new_ids.append(excerpt_id)
+                new_vectors.append(vector)
+
+        if not new_vectors:
+            return
+
+        new_vectors = barton_link.normalize_embeddings(np.vstack(new_vectors))
+
+        self.vectors = new_vectors if self.vectors is None \
+                else np.vstack([self.vectors, new_vectors])
+
+        self.rows.update({
+            excerpt_id: len(self.excerpt_ids) + row
+            for row, excerpt_id in enumerate(new_ids)
+        })
+        self.excerpt_ids = np.concatenate([
+            self.excerpt_ids, np.array(new_ids, dtype=np.int64)
+        ])
+
+    def search(self,
+               query_vector,
+               k,
+               include_ids=None,
+               include_deleted=False,
+               roots_only=False):
+        """
+        Return (excerpt_ids, scores) of the k rows most similar to
+        query_vector, best first.
+
+        If include_ids is given, only those excerpts are considered.
+        Deleted excerpts are left out unless include_deleted, and excerpts
+        with parents if roots_only.
+        """
+
+        # Take a consistent view of the matrix while it may be refreshed
+        with self.lock:
+            excerpt_ids, vectors = self.excerpt_ids, self.vectors
+            deleted, roots = self.deleted, self.roots
+
+        if vectors is None or k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+        scores = vectors @ normalize_vector(query_vector)
+
+        # Mask out filtered excerpts
+        if not include_deleted:
+            scores[deleted] = -np.inf
+
+        if roots_only:
+            scores[~roots] = -np.inf
+
+        if include_ids is not None:
+            scores[~np.isin(excerpt_ids, np.asarray(include_ids, dtype=np.int64))] = -np.inf
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        top = top[np.isfinite(scores[top])]
+
+        return excerpt_ids[top], scores[top]
+
+def normalize_vector(vector):
+    return barton_link.normalize_embeddings(vector)[0]
+
+# Matrices by model name, shared across requests
+embedding_matrices = {}
+embedding_matrices_lock = Lock()
+
+def get_embedding_matrix(model_name=barton_link.EMBEDDING_MODEL_NAME):
+    """
+    Get the up-to-date embedding matrix of a model.
+    """
+
+    with embedding_matrices_lock:
+        if model_name not in embedding_matrices:
+            embedding_matrices[model_name] = EmbeddingMatrix(model_name)
+
+        matrix = embedding_matrices[model_name]
+
+    matrix.refresh()
+
+    return matrix
+
+def semantic_search(query,
+                    tag_id=None,
+                    include_deleted=False,
+                    roots_only=False,
+                    limit=SEMANTIC_SEARCH_LIMIT,
+                    model_name=barton_link.EMBEDDING_MODEL_NAME):
+    """
+    Rank excerpts by the cosine similarity of their stored embedding to the
+    query.
+
+    The query is encoded once with the loaded model; excerpts are compared
+    through the in-memory embedding matrix. Excerpts without a stored
+    embedding aren't found until an analysis, autotag run or import has
+    embedded them. With roots_only, excerpts with parents are left out, as
+    excerpt lists show them under their parents.
+
+    Returns a list of up to limit Excerpts, best match first, each with a
+    search_score attribute.
+    """
+
+    if not query.strip():
+        return []
+
+    matrix = get_embedding_matrix(model_name)
+
+    if len(matrix) == 0:
+        return []
+
+    include_ids = None
+
+    # Keep only excerpts with the tag
+    if tag_id is not None:
+        include_ids = list(ExcerptTag.objects.filter(tag_id=tag_id) \
+                .values_list('excerpt_id', flat=True))
+
+    query_vector = barton_link.encode_sbert([query])[0]
+    excerpt_ids, scores = matrix.search(query_vector,
+                                        limit,
+                                        include_ids,
+                                        include_deleted=include_deleted,
+                                        roots_only=roots_only)
+
+    # Load the excerpts in ranked order
+    manager = Excerpt.all_objects if include_deleted else Excerpt.objects
+    excerpts = manager.in_bulk(excerpt_ids.tolist())
+
+    results = []
+    for excerpt_id, score in zip(excerpt_ids.tolist(), scores.tolist()):
+        if excerpt_id in excerpts:
+            excerpt = excerpts[excerpt_id]
+            excerpt.search_score = score
+            results.append(excerpt)
+
+    return results
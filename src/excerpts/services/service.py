@@ -6,6 +6,16 @@ class Service:
     running: bool = False
     name: str
 
+    # Thread of the latest run, which finishes its current step after a stop
+    thread: Thread = None
+
+    # Selectable implementations of run(); the first is the default
+    engines: list = []
+    engine: str = None
+
+    # Number of processes used to encode excerpts
+    workers: int = 1
+
     def __init__(self, name):
         self.name = name
 
@@ -14,16 +24,23 @@ class Service:
         Start service.
         """
 
-        # If service is already running, return
-        if self.running == True:
+        # If service is already running, or still winding down, return
+        if self.running == True or self.is_alive():
             return
 
         # Set running to True
         self.running = True
 
         # Create thread and run service
-        thread = Thread(target=self.run)
-        thread.start()
+        self.thread = Thread(target=self.run)
+        self.thread.start()
+
+    def is_alive(self):
+        """
+        Whether the thread of the latest run hasn't exited yet.
+        """
+
+        return self.thread is not None and self.thread.is_alive()
 
     def stop(self):
         """
@@ -40,13 +57,53 @@ class Service:
 
         raise NotImplementedError
 
+    def set_engine(self, engine):
+        """
+        Select the engine used by the next run.
+        """
+
+        if engine not in self.engines:
+            raise ValueError("Invalid engine.")
+
+        # Don't switch engines under a running service
+        if self.running:
+            return
+
+        self.engine = engine
+
+    def set_workers(self, workers):
+        """
+        Set the number of encoding processes used by the next run.
+        """
+
+        if workers < 1:
+            raise ValueError("Invalid number of workers.")
+
+        # Don't change workers under a running service
+        if self.running:
+            return
+
+        self.workers = workers
+
+    @property
+    def job_name(self):
+        """
+        Name of the service's Job database entry.
+        """
+
+        # Engines count progress differently, so each gets its own Job
+        if self.engine is None or self.engine == self.engines[0]:
+            return self.name
+
+        return f"{self.name}_{self.engine}"
+
     def get_job(self):
         """
         Get service Job database entry.
         """
 
         try:
-            job = Job.objects.get(name=self.name)
+            job = Job.objects.get(name=self.job_name)
             return job
 
         # If no Job exists, create one
@@ -64,9 +121,12 @@ class Service:
 
         return {
             "running": self.running,
+            "engine": self.engine,
+            "workers": self.workers,
             "job": job if job else None,
             "progress": job.progress if job else None,
             "subprogress": job.subprogress if job else None,
             "total": job.total if job else None,
-            "percent": round(job.progress / job.total * 100, 2) if job else None,
+            "percent": round(job.progress / job.total * 100, 2) \
+                    if job and job.total else None,
         }
@@ -1,4 +1,6 @@
 import django
+import numpy as np
+from django.db import transaction
 
 from barton_link import barton_link
 
@@ -7,16 +9,57 @@ from ..models import Excerpt,\
         Job
 
 from .service import Service
+from .embedding_store import get_excerpt_embeddings, LOOKUP_CHUNK_SIZE
+from .similarity_index import sync_similarity_index
+
+# Pairs with an absolute similarity below this are not stored
+SIMILARITY_THRESHOLD = 0.4
+
+# Number of excerpts per side of a tile in the matrix engine
+TILE_SIZE = 1024
+
+# Number of nearest neighbours looked up per excerpt by the ann engine
+ANN_NEIGHBOURS = 20
+
+# Number of most similar excerpts kept per excerpt by the top_k engine
+SIMILARITY_TOP_K = 10
 
 class SimilarityAnalysisService(Service):
     """
     Service for analyzing similarities between excerpts using NLP.
+
+    Engines:
+        pairwise: compare one pair of excerpts at a time.
+        matrix: compare tiles of the embedding matrix at a time.
+        ann: look up the nearest neighbours of each excerpt in an
+            approximate nearest neighbour index.
+        top_k: keep only each excerpt's SIMILARITY_TOP_K most similar
+            excerpts, replacing all stored similarities.
     """
 
-    def __init__(self):
+    engines = ["pairwise", "matrix", "ann", "top_k"]
+
+    def __init__(self, engine="pairwise"):
         super().__init__("similarity_analysis")
+        self.engine = engine
 
     def run(self):
+        """
+        Analyze similarities between excerpts using the selected engine.
+        """
+
+        if self.engine == "matrix":
+            self.run_matrix()
+        elif self.engine == "ann":
+            self.run_ann()
+        elif self.engine == "top_k":
+            self.run_top_k()
+        else:
+            self.run_pairwise()
+
+        self.running = False
+
+    def run_pairwise(self):
         """
         Analyze similarities between excerpts using NLP.
         """
@@ -40,7 +83,7 @@ class SimilarityAnalysisService(Service):
 
         if job == None:
             job = Job.objects.create(
-                name="similarity_analysis",
+                name=self.job_name,
                 total=Excerpt.objects.count(),
             )
 
@@ -51,7 +94,13 @@ class SimilarityAnalysisService(Service):
 
         # Get all excerpts, order by ascending id, starting from current_progress
         #@TODO optimization; is Django loading all excerpts into memory?
-        excerpts = Excerpt.objects.order_by('id')[current_progress:]
+        excerpts = list(Excerpt.objects.order_by('id')[current_progress:])
+
+        # Load stored embeddings, encoding only new or edited excerpts
+        embeddings = dict(zip(
+            [excerpt.id for excerpt in excerpts],
+            get_excerpt_embeddings(excerpts, workers=self.workers)
+        ))
 
         # For each excerpt
         for excerpt in excerpts:
@@ -87,17 +136,17 @@ class SimilarityAnalysisService(Service):
                 other_excerpt_text = other_excerpt.content
 
                 # Measure similarities
-                sbert_similarity = barton_link.measure_excerpt_similarity_sbert(
-                    excerpt_text,
-                    other_excerpt_text
-                )
+                sbert_similarity = float(barton_link.compare_embeddings(
+                    embeddings[excerpt.id],
+                    embeddings[other_excerpt.id]
+                )[0][0])
 
                 # spacy_similarity = barton_link.measure_excerpt_similarity_spacy(
                 #         excerpt_text,
                 #         other_excerpt_text
                 #         )
 
-                threshold = 0.4
+                threshold = SIMILARITY_THRESHOLD
 
                 # If similarity is below threshold
                 if abs(sbert_similarity) < threshold:
@@ -156,3 +205,328 @@ class SimilarityAnalysisService(Service):
         # return HttpResponse(
         #     f"Created {similarities_stored} new ExcerptSimilarity entries."
         # )
+
+    def run_matrix(self):
+        """
+        Analyze similarities between excerpts as blocked matrix products.
+
+        The normalized embedding matrix is split into tiles of TILE_SIZE
+        excerpts. Each (row, column) tile in the upper triangle is compared
+        with a single matrix product and only pairs above the threshold are
+        stored. Job.progress is the current row tile and Job.subprogress the
+        current column tile, so the analysis can be resumed.
+        """
+
+        print("Running matrix similarity analysis...")
+
+        # Get all excerpts, order by ascending id
+        excerpts = list(Excerpt.objects.order_by('id').only('id', 'content', 'content_hash'))
+        excerpt_ids = np.array([excerpt.id for excerpt in excerpts])
+
+        # Load stored embeddings, encoding only new or edited excerpts
+        embeddings = barton_link.normalize_embeddings(
+            get_excerpt_embeddings(excerpts, workers=self.workers)
+        )
+
+        tile_count = -(-len(excerpts) // TILE_SIZE)
+
+        job = self.get_job()
+
+        if job == None:
+            job = Job.objects.create(name=self.job_name, total=tile_count)
+
+        # If the previous analysis finished, start over
+        if job.progress >= job.total:
+            job.progress = 0
+            job.subprogress = 0
+
+        #@REVISIT resuming assumes no excerpts were added or removed since the
+        #@ last run; otherwise tile boundaries shift and some pairs are missed
+        job.total = tile_count
+        job.save()
+
+        similarities_stored = 0
+
+        for row in range(job.progress, tile_count):
+            row_slice = slice(row * TILE_SIZE, (row + 1) * TILE_SIZE)
+
+            for column in range(max(row, job.subprogress), tile_count):
+                # If service is no longer running
+                if self.running == False:
+                    return
+
+                column_slice = slice(column * TILE_SIZE, (column + 1) * TILE_SIZE)
+
+                # Compare every excerpt in the row tile to the column tile
+                scores = embeddings[row_slice] @ embeddings[column_slice].T
+
+                matches = np.abs(scores) >= SIMILARITY_THRESHOLD
+
+                # On the diagonal, keep only pairs where excerpt1 < excerpt2
+                if row == column:
+                    matches = np.triu(matches, k=1)
+
+                pairs = [
+                    (int(excerpt_ids[row_slice][i]),
+                     int(excerpt_ids[column_slice][j]),
+                     float(scores[i, j]))
+                    for i, j in zip(*np.nonzero(matches))
+                ]
+
+                similarities_stored += self.store_similarities(pairs)
+
+                # Update job progress
+                job.subprogress = column + 1
+                job.save()
+
+            print(f"Finished row tile {row + 1} of {tile_count} " \
+                    + f"(similarities added: {similarities_stored})")
+
+            # Move to the next row tile; its first column tile is itself
+            job.progress = row + 1
+            job.subprogress = row + 1
+            job.save()
+
+    def run_ann(self):
+        """
+        Analyze similarities between excerpts with the similarity index.
+
+        Only the ANN_NEIGHBOURS most similar excerpts of each excerpt are
+        compared, so the analysis scales to corpora where comparing all
+        pairs is too slow. Strongly dissimilar pairs are not found.
+        Job.progress is the number of excerpts looked up so far.
+        """
+
+        print("Running approximate similarity analysis...")
+
+        # Build the index or insert excerpts added since the last run
+        index, excerpt_ids, embeddings = sync_similarity_index(workers=self.workers)
+
+        job = self.get_job()
+
+        if job == None:
+            job = Job.objects.create(name=self.job_name, total=len(excerpt_ids))
+
+        # If the previous analysis finished, start over
+        if job.progress >= job.total:
+            job.progress = 0
+            job.subprogress = 0
+
+        job.total = len(excerpt_ids)
+        job.save()
+
+        if index is None:
+            return
+
+        similarities_stored = 0
+
+        for start in range(job.progress, len(excerpt_ids), TILE_SIZE):
+            # If service is no longer running
+            if self.running == False:
+                return
+
+            chunk_ids = excerpt_ids[start:start + TILE_SIZE]
+
+            # One extra neighbour, since each excerpt finds itself
+            neighbour_ids, scores = index.search(embeddings[start:start + TILE_SIZE],
+                                                 k=ANN_NEIGHBOURS + 1)
+
+            # Collect each pair once, ordered so excerpt1 < excerpt2
+            pairs = {}
+            for excerpt_id, row_ids, row_scores in zip(chunk_ids, neighbour_ids, scores):
+                for neighbour_id, score in zip(row_ids, row_scores):
+                    if neighbour_id == -1 or neighbour_id == excerpt_id \
+                            or score < SIMILARITY_THRESHOLD:
+                        continue
+
+                    key = (int(min(excerpt_id, neighbour_id)),
+                           int(max(excerpt_id, neighbour_id)))
+                    pairs[key] = float(score)
+
+            similarities_stored += self.store_similarities(
+                [(*key, score) for key, score in sorted(pairs.items())]
+            )
+
+            # Update job progress
+            job.progress = start + len(chunk_ids)
+            job.save()
+
+            print(f"Looked up {job.progress} of {job.total} excerpts " \
+                    + f"(similarities added: {similarities_stored})")
+
+    def run_top_k(self):
+        """
+        Store each excerpt's SIMILARITY_TOP_K most similar excerpts, keeping
+        only those at least SIMILARITY_THRESHOLD similar.
+
+        Neighbours are found exactly, a row tile at a time against every
+        column tile. A pair is stored once if either excerpt is among the
+        other's neighbours, so neighbour lists are symmetric and storage
+        grows linearly with the corpus. The stored similarities are only
+        replaced, in one transaction, once every list is computed; a stopped
+        run leaves the previous lists in place and starts over.
+        Job.progress is the number of row tiles done.
+        """
+
+        print("Running top-k similarity analysis...")
+
+        # Get all excerpts, order by ascending id
+        excerpts = list(Excerpt.objects.order_by('id').only('id', 'content', 'content_hash'))
+        excerpt_ids = np.array([excerpt.id for excerpt in excerpts])
+
+        # Load stored embeddings, encoding only new or edited excerpts
+        embeddings = barton_link.normalize_embeddings(
+            get_excerpt_embeddings(excerpts, workers=self.workers)
+        )
+
+        tile_count = -(-len(excerpts) // TILE_SIZE)
+
+        job = self.get_job()
+
+        if job == None:
+            job = Job.objects.create(name=self.job_name, total=tile_count)
+
+        job.progress = 0
+        job.total = tile_count
+        job.save()
+
+        k = min(SIMILARITY_TOP_K, len(excerpts) - 1)
+        pairs = {}
+
+        for row in range(tile_count):
+            # If service is no longer running
+            if self.running == False:
+                return
+
+            row_slice = slice(row * TILE_SIZE, (row + 1) * TILE_SIZE)
+            neighbours, scores = self.find_top_k(embeddings, row_slice, k)
+
+            # Collect each pair once, ordered so excerpt1 < excerpt2
+            for excerpt_id, row_neighbours, row_scores \
+                    in zip(excerpt_ids[row_slice], neighbours, scores):
+                for neighbour, score in zip(row_neighbours, row_scores):
+                    if score < SIMILARITY_THRESHOLD:
+                        continue
+
+                    neighbour_id = excerpt_ids[neighbour]
+
+                    key = (int(min(excerpt_id, neighbour_id)),
+                           int(max(excerpt_id, neighbour_id)))
+                    pairs[key] = float(score)
+
+            # Update job progress
+            job.progress = row + 1
+            job.save()
+
+        self.replace_similarities(
+            [(*key, score) for key, score in sorted(pairs.items())]
+        )
+
+        print(f"Stored {len(pairs)} similarities for {len(excerpts)} excerpts")
+
+    def find_top_k(self, embeddings, row_slice, k):
+        """
+        Return (indices, scores) of the k rows of embeddings most similar to
+        each row in row_slice, other than itself.
+        """
+
+        rows = embeddings[row_slice]
+        row_indices = np.arange(len(embeddings))[row_slice]
+
+        best_indices = np.zeros((len(rows), 0), dtype=np.int64)
+        best_scores = np.zeros((len(rows), 0), dtype=np.float32)
+
+        if k <= 0:
+            return best_indices, best_scores
+
+        for start in range(0, len(embeddings), TILE_SIZE):
+            column_indices = np.arange(start, min(start + TILE_SIZE, len(embeddings)))
+            scores = rows @ embeddings[column_indices].T
+
+            # Leave out each excerpt itself
+            scores[row_indices[:, None] == column_indices[None, :]] = -np.inf
+
+            # Merge the tile into the running top k
+            candidate_indices = np.hstack([
+                best_indices,
+                np.broadcast_to(column_indices, scores.shape),
+            ])
+            candidate_scores = np.hstack([best_scores, scores])
+
+            top = np.argpartition(-candidate_scores,
+                                  min(k, candidate_scores.shape[1]) - 1,
+                                  axis=1)[:, :k]
+
+            best_indices = np.take_along_axis(candidate_indices, top, axis=1)
+            best_scores = np.take_along_axis(candidate_scores, top, axis=1)
+
+        return best_indices, best_scores
+
+    def replace_similarities(self, pairs):
+        """
+        Replace all ExcerptSimilarity entries with
+        (excerpt1_id, excerpt2_id, sbert_similarity) tuples, atomically.
+        """
+
+        with transaction.atomic():
+            ExcerptSimilarity.objects.all().delete()
+
+            ExcerptSimilarity.objects.bulk_create(
+                [ExcerptSimilarity(excerpt1_id=excerpt1_id,
+                                   excerpt2_id=excerpt2_id,
+                                   sbert_similarity=sbert_similarity)
+                 for excerpt1_id, excerpt2_id, sbert_similarity in pairs],
+                batch_size=LOOKUP_CHUNK_SIZE,
+            )
+
+    def store_similarities(self, pairs):
+        """
+        Create or update ExcerptSimilarity entries for
+        (excerpt1_id, excerpt2_id, sbert_similarity) tuples.
+
+        Returns the number of entries created.
+        """
+
+        if not pairs:
+            return 0
+
+        # Look up existing entries for the pairs
+        existing = {}
+        excerpt1_ids = sorted(set(pair[0] for pair in pairs))
+        excerpt2_range = (min(pair[1] for pair in pairs),
+                          max(pair[1] for pair in pairs))
+
+        for i in range(0, len(excerpt1_ids), LOOKUP_CHUNK_SIZE):
+            entries = ExcerptSimilarity.objects.filter(
+                excerpt1_id__in=excerpt1_ids[i:i + LOOKUP_CHUNK_SIZE],
+                excerpt2_id__gte=excerpt2_range[0],
+                excerpt2_id__lte=excerpt2_range[1],
+            )
+
+            for entry in entries:
+                existing[(entry.excerpt1_id, entry.excerpt2_id)] = entry
+
+        new_entries = []
+        changed_entries = []
+
+        for excerpt1_id, excerpt2_id, sbert_similarity in pairs:
+            entry = existing.get((excerpt1_id, excerpt2_id))
+
+            if entry is None:
+                new_entries.append(ExcerptSimilarity(
+                    excerpt1_id=excerpt1_id,
+                    excerpt2_id=excerpt2_id,
+                    sbert_similarity=sbert_similarity,
+                ))
+
+            elif entry.sbert_similarity != sbert_similarity:
+                entry.sbert_similarity = sbert_similarity
+                changed_entries.append(entry)
+
+        ExcerptSimilarity.objects.bulk_create(new_entries,
+                                              batch_size=LOOKUP_CHUNK_SIZE)
+        ExcerptSimilarity.objects.bulk_update(changed_entries,
+                                              ["sbert_similarity"],
+                                              batch_size=LOOKUP_CHUNK_SIZE)
+
+        return len(new_entries)
@@ -0,0 +1,169 @@
+import os
+from datetime import datetime
+from threading import Lock, Thread
+
+import appdirs
+import numpy as np
+from django.utils import timezone
+
+from barton_link import barton_link
+from barton_link.ann_index import IVFIndex
+
+from ..models import Excerpt, ExcerptEmbedding
+from .embedding_store import get_excerpt_embeddings, LOOKUP_CHUNK_SIZE
+
+INDEX_PATH = appdirs.user_data_dir('barton-link', 'barton-link') \
+        + '/similarity_index.npz'
+
+# Rebuild the index once it holds this many times the excerpts it was
+# trained on; until then new excerpts are only inserted into existing lists
+REBUILD_GROWTH_FACTOR = 4
+
+# Serialize reads and writes of the index file
+index_lock = Lock()
+
+def load_similarity_index(model_name=barton_link.EMBEDDING_MODEL_NAME):
+    """
+    Load the saved similarity index.
+
+    Returns None if there is no index or it was built with another model.
+    """
+
+    if not os.path.exists(INDEX_PATH):
+        return None
+
+    index = IVFIndex.load(INDEX_PATH)
+
+    if index.metadata.get("model_name") != model_name:
+        return None
+
+    return index
+
+def save_similarity_index(index, model_name=barton_link.EMBEDDING_MODEL_NAME):
+    """
+    Save the similarity index.
+    """
+
+    index.metadata["model_name"] = model_name
+
+    os.makedirs(os.path.dirname(INDEX_PATH), exist_ok=True)
+    index.save(INDEX_PATH)
+
+def sync_similarity_index(model_name=barton_link.EMBEDDING_MODEL_NAME, workers=1):
+    """
+    Build the similarity index, or bring the saved one up to date.
+
+    New and edited excerpts are inserted into the existing index and deleted
+    excerpts are removed; the index is only rebuilt when there is none or
+    the corpus has outgrown it. Missing embeddings are encoded across
+    workers processes.
+
+    Returns (index, excerpt_ids, embeddings) for all current excerpts.
+    """
+
+    with index_lock:
+        index = load_similarity_index(model_name)
+        loaded_at = timezone.now()
+
+        # Load stored embeddings, encoding only new or edited excerpts
+        excerpts = list(Excerpt.objects.order_by('id').only('id', 'content', 'content_hash'))
+        excerpt_ids = np.array([excerpt.id for excerpt in excerpts], dtype=np.int64)
+        embeddings = get_excerpt_embeddings(excerpts, model_name, workers)
+
+        # Re-encode excerpts edited during the encode, so the index is only
+        # stamped with vectors of their content when it was last checked
+        synced_at = timezone.now()
+        rows_by_id = {excerpt.id: row for row, excerpt in enumerate(excerpts)}
+
+        edited = [
+            excerpt for excerpt in Excerpt.objects
+                    .filter(updated__gte=loaded_at)
+                    .only('id', 'content', 'content_hash')
+            if excerpt.id in rows_by_id
+                    and excerpt.content_hash != excerpts[rows_by_id[excerpt.id]].content_hash
+        ]
+
+        if edited:
+            embeddings[[rows_by_id[excerpt.id] for excerpt in edited]] = \
+                    get_excerpt_embeddings(edited, model_name, workers)
+
+        if len(excerpts) == 0:
+            return None, excerpt_ids, embeddings
+
+        if index is None or len(excerpts) > REBUILD_GROWTH_FACTOR \
+                * int(index.metadata.get("trained_size", 0)):
+            print(f"Building similarity index for {len(excerpts)} excerpts...")
+
+            index = IVFIndex()
+            index.build(embeddings, excerpt_ids)
+            index.metadata["trained_size"] = str(len(excerpts))
+
+        else:
+            # Remove deleted excerpts
+            current_ids = set(excerpt_ids.tolist())
+            index.remove([id for id in list(index.id_to_list)
+                          if id not in current_ids])
+
+            # Find excerpts whose embedding changed since the last sync
+            changed_ids = set()
+            if "synced_at" in index.metadata:
+                changed_ids = set(ExcerptEmbedding.objects.filter(
+                    model_name=model_name,
+                    updated__gte=datetime.fromisoformat(index.metadata["synced_at"]),
+                ).values_list('excerpt_id', flat=True))
+
+            # Insert new excerpts and re-insert edited ones
+            rows = [row for row, excerpt_id in enumerate(excerpt_ids.tolist())
+                    if excerpt_id not in index or excerpt_id in changed_ids]
+
+            print(f"Inserting {len(rows)} excerpts into similarity index...")
+            index.add(embeddings[rows], excerpt_ids[rows])
+
+        index.metadata["synced_at"] = synced_at.isoformat()
+        save_similarity_index(index, model_name)
+
+        return index, excerpt_ids, embeddings
+
+def add_new_excerpts_to_similarity_index(model_name=barton_link.EMBEDDING_MODEL_NAME):
+    """
+    Insert excerpts that are not yet in the saved similarity index.
+
+    Does nothing if no index has been built.
+    """
+
+    with index_lock:
+        index = load_similarity_index(model_name)
+
+        if index is None:
+            return 0
+
+        new_ids = [excerpt_id for excerpt_id
+                   in Excerpt.objects.values_list('id', flat=True)
+                   if excerpt_id not in index]
+
+        if not new_ids:
+            return 0
+
+        excerpts = []
+        for i in range(0, len(new_ids), LOOKUP_CHUNK_SIZE):
+            excerpts += Excerpt.objects.filter(
+                id__in=new_ids[i:i + LOOKUP_CHUNK_SIZE]
+            ).order_by('id').only('id', 'content', 'content_hash')
+
+        index.add(get_excerpt_embeddings(excerpts, model_name),
+                  [excerpt.id for excerpt in excerpts])
+
+        save_similarity_index(index, model_name)
+
+        return len(excerpts)
+
+def index_new_excerpts_in_background():
+    """
+    Insert newly imported excerpts into the similarity index without
+    blocking the request.
+    """
+
+    #@REVISIT encoding loads the model in this process; fine while imports
+    #@ are rare
+    if os.path.exists(INDEX_PATH):
+        Thread(target=add_new_excerpts_to_similarity_index, daemon=True).start()
@@ -0,0 +1,92 @@
+from django.db.models import Max
+
+from barton_link import text_delta
+
+from ..models import ExcerptVersion
+
+# Most versions stored as deltas between two snapshots, which bounds the
+# number of deltas applied to rebuild any version
+VERSION_SNAPSHOT_INTERVAL = 10
+
+def version_chain(excerpt_id, start, end):
+    """
+    Return the versions of an excerpt from the nearest snapshot at or before
+    version number start through version number end, in order, each with its
+    rebuilt content as text.
+    """
+
+    snapshot_number = ExcerptVersion.objects \
+            .filter(excerpt_id=excerpt_id, number__lte=start, content__isnull=False) \
+            .aggregate(number=Max('number'))['number'] or 1
+
+    chain = list(ExcerptVersion.objects
+                 .filter(excerpt_id=excerpt_id,
+                         number__gte=snapshot_number,
+                         number__lte=end)
+                 .order_by('number'))
+
+    text = ""
+
+    for version in chain:
+        text = version.content if version.is_snapshot \
+                else text_delta.apply_delta(text, version.delta)
+
+        version.text = text
+
+    return chain
+
+def rebuild_versions(excerpt_id, start, end):
+    """
+    Return the versions of an excerpt numbered start through end, in order,
+    each with its rebuilt content as text.
+    """
+
+    return [version for version in version_chain(excerpt_id, start, end)
+            if version.number >= start]
+
+def version_content(version):
+    """
+    Return the content of a version, rebuilding it if it is a delta.
+    """
+
+    if version.is_snapshot:
+        return version.content
+
+    return version_chain(version.excerpt_id, version.number, version.number)[-1].text
+
+def add_version(excerpt):
+    """
+    Store an excerpt's current content as its next version, as a delta from
+    the latest version or, every VERSION_SNAPSHOT_INTERVAL versions, as a
+    snapshot.
+
+    Returns the new version, or None if the content is unchanged.
+    """
+
+    latest_number = excerpt.versions.aggregate(number=Max('number'))['number']
+
+    if latest_number is None:
+        return ExcerptVersion.objects.create(excerpt=excerpt,
+                                             number=1,
+                                             content=excerpt.content)
+
+    chain = version_chain(excerpt.id, latest_number, latest_number)
+    previous = chain[-1].text
+
+    if previous == excerpt.content:
+        return None
+
+    version = ExcerptVersion(excerpt=excerpt, number=latest_number + 1)
+
+    delta = text_delta.make_delta(previous, excerpt.content)
+
+    # Snapshot when the chain is long enough, or a delta saves nothing
+    if version.number - chain[0].number >= VERSION_SNAPSHOT_INTERVAL \
+            or len(delta) >= len(excerpt.content.encode("utf-8")):
+        version.content = excerpt.content
+    else:
+        version.delta = delta
+
+    version.save()
+
+    return version
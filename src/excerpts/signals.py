@@ -0,0 +1,70 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Excerpt, ExcerptRelationship
+from .services.embedding_store import invalidate_excerpt_flags
+from .services.near_duplicates import store_minhashes
+
+#@REVISIT Excerpt.parents is the forward side of ExcerptRelationship, so an
+#@ excerpt with parents is the one stored in the parent column; see
+#@ bulk_actualize_parser_excerpts
+
+def update_root_flags(excerpt_ids):
+    """
+    Recompute Excerpt.is_root for the given excerpt ids.
+    """
+
+    excerpt_ids = set(excerpt_ids)
+
+    if not excerpt_ids:
+        return
+
+    with_parents = ExcerptRelationship.objects \
+            .filter(parent_id__in=excerpt_ids) \
+            .values_list('parent_id', flat=True)
+
+    Excerpt.all_objects.filter(id__in=excerpt_ids) \
+            .exclude(id__in=with_parents) \
+            .update(is_root=True)
+
+    Excerpt.all_objects.filter(id__in=with_parents).update(is_root=False)
+
+    invalidate_excerpt_flags()
+
+@receiver(post_save, sender=ExcerptRelationship)
+def relationship_saved(sender, instance, **kwargs):
+    update_root_flags([instance.parent_id])
+
+@receiver(post_delete, sender=ExcerptRelationship)
+def relationship_deleted(sender, instance, **kwargs):
+    update_root_flags([instance.parent_id])
+
+@receiver(m2m_changed, sender=Excerpt.parents.through)
+def parents_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    # excerpt.parents.*: the instance is in the parent column
+    if not reverse:
+        update_root_flags([instance.id])
+
+    # excerpt.children.* with the changed excerpts in the parent column
+    elif pk_set:
+        update_root_flags(pk_set)
+
+    # excerpt.children.clear() doesn't say which excerpts it removed, so
+    # fix any flag left stale
+    else:
+        Excerpt.all_objects.filter(is_root=False, parent__isnull=True) \
+                .update(is_root=True)
+
+        invalidate_excerpt_flags()
+
+@receiver(post_save, sender=Excerpt)
+def excerpt_saved(sender, instance, **kwargs):
+    # Keep near-duplicate signatures in step with the content
+    if getattr(instance, '_content_changed', False):
+        store_minhashes([instance])
+
+    # The excerpt may have been deleted or restored
+    invalidate_excerpt_flags()
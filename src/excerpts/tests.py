@@ -1,7 +1,25 @@
+import os
+import tempfile
+import time
+from io import StringIO
+from unittest import mock
+
+import numpy as np
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.template.loader import render_to_string
 from django.test import TestCase
-from .models import Excerpt, Tag, TagType
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from .models import Entity, Excerpt, ExcerptAutoTag, ExcerptEmbedding, ExcerptRelationship, ExcerptSimilarity, ExcerptTag, ExcerptVersion, Job, Tag, TagType
+from .services import autotag, embedding_store, import_service, near_duplicates, search_index, semantic_index, similarity_analysis, similarity_index, version_history
+from barton_link import barton_link
+from barton_link.embedding_worker import EmbeddingWorker, WORKER_ADDRESS
 from barton_link.parser_excerpt import ParserExcerpt
-from .views.imports.utils import actualize_parser_excerpt, actualize_parser_excerpts, check_for_duplicate_excerpts
+from .hashing import content_hash, normalized_content_hash
+from .utils import load_excerpt_tree, prefetch_excerpt_list
+from .views.excerpts import excerpt_views
+from .views.imports.utils import actualize_parser_excerpt, actualize_parser_excerpts, bulk_actualize_parser_excerpts, check_for_duplicate_excerpts, find_existing_excerpts
 
 # Create your tests here.
 
@@ -151,3 +169,1558 @@ class ExcerptImportTests(TestCase):
         # Verify that both unique children are in the set
         self.assertIn('Unique child one', child_contents)
         self.assertIn('Unique child two', child_contents)
+
+
+class BulkExcerptImportTests(TestCase):
+    def setUp(self):
+        self.tag_type = TagType.objects.create(
+            name='default',
+            description='Default tag type'
+        )
+
+        self.tag = Tag.objects.create(
+            name='test_tag',
+            type=self.tag_type,
+            description='Test tag'
+        )
+
+        self.existing_excerpt = Excerpt.objects.create(
+            content='Existing parent excerpt'
+        )
+        self.existing_excerpt.tags.add(self.tag)
+
+    def test_bulk_matches_duplicate_semantics(self):
+        """
+        Test that bulk actualization reuses existing and repeated excerpts,
+        links unique children of duplicates, and creates missing tags.
+        """
+        parent1 = ParserExcerpt(content='Existing parent excerpt', tags=['test_tag'])
+        parent1.children.append(ParserExcerpt(content='Unique child one',
+                                              tags=['test_tag', 'new_tag']))
+
+        parent2 = ParserExcerpt(content='Existing parent excerpt', tags=['test_tag'])
+        parent2.children.append(ParserExcerpt(content='Unique child two'))
+
+        unique = ParserExcerpt(content='Another unique excerpt', tags=['new_tag'])
+        repeated = ParserExcerpt(content='Another unique excerpt')
+
+        created, duplicates = bulk_actualize_parser_excerpts(
+            [parent1, parent2, unique, repeated]
+        )
+
+        self.assertEqual(created, [unique])
+        self.assertEqual(duplicates, [parent1, parent2, repeated])
+        self.assertTrue(repeated.is_duplicate)
+        self.assertFalse(parent1.children[0].is_duplicate)
+
+        parent_in_db = Excerpt.objects.get(content='Existing parent excerpt')
+        self.assertEqual(set(parent_in_db.children.values_list('content', flat=True)),
+                         {'Unique child one', 'Unique child two'})
+
+        # Existing links are not duplicated
+        self.assertEqual(ExcerptTag.objects.filter(excerpt=parent_in_db).count(), 1)
+
+        new_tag = Tag.objects.get(name='new_tag')
+        self.assertEqual(set(new_tag.excerpts.values_list('content', flat=True)),
+                         {'Unique child one', 'Another unique excerpt'})
+
+        self.assertEqual(Excerpt.objects.filter(content='Another unique excerpt').count(), 1)
+        self.assertEqual(Excerpt.objects.get(content='Unique child two').versions.count(), 1)
+
+    def test_bulk_query_count_does_not_grow_with_excerpts(self):
+        """
+        Test that a large import takes a small, fixed number of queries.
+        """
+        parser_excerpts = []
+        for i in range(200):
+            parent = ParserExcerpt(content=f'Parent {i}', tags=['test_tag', f'tag {i % 5}'])
+            parent.children.append(ParserExcerpt(content=f'Child {i}', tags=['test_tag']))
+            parser_excerpts.append(parent)
+
+        with CaptureQueriesContext(connection) as queries:
+            created, duplicates = bulk_actualize_parser_excerpts(parser_excerpts)
+
+        self.assertEqual(len(created), 200)
+        self.assertEqual(Excerpt.objects.count(), 401)
+        self.assertEqual(ExcerptTag.objects.count(), 1 + 200 * 3)
+        self.assertLess(len(queries), 25)
+
+class ContentHashTests(TestCase):
+    def setUp(self):
+        self.existing_excerpt = Excerpt.objects.create(content='Existing parent excerpt')
+
+    def test_hashes_follow_content(self):
+        """
+        Test that saving an excerpt keeps its hashes in step with its content.
+        """
+        self.assertEqual(self.existing_excerpt.content_hash,
+                         content_hash('Existing parent excerpt'))
+
+        self.existing_excerpt.content = '**Existing**  parent   EXCERPT'
+        self.existing_excerpt.save(update_fields=['content'])
+        self.existing_excerpt.refresh_from_db()
+
+        self.assertEqual(self.existing_excerpt.content_hash,
+                         content_hash('**Existing**  parent   EXCERPT'))
+        self.assertEqual(self.existing_excerpt.normalized_hash,
+                         normalized_content_hash('Existing parent excerpt'))
+
+    def test_normalized_duplicates(self):
+        """
+        Test that variants differing in whitespace, case and emphasis are
+        duplicates, in the preview and in both import paths.
+        """
+        variant = '  existing **parent**\n_excerpt_ '
+
+        non_duplicates, duplicates = check_for_duplicate_excerpts([
+            ParserExcerpt(content=variant),
+            ParserExcerpt(content='Existing parent_excerpt'),
+        ])
+        self.assertEqual([e.content for e in duplicates], [variant])
+        self.assertEqual([e.content for e in non_duplicates], ['Existing parent_excerpt'])
+
+        instance, created = actualize_parser_excerpt(ParserExcerpt(content=variant))
+        self.assertFalse(created)
+        self.assertEqual(instance, self.existing_excerpt)
+
+        created, duplicates = bulk_actualize_parser_excerpts([
+            ParserExcerpt(content=variant),
+            ParserExcerpt(content='New *excerpt*'),
+            ParserExcerpt(content='new excerpt'),
+        ])
+        self.assertEqual([e.content for e in created], ['New *excerpt*'])
+        self.assertEqual(Excerpt.objects.count(), 2)
+
+    def test_large_lookups_are_chunked(self):
+        """
+        Test that duplicate lookups stay within SQLite's parameter limit.
+        """
+        contents = [f'Excerpt {i}' for i in range(40000)] + ['existing parent excerpt']
+
+        self.assertEqual(list(find_existing_excerpts(contents).values()),
+                         [self.existing_excerpt])
+
+def fake_encode(texts, batch_size=64):
+    """
+    Deterministic stand-in for barton_link.encode_sbert.
+    """
+    return np.array([[len(text), text.count("e"), 1.0] for text in texts],
+                    dtype=np.float32).reshape(len(texts), 3)
+
+class EmbeddingStoreTests(TestCase):
+    def setUp(self):
+        self.excerpts = [
+            Excerpt.objects.create(content='First excerpt'),
+            Excerpt.objects.create(content='Second excerpt'),
+        ]
+
+    def test_embeddings_are_encoded_once(self):
+        """
+        Test that stored embeddings are reused instead of re-encoded.
+        """
+        with mock.patch.object(embedding_store.barton_link,
+                               'encode_sbert',
+                               side_effect=fake_encode) as encode:
+            first = embedding_store.get_excerpt_embeddings(self.excerpts)
+            second = embedding_store.get_excerpt_embeddings(self.excerpts)
+
+        self.assertEqual(encode.call_count, 1)
+        self.assertEqual(first.shape, (2, 3))
+        np.testing.assert_array_equal(first, second)
+        self.assertEqual(ExcerptEmbedding.objects.count(), 2)
+
+    def test_edited_excerpt_is_re_encoded(self):
+        """
+        Test that only excerpts whose content changed are re-encoded.
+        """
+        with mock.patch.object(embedding_store.barton_link,
+                               'encode_sbert',
+                               side_effect=fake_encode) as encode:
+            embedding_store.get_excerpt_embeddings(self.excerpts)
+
+            self.excerpts[1].content = 'Second excerpt, edited'
+            self.excerpts[1].save()
+
+            embeddings = embedding_store.get_excerpt_embeddings(self.excerpts)
+
+        self.assertEqual(encode.call_count, 2)
+        self.assertEqual(encode.call_args[0][0], ['Second excerpt, edited'])
+        self.assertEqual(embeddings[1][0], len('Second excerpt, edited'))
+        self.assertEqual(ExcerptEmbedding.objects.count(), 2)
+
+    def test_parallel_encoding(self):
+        """
+        Test that workers > 1 encodes through the process pool.
+        """
+        with mock.patch.object(embedding_store.barton_link,
+                               'encode_parallel',
+                               side_effect=lambda texts, workers: fake_encode(texts)) as encode:
+            embeddings = embedding_store.get_excerpt_embeddings(self.excerpts, workers=2)
+
+        self.assertEqual(encode.call_args[0][1], 2)
+        self.assertEqual(embeddings.shape, (2, 3))
+
+class MatrixSimilarityTests(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+
+        # Two loose clusters so that some pairs pass the threshold
+        self.vectors = np.vstack([
+            rng.normal(1, 0.5, (6, 8)),
+            rng.normal(-1, 0.5, (5, 8)),
+        ]).astype(np.float32)
+
+        self.excerpts = [Excerpt.objects.create(content=f'Excerpt {i}')
+                         for i in range(len(self.vectors))]
+
+        self.vectors_by_content = {
+            excerpt.content: vector
+            for excerpt, vector in zip(self.excerpts, self.vectors)
+        }
+
+    def encode(self, texts, batch_size=64):
+        return np.array([self.vectors_by_content[text] for text in texts],
+                        dtype=np.float32).reshape(len(texts), -1)
+
+    def expected_pairs(self):
+        scores = embedding_store.barton_link.compare_embeddings(self.vectors,
+                                                                self.vectors)
+        pairs = set()
+
+        for i in range(len(self.excerpts)):
+            for j in range(i + 1, len(self.excerpts)):
+                if abs(scores[i][j]) >= similarity_analysis.SIMILARITY_THRESHOLD:
+                    pairs.add((self.excerpts[i].id, self.excerpts[j].id))
+
+        return pairs
+
+    def test_matrix_engine_matches_all_pairs(self):
+        """
+        Test that the tiled engine stores the same pairs as comparing every
+        pair, with tiles that don't divide the corpus evenly.
+        """
+        service = similarity_analysis.SimilarityAnalysisService(engine="matrix")
+        service.running = True
+
+        with mock.patch.object(similarity_analysis, 'TILE_SIZE', 4), \
+                mock.patch.object(embedding_store.barton_link,
+                                  'encode_sbert',
+                                  side_effect=self.encode):
+            service.run()
+
+        stored = set(ExcerptSimilarity.objects.values_list('excerpt1_id',
+                                                           'excerpt2_id'))
+
+        self.assertTrue(stored)
+        self.assertEqual(stored, self.expected_pairs())
+
+        job = service.get_job()
+        self.assertEqual(job.name, 'similarity_analysis_matrix')
+        self.assertEqual(job.progress, job.total)
+        self.assertEqual(job.total, 3)
+        self.assertFalse(service.running)
+
+    def test_top_k_engine_keeps_nearest_neighbours(self):
+        """
+        Test that the top_k engine stores each excerpt's k nearest
+        neighbours above the threshold once per pair, replacing earlier
+        similarities.
+        """
+        ExcerptSimilarity.objects.create(excerpt1=self.excerpts[0],
+                                         excerpt2=self.excerpts[10],
+                                         sbert_similarity=-0.9)
+
+        service = similarity_analysis.SimilarityAnalysisService(engine="top_k")
+        service.running = True
+
+        with mock.patch.object(similarity_analysis, 'TILE_SIZE', 4), \
+                mock.patch.object(similarity_analysis, 'SIMILARITY_TOP_K', 7), \
+                mock.patch.object(embedding_store.barton_link,
+                                  'encode_sbert',
+                                  side_effect=self.encode):
+            service.run()
+
+        scores = embedding_store.barton_link.compare_embeddings(self.vectors,
+                                                                self.vectors)
+        np.fill_diagonal(scores, -np.inf)
+
+        expected = set()
+        for i, row in enumerate(scores):
+            for j in np.argsort(-row)[:7]:
+                if row[j] >= similarity_analysis.SIMILARITY_THRESHOLD:
+                    expected.add((self.excerpts[min(i, j)].id, self.excerpts[max(i, j)].id))
+
+        stored = set(ExcerptSimilarity.objects.values_list('excerpt1_id',
+                                                           'excerpt2_id'))
+
+        self.assertTrue(stored)
+        self.assertEqual(stored, expected)
+        self.assertFalse(ExcerptSimilarity.objects.filter(
+            sbert_similarity__lt=similarity_analysis.SIMILARITY_THRESHOLD).exists())
+        self.assertEqual(ExcerptSimilarity.objects.count(), len(expected))
+        self.assertEqual(service.get_job().progress, 3)
+
+    def test_ann_engine_and_incremental_insertion(self):
+        """
+        Test that the ann engine stores the positive pairs, and that new
+        excerpts are inserted into the saved index without a rebuild.
+        """
+        service = similarity_analysis.SimilarityAnalysisService(engine="ann")
+        service.running = True
+
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch.object(similarity_index, 'INDEX_PATH',
+                                  f'{directory}/index.npz'), \
+                mock.patch.object(embedding_store.barton_link,
+                                  'encode_sbert',
+                                  side_effect=self.encode):
+            service.run()
+
+            stored = set(ExcerptSimilarity.objects.values_list('excerpt1_id',
+                                                               'excerpt2_id'))
+
+            # Small corpus; every list is probed, so the search is exact.
+            # Only similar (not opposite) pairs are neighbours.
+            scores = embedding_store.barton_link.compare_embeddings(self.vectors,
+                                                                    self.vectors)
+            positions = {excerpt.id: i for i, excerpt in enumerate(self.excerpts)}
+            expected = set(pair for pair in self.expected_pairs()
+                           if scores[positions[pair[0]]][positions[pair[1]]] > 0)
+
+            self.assertTrue(stored)
+            self.assertEqual(stored, expected)
+
+            job = service.get_job()
+            self.assertEqual(job.name, 'similarity_analysis_ann')
+            self.assertEqual(job.progress, len(self.excerpts))
+
+            new_excerpt = Excerpt.objects.create(content='Excerpt new')
+            self.vectors_by_content['Excerpt new'] = self.vectors[0]
+
+            added = similarity_index.add_new_excerpts_to_similarity_index()
+            index = similarity_index.load_similarity_index()
+
+            self.assertEqual(added, 1)
+            self.assertIn(new_excerpt.id, index)
+            self.assertEqual(index.metadata['trained_size'], str(len(self.excerpts)))
+
+    def test_sync_reencodes_excerpts_edited_during_encode(self):
+        """
+        Test that an excerpt edited while the index is encoding is indexed
+        with the vector of its new content.
+        """
+        self.vectors_by_content['Edited'] = self.vectors[10]
+        edited = self.excerpts[0]
+
+        def encode_then_edit(texts, batch_size=64):
+            if edited.content != 'Edited':
+                edited.content = 'Edited'
+                edited.save()
+
+            return self.encode(texts, batch_size)
+
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch.object(similarity_index, 'INDEX_PATH',
+                                  f'{directory}/index.npz'), \
+                mock.patch.object(embedding_store.barton_link,
+                                  'encode_sbert',
+                                  side_effect=encode_then_edit):
+            index, excerpt_ids, embeddings = similarity_index.sync_similarity_index()
+
+        self.assertEqual(excerpt_ids[0], edited.id)
+        np.testing.assert_allclose(embeddings[0], self.vectors[10])
+        self.assertEqual(ExcerptEmbedding.objects.get(excerpt=edited).content_hash,
+                         content_hash('Edited'))
+
+class AutotagTests(TestCase):
+    def setUp(self):
+        TagType.objects.create(id=1, name='default', description='')
+
+        self.vectors_by_content = {
+            'ocean': [1, 0, 0],
+            'forest': [0, 1, 0],
+            'A ship at sea': [0.9, 0.1, 0],
+            'Trees and moss': [0.1, 0.8, 0.3],
+            'Wet leaves by the shore': [0.6, 0.6, 0.1],
+            'An empty room': [0, 0, 1],
+            'Against the tide': [-0.8, 0, 0.2],
+        }
+
+        for name in ['ocean', 'forest']:
+            Tag.objects.create(name=name, description='')
+
+        for content in list(self.vectors_by_content)[2:]:
+            Excerpt.objects.create(content=content)
+
+    def encode(self, texts, batch_size=64):
+        return np.array([self.vectors_by_content[text] for text in texts],
+                        dtype=np.float32).reshape(len(texts), 3)
+
+    def run_engine(self, engine):
+        service = autotag.AutotagService(engine=engine)
+        service.running = True
+
+        with mock.patch.object(autotag, 'EXCERPT_CHUNK_SIZE', 2), \
+                mock.patch.object(autotag.barton_link,
+                                  'encode_sbert',
+                                  side_effect=self.encode):
+            service.run()
+
+        return service
+
+    def stored_autotags(self):
+        return {
+            (autotag.excerpt.content, autotag.tag.name): autotag.sbert_similarity
+            for autotag in ExcerptAutoTag.objects.select_related('excerpt', 'tag')
+        }
+
+    def test_batched_engine_matches_per_excerpt_engine(self):
+        """
+        Test that the batched engine stores the same autotags as scoring one
+        excerpt at a time, and that re-running it updates in place.
+        """
+        self.run_engine("per_excerpt")
+        expected = self.stored_autotags()
+        ExcerptAutoTag.objects.all().delete()
+
+        service = self.run_engine("batched")
+        stored = self.stored_autotags()
+
+        self.assertIn(('A ship at sea', 'ocean'), stored)
+        self.assertIn(('Against the tide', 'ocean'), stored)
+        self.assertNotIn(('An empty room', 'ocean'), stored)
+        self.assertEqual(stored.keys(), expected.keys())
+        for key in expected:
+            self.assertAlmostEqual(stored[key], expected[key], places=5)
+
+        job = service.get_job()
+        self.assertEqual(job.name, 'autotag_batched')
+        self.assertEqual(job.progress, 5)
+        self.assertEqual(job.total, 5)
+        self.assertFalse(service.running)
+
+        # A finished run starts over without duplicating autotags
+        self.run_engine("batched")
+        self.assertEqual(ExcerptAutoTag.objects.count(), len(expected))
+
+    def test_batched_engine_scores_only_missing_combinations(self):
+        """
+        Test that new tags add a column, edited excerpts redo their row and
+        renamed tags redo their column, leaving other scores alone.
+        """
+        self.run_engine("batched")
+
+        # Mark every stored score so untouched ones can be recognized
+        ExcerptAutoTag.objects.update(sbert_similarity=2.0)
+
+        self.vectors_by_content['sea'] = [1, 0.1, 0]
+        Tag.objects.create(name='sea', description='')
+        service = self.run_engine("batched")
+
+        stored = self.stored_autotags()
+        self.assertEqual(stored[('A ship at sea', 'ocean')], 2.0)
+        self.assertNotEqual(stored[('A ship at sea', 'sea')], 2.0)
+        self.assertEqual(service.get_job().total, 5)
+
+        # Nothing left to score
+        service = self.run_engine("batched")
+        self.assertEqual(service.get_job().total, 0)
+
+        # Edit an excerpt's content
+        ExcerptAutoTag.objects.update(sbert_similarity=2.0)
+        self.vectors_by_content['A wooden ship'] = [0.7, 0.7, 0]
+        excerpt = Excerpt.objects.get(content='A ship at sea')
+        excerpt.content = 'A wooden ship'
+        excerpt.save()
+
+        service = self.run_engine("batched")
+        stored = self.stored_autotags()
+
+        self.assertEqual(service.get_job().total, 1)
+        self.assertNotEqual(stored[('A wooden ship', 'forest')], 2.0)
+        self.assertEqual(stored[('Trees and moss', 'forest')], 2.0)
+
+        # Rename a tag so it no longer matches
+        ExcerptAutoTag.objects.update(sbert_similarity=2.0)
+        self.vectors_by_content['kitchen'] = [0, 0, 1]
+        Tag.objects.filter(name='forest').update(name='kitchen')
+
+        self.run_engine("batched")
+        stored = self.stored_autotags()
+
+        self.assertNotIn(('Trees and moss', 'forest'), stored)
+        self.assertIn(('An empty room', 'kitchen'), stored)
+        self.assertEqual(stored[('Wet leaves by the shore', 'ocean')], 2.0)
+
+class ImportServiceTests(TestCase):
+    def setUp(self):
+        TagType.objects.create(id=1, name='default', description='')
+        Tag.objects.create(name='existing_tag', description='')
+        Excerpt.objects.create(content='Existing excerpt')
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+        patcher = mock.patch.object(import_service, 'IMPORT_DIR', self.directory.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.addCleanup(import_service.import_services.clear)
+
+    def run_now(self, service):
+        service.running = True
+        service.run()
+
+    def test_preview_and_confirm(self):
+        """
+        Test that an import is previewed and written in separate stages.
+        """
+        service = import_service.create_import_service()
+        service.add_text_source("- One\n    - Child\n- Existing excerpt",
+                                ['existing_tag', 'new_tag'])
+        service.add_text_source("- Two", ['unwanted_tag'])
+
+        self.run_now(service)
+        self.assertTrue(service.is_finished())
+        self.assertEqual(Excerpt.objects.count(), 1)
+
+        preview = service.get_preview()
+        self.assertEqual([e.content for e in preview['excerpts']], ['One', 'Two'])
+        self.assertEqual([e.content for e in preview['duplicates']], ['Existing excerpt'])
+        self.assertEqual(preview['new_tags'], ['new_tag', 'unwanted_tag'])
+
+        service.confirm(['new_tag'])
+        self.assertFalse(service.is_finished())
+
+        self.run_now(service)
+        self.assertTrue(service.is_finished())
+
+        result = service.get_result()
+        self.assertEqual([e.content for e in result['excerpts']], ['One', 'Two'])
+
+        child = Excerpt.objects.get(content='Child')
+        self.assertEqual(set(child.tags.values_list('name', flat=True)),
+                         {'existing_tag', 'new_tag'})
+        self.assertFalse(Tag.objects.filter(name='unwanted_tag').exists())
+
+    def test_stopped_confirm_resumes_after_restart(self):
+        """
+        Test that a stopped import continues where it left off when reloaded
+        from its directory.
+        """
+        service = import_service.create_import_service()
+        service.add_text_source("- One\n- Two\n- Three")
+
+        with mock.patch.object(import_service, 'IMPORT_CHUNK_SIZE', 1):
+            self.run_now(service)
+
+        service.confirm([])
+
+        from .views.imports import utils
+        bulk_actualize = utils.bulk_actualize_parser_excerpts
+
+        # Stop after the first chunk is written
+        def write_then_stop(parser_excerpts):
+            service.stop()
+            return bulk_actualize(parser_excerpts)
+
+        with mock.patch.object(utils, 'bulk_actualize_parser_excerpts',
+                               side_effect=write_then_stop):
+            self.run_now(service)
+
+        self.assertFalse(service.is_finished())
+        self.assertEqual(service.get_job().progress, 1)
+
+        # Simulate a restart
+        import_service.import_services.clear()
+        resumed = import_service.get_import_service(service.import_id)
+        self.assertIsNot(resumed, service)
+        self.assertEqual(resumed.stage, 'confirm')
+
+        self.run_now(resumed)
+
+        self.assertTrue(resumed.is_finished())
+        self.assertEqual(len(resumed.get_result()['excerpts']), 3)
+        self.assertEqual(Excerpt.objects.filter(content__in=['One', 'Two', 'Three']).count(), 3)
+
+    def test_finished_import_is_unregistered(self):
+        """
+        Test that an import is only kept in memory while it runs.
+        """
+        service = import_service.create_import_service()
+        service.add_text_source("- One")
+
+        with mock.patch('excerpts.services.service.Thread'):
+            service.start()
+
+        self.assertIs(import_service.get_import_service(service.import_id), service)
+
+        service.run()
+
+        self.assertEqual(import_service.import_services, {})
+
+        reloaded = import_service.get_import_service(service.import_id)
+        self.assertIsNot(reloaded, service)
+        self.assertTrue(reloaded.is_finished())
+
+    def test_import_views(self):
+        """
+        Test that the import views hand the import to the service and poll
+        until the preview and the import are done.
+        """
+        def start(service):
+            self.run_now(service)
+
+        with mock.patch.object(import_service.ImportService, 'start',
+                               autospec=True, side_effect=start):
+            response = self.client.post('/excerpts/import', {
+                'import_method': 'text_paste',
+                'excerpts': '- Pasted excerpt',
+            })
+
+            self.assertContains(response, 'Import Confirmation')
+            preview_id = response.context['preview_id']
+
+            response = self.client.post('/excerpts/confirm-import', {
+                'preview_id': preview_id,
+            })
+
+            self.assertContains(response, 'Import Successful')
+            self.assertTrue(Excerpt.objects.filter(content='Pasted excerpt').exists())
+
+        # The finished import is deleted once its success page is shown
+        response = self.client.get(f'/excerpts/import/{preview_id}/progress')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(os.listdir(self.directory.name), [])
+        self.assertFalse(Job.objects.filter(name__startswith=f'import_{preview_id}').exists())
+
+        response = self.client.get('/excerpts/import/doesnotexist/progress')
+        self.assertEqual(response.status_code, 404)
+
+    def test_preview_checks_chunks_against_earlier_chunks(self):
+        """
+        Test that each chunk is checked against the chunks before it, also
+        when a stopped preview is resumed after a restart.
+        """
+        service = import_service.create_import_service()
+        service.add_text_source("- One\n- Two\n- ONE\n- Three")
+
+        from .views.imports import utils
+        check = utils.check_for_duplicate_excerpts
+
+        # Stop after the first chunk is checked
+        def check_then_stop(parser_excerpts, seen_hashes):
+            service.stop()
+            return check(parser_excerpts, seen_hashes)
+
+        with mock.patch.object(import_service, 'IMPORT_CHUNK_SIZE', 2), \
+                mock.patch.object(utils, 'check_for_duplicate_excerpts',
+                                  side_effect=check_then_stop):
+            self.run_now(service)
+
+        self.assertFalse(service.is_finished())
+
+        import_service.import_services.clear()
+        resumed = import_service.get_import_service(service.import_id)
+
+        with mock.patch.object(import_service, 'IMPORT_CHUNK_SIZE', 2):
+            self.run_now(resumed)
+
+        self.assertTrue(resumed.is_finished())
+        self.assertEqual(resumed.get_job().subprogress, 4)
+
+        preview = resumed.get_preview()
+        self.assertEqual([e.content for e in preview['excerpts']], ['One', 'Two', 'Three'])
+        self.assertEqual([e.content for e in preview['duplicates']], ['ONE'])
+
+        self.assertEqual(sorted(os.listdir(resumed.directory)), [
+            'manifest.json', 'preview_0.json', 'preview_1.json', 'source_0.md',
+        ])
+
+    def test_failed_import_shows_error(self):
+        """
+        Test that an exception stops the import with its message on the Job,
+        and that resuming clears it.
+        """
+        service = import_service.create_import_service()
+        service.add_text_source("- One")
+
+        with mock.patch.object(import_service.ImportService, 'run_preview',
+                               side_effect=ValueError('Unreadable source')):
+            self.run_now(service)
+
+        status = service.get_status()
+        self.assertFalse(status['running'])
+        self.assertFalse(status['finished'])
+        self.assertEqual(status['error'], 'Unreadable source')
+
+        response = self.client.get(f'/excerpts/import/{service.import_id}/progress')
+        self.assertContains(response, 'Import failed: Unreadable source')
+
+        self.run_now(service)
+        self.assertTrue(service.is_finished())
+        self.assertEqual(service.get_status()['error'], '')
+
+    def test_start_waits_for_stopped_thread(self):
+        """
+        Test that a stopped import isn't started again until its thread exits.
+        """
+        service = import_service.create_import_service()
+        service.add_text_source("- One")
+
+        with mock.patch('excerpts.services.service.Thread') as thread:
+            service.start()
+            service.stop()
+            service.start()
+
+            self.assertEqual(thread.call_count, 1)
+            self.assertFalse(service.running)
+
+            thread.return_value.is_alive.return_value = False
+            service.start()
+
+            self.assertEqual(thread.call_count, 2)
+
+    def test_cancelled_and_stale_imports_are_deleted(self):
+        """
+        Test that cancelling an import deletes it, and that creating an import
+        deletes others untouched for IMPORT_MAX_AGE.
+        """
+        service = import_service.create_import_service()
+        service.add_text_source("- One")
+        self.run_now(service)
+
+        response = self.client.get(f'/excerpts/import/{service.import_id}/cancel')
+        self.assertContains(response, 'Import Cancelled')
+        self.assertFalse(os.path.exists(service.directory))
+        self.assertFalse(Job.objects.filter(name__startswith=service.name).exists())
+
+        stale = import_service.create_import_service()
+        stale.add_text_source("- Two")
+        self.run_now(stale)
+
+        recent = import_service.create_import_service()
+        recent.add_text_source("- Three")
+
+        old = time.time() - import_service.IMPORT_MAX_AGE - 1
+        os.utime(stale.directory, (old, old))
+
+        import_service.create_import_service()
+
+        self.assertEqual(os.listdir(self.directory.name), [recent.import_id])
+        self.assertFalse(Job.objects.filter(name__startswith=stale.name).exists())
+
+class SearchIndexTests(TestCase):
+    def setUp(self):
+        self.excerpts = {
+            content: Excerpt.objects.create(content=content)
+            for content in [
+                'The lighthouse keeper counted ships',
+                'Ships in a bottle',
+                'A keeper of bees',
+                'Lighthouses along the coast',
+            ]
+        }
+
+    def search(self, search):
+        response = self.client.get('/excerpts/', {'search': search},
+                                   HTTP_HX_REQUEST='true')
+        return [excerpt.content for excerpt in response.context['page_obj']]
+
+    def test_build_fts_query(self):
+        """
+        Test that searches become escaped FTS5 phrase and prefix terms.
+        """
+        self.assertEqual(search_index.build_fts_query('light* "the keeper" bees'),
+                         '"light"* "the keeper" "bees"')
+        self.assertEqual(search_index.build_fts_query('say "hi'), '"say" "hi"')
+        self.assertEqual(search_index.build_fts_query('OR AND'), '"OR" "AND"')
+        self.assertIsNone(search_index.build_fts_query('  * "" '))
+
+    def test_word_prefix_and_phrase_search(self):
+        """
+        Test word, prefix and phrase matches.
+        """
+        self.assertEqual(set(self.search('keeper')),
+                         {'The lighthouse keeper counted ships',
+                          'A keeper of bees'})
+        self.assertEqual(set(self.search('lighthouse*')),
+                         {'The lighthouse keeper counted ships',
+                          'Lighthouses along the coast'})
+        self.assertEqual(self.search('"keeper counted"'),
+                         ['The lighthouse keeper counted ships'])
+        self.assertEqual(self.search('"counted keeper"'), [])
+        self.assertEqual(len(self.search('')), 4)
+
+    def test_results_are_ranked(self):
+        """
+        Test that better matches come first.
+        """
+        Excerpt.objects.create(content='ships ships ships')
+        self.assertEqual(self.search('ships')[0], 'ships ships ships')
+
+    def test_index_follows_edits_deletes_and_bulk_imports(self):
+        """
+        Test that the index stays in sync with saves, soft deletes and bulk
+        inserts.
+        """
+        excerpt = self.excerpts['Ships in a bottle']
+        excerpt.content = 'Letters in a bottle'
+        excerpt.save()
+
+        self.assertEqual(self.search('letters'), ['Letters in a bottle'])
+        self.assertEqual(self.search('bottle ships'), [])
+
+        excerpt.soft_delete()
+        self.assertEqual(self.search('letters'), [])
+
+        Excerpt.all_objects.filter(id=excerpt.id).update(is_deleted=False)
+        self.assertEqual(self.search('letters'), ['Letters in a bottle'])
+
+        bulk_actualize_parser_excerpts([ParserExcerpt(content='Bulk imported lighthouse')])
+        self.assertIn('Bulk imported lighthouse', self.search('lighthouse'))
+
+        Excerpt.objects.filter(content='Bulk imported lighthouse').delete()
+        self.assertNotIn('Bulk imported lighthouse', self.search('lighthouse'))
+
+class SemanticSearchTests(TestCase):
+    def setUp(self):
+        semantic_index.embedding_matrices.clear()
+
+        self.tag = Tag.objects.create(name='Sea', type=TagType.objects.create(name='Default'))
+        self.excerpts = [Excerpt.objects.create(content=f'Excerpt {i}') for i in range(4)]
+        self.excerpts[2].tags.add(self.tag)
+
+        embedding_store.store_embeddings(self.excerpts, [
+            [1.0, 0.0, 0.0],
+            [0.8, 0.6, 0.0],
+            [0.6, 0.8, 0.0],
+            [0.0, 0.0, 1.0],
+        ])
+
+    def search(self, query_vector, **kwargs):
+        with mock.patch.object(semantic_index.barton_link,
+                               'encode_sbert',
+                               return_value=np.array([query_vector], dtype=np.float32)):
+            return semantic_index.semantic_search('query', **kwargs)
+
+    def test_results_are_ranked_by_similarity(self):
+        """
+        Test that excerpts come back best match first, with scores.
+        """
+        results = self.search([2.0, 0.0, 0.0])
+
+        self.assertEqual(results[:3], self.excerpts[:3])
+        self.assertAlmostEqual(results[0].search_score, 1.0, places=5)
+        self.assertEqual(self.search([2.0, 0.0, 0.0], limit=2), self.excerpts[:2])
+
+    def test_filters(self):
+        """
+        Test the tag and soft-delete filters.
+        """
+        self.assertEqual(self.search([1.0, 0.0, 0.0], tag_id=self.tag.id),
+                         [self.excerpts[2]])
+
+        self.excerpts[3].children.add(self.excerpts[1])
+        self.assertEqual(self.search([1.0, 0.0, 0.0], roots_only=True)[:2],
+                         [self.excerpts[0], self.excerpts[2]])
+
+        self.excerpts[0].soft_delete()
+
+        self.assertNotIn(self.excerpts[0], self.search([1.0, 0.0, 0.0]))
+        self.assertEqual(self.search([1.0, 0.0, 0.0], include_deleted=True)[0],
+                         self.excerpts[0])
+
+    def test_matrix_follows_stored_embeddings(self):
+        """
+        Test that new, replaced and removed embeddings reach the matrix.
+        """
+        self.search([1.0, 0.0, 0.0])
+
+        excerpt = Excerpt.objects.create(content='New excerpt')
+        embedding_store.store_embeddings([excerpt, self.excerpts[3]], [
+            [0.0, 1.0, 0.0],
+            [1.0, 0.0, 0.0],
+        ])
+
+        self.assertEqual(self.search([0.0, 1.0, 0.0])[0], excerpt)
+        self.assertEqual(self.search([1.0, 0.0, 0.0])[0].search_score,
+                         self.search([1.0, 0.0, 0.0])[1].search_score)
+
+        # Changes made without this process's invalidation are seen on the
+        # next periodic check
+        ExcerptEmbedding.objects.filter(excerpt=excerpt).delete()
+        self.assertEqual(len(semantic_index.get_embedding_matrix()), 5)
+
+        with mock.patch.object(semantic_index, 'MATRIX_CHECK_INTERVAL', 0):
+            self.assertNotIn(excerpt, self.search([0.0, 1.0, 0.0]))
+            self.assertEqual(len(semantic_index.get_embedding_matrix()), 4)
+
+    def test_search_does_not_query_unchanged_data(self):
+        """
+        Test that repeated searches use the matrix's flags instead of
+        querying embeddings or excerpts, until search data changes.
+        """
+        self.excerpts[3].children.add(self.excerpts[1])
+        self.search([1.0, 0.0, 0.0])
+
+        with CaptureQueriesContext(connection) as queries:
+            results = self.search([1.0, 0.0, 0.0], roots_only=True)
+
+        self.assertNotIn(self.excerpts[1], results)
+        self.assertEqual(len(queries), 1)
+
+        self.excerpts[0].soft_delete()
+        self.assertNotIn(self.excerpts[0], self.search([1.0, 0.0, 0.0]))
+
+    def test_search_view_semantic_mode(self):
+        """
+        Test that the search page paginates semantic results, leaving
+        children to be shown under their parents.
+        """
+        self.excerpts[3].children.add(self.excerpts[1])
+
+        with mock.patch.object(semantic_index.barton_link,
+                               'encode_sbert',
+                               return_value=np.array([[0.0, 1.0, 0.0]], dtype=np.float32)), \
+                mock.patch.object(semantic_index.barton_link, 'is_encoder_ready',
+                                  return_value=True):
+            response = self.client.get('/excerpts/', {
+                'search': 'waves', 'mode': 'semantic', 'page_size': 2,
+            }, HTTP_HX_REQUEST='true')
+
+        page = list(response.context['page_obj'])
+        self.assertEqual(page[0], self.excerpts[2])
+        self.assertNotIn(self.excerpts[1], page)
+        self.assertIn('mode=semantic', response.context['next_page_url'])
+        self.assertIn('search=waves', response.context['next_page_url'])
+
+    def test_tag_filter_options_load_lazily(self):
+        """
+        Test that the search page renders only the selected tag, and the
+        rest load from their own endpoint.
+        """
+        other = Tag.objects.create(name='Harbour', type=self.tag.type)
+
+        response = self.client.get('/excerpts/', {'tag': self.tag.id})
+        self.assertContains(response, reverse('search_tag_options'))
+        self.assertContains(response, 'Sea')
+        self.assertNotContains(response, 'Harbour')
+
+        response = self.client.get(reverse('search_tag_options'), {'tag': self.tag.id})
+        self.assertContains(response, f'<option value="{other.id}">', html=False)
+        self.assertContains(response, f'<option value="{self.tag.id}" selected>', html=False)
+
+    def test_search_view_does_not_wait_for_model(self):
+        """
+        Test that semantic mode falls back to keyword results while the
+        model loads in the background.
+        """
+        with mock.patch.object(semantic_index.barton_link, 'is_encoder_ready',
+                               return_value=False), \
+                mock.patch.object(semantic_index.barton_link,
+                                  'load_models_in_background') as load, \
+                mock.patch.object(semantic_index.barton_link,
+                                  'encode_sbert') as encode:
+            response = self.client.get('/excerpts/', {
+                'search': 'Excerpt 2', 'mode': 'semantic',
+            }, HTTP_HX_REQUEST='true')
+
+        load.assert_called_once()
+        encode.assert_not_called()
+        self.assertTrue(response.context['model_loading'])
+        self.assertEqual(list(response.context['page_obj']), [self.excerpts[2]])
+
+class SimilarExcerptsTests(TestCase):
+    def setUp(self):
+        self.excerpt = Excerpt.objects.create(content='Centre')
+        self.others = [Excerpt.objects.create(content=f'Other {i}') for i in range(5)]
+
+        # Store pairs from both sides, as excerpt1 < excerpt2 puts them
+        for i, other in enumerate(self.others):
+            first, second = (other, self.excerpt) if i % 2 else (self.excerpt, other)
+            ExcerptSimilarity.objects.create(excerpt1=first,
+                                             excerpt2=second,
+                                             sbert_similarity=0.5 + i / 10)
+
+    def test_similar_excerpts_in_one_query(self):
+        """
+        Test that similar excerpts load in one query, most similar first,
+        and are cached.
+        """
+        self.others[4].soft_delete()
+
+        with self.assertNumQueries(1):
+            similar = self.excerpt.similar_excerpts()
+            self.excerpt.similar_excerpts()
+
+            self.assertEqual([similarity['excerpt'].content for similarity in similar],
+                             ['Other 3', 'Other 2', 'Other 1', 'Other 0'])
+
+        self.assertEqual(len(Excerpt.objects.get(id=self.excerpt.id).similar_excerpts(limit=2)), 2)
+
+    def test_limit_setting(self):
+        """
+        Test that the default limit comes from the settings.
+        """
+        with self.settings(SIMILAR_EXCERPTS_LIMIT=3):
+            self.assertEqual(len(self.excerpt.similar_excerpts()), 3)
+
+class ExcerptListQueryTests(TestCase):
+    # Queries allowed to render a page of excerpts, whatever its size
+    QUERY_BUDGET = 12
+
+    def setUp(self):
+        tag_type = TagType.objects.create(name='Default')
+        self.tags = [Tag.objects.create(name=f'Tag {i}', type=tag_type) for i in range(5)]
+
+    def create_excerpts(self, count):
+        for i in range(count):
+            excerpt = Excerpt.objects.create(content=f'Excerpt {i}')
+            excerpt.tags.add(self.tags[0], self.tags[i % 5])
+            ExcerptAutoTag.objects.create(excerpt=excerpt, tag=self.tags[1],
+                                          sbert_similarity=0.7)
+
+            child = Excerpt.objects.create(content=f'Child {i}')
+            child.tags.add(self.tags[2])
+            excerpt.children.add(child)
+
+    def count_queries(self, url, **headers):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'page_size': 100}, **headers)
+
+        self.assertEqual(response.status_code, 200)
+
+        return len(queries)
+
+    def test_search_page_query_budget(self):
+        """
+        Test that the search page's query count doesn't grow with its size.
+        """
+        self.create_excerpts(3)
+        small_page = self.count_queries('/excerpts/', HTTP_HX_REQUEST='true')
+
+        self.create_excerpts(40)
+        large_page = self.count_queries('/excerpts/', HTTP_HX_REQUEST='true')
+
+        self.assertEqual(small_page, large_page)
+        self.assertLessEqual(large_page, self.QUERY_BUDGET)
+
+    def test_tag_page_query_budget(self):
+        """
+        Test that the tag page's query count doesn't grow with its size.
+        """
+        self.create_excerpts(3)
+        small_page = self.count_queries(f'/excerpts/tags/{self.tags[0].id}')
+
+        self.create_excerpts(40)
+        large_page = self.count_queries(f'/excerpts/tags/{self.tags[0].id}')
+
+        self.assertEqual(small_page, large_page)
+        self.assertLessEqual(large_page, self.QUERY_BUDGET)
+
+    def test_only_page_tags_are_loaded(self):
+        """
+        Test that a page loads the tags of its excerpts, not every tag.
+        """
+        self.create_excerpts(2)
+        tag_type = TagType.objects.get(name='Default')
+        Tag.objects.bulk_create([Tag(name=f'Unused {i}', type=tag_type) for i in range(20)])
+
+        with CaptureQueriesContext(connection) as queries:
+            excerpts = prefetch_excerpt_list(Excerpt.objects.filter(is_root=True).order_by('id'))
+
+        tag_queries = [query['sql'] for query in queries
+                       if 'FROM "excerpts_tag"' in query['sql']]
+
+        self.assertTrue(tag_queries)
+        self.assertTrue(all('WHERE' in sql for sql in tag_queries))
+
+        self.assertEqual([set(tag.name for tag in excerpt.tags.all()) for excerpt in excerpts],
+                         [{'Tag 0'}, {'Tag 0', 'Tag 1'}])
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.excerpts = [Excerpt.objects.create(content=f'Excerpt {i}') for i in range(7)]
+
+        # A child, which the search page leaves out
+        self.excerpts[3].children.add(Excerpt.objects.create(content='Child'))
+
+    def get_page(self, url, **params):
+        response = self.client.get(url, {'page_size': 3, **params}, HTTP_HX_REQUEST='true')
+        return response.context
+
+    def test_cursor_pages(self):
+        """
+        Test that cursor links walk forwards and back through the excerpts,
+        newest first, without counting them.
+        """
+        expected = [excerpt.content for excerpt in reversed(self.excerpts)]
+
+        with self.settings(KEYSET_PAGINATION=True):
+            with CaptureQueriesContext(connection) as queries:
+                first = self.get_page('/excerpts/')
+
+            self.assertFalse(any('COUNT(' in query['sql'] for query in queries))
+            self.assertFalse(any('OFFSET' in query['sql'] for query in queries))
+
+            self.assertEqual([e.content for e in first['page_obj']], expected[:3])
+            self.assertIsNone(first['prev_page_url'])
+
+            second = self.client.get(first['next_page_url'], HTTP_HX_REQUEST='true').context
+            third = self.client.get(second['next_page_url'], HTTP_HX_REQUEST='true').context
+
+            self.assertEqual([e.content for e in second['page_obj']], expected[3:6])
+            self.assertEqual([e.content for e in third['page_obj']], expected[6:])
+            self.assertIsNone(third['next_page_url'])
+
+            back = self.client.get(third['prev_page_url'], HTTP_HX_REQUEST='true').context
+            self.assertEqual([e.content for e in back['page_obj']], expected[3:6])
+
+            first_again = self.client.get(back['prev_page_url'], HTTP_HX_REQUEST='true').context
+            self.assertEqual([e.content for e in first_again['page_obj']], expected[:3])
+            self.assertIsNone(first_again['prev_page_url'])
+
+    def test_previous_page_at_the_oldest_excerpt(self):
+        """
+        Test that paging back from a cursor with nothing older has no next
+        page, and that the search form keeps the cursor.
+        """
+        oldest_id = self.excerpts[0].id
+        self.excerpts[0].delete()
+
+        with self.settings(KEYSET_PAGINATION=True):
+            context = self.get_page('/excerpts/', before=oldest_id)
+
+            self.assertEqual([e.content for e in context['page_obj']],
+                             ['Excerpt 3', 'Excerpt 2', 'Excerpt 1'])
+            self.assertIsNone(context['next_page_url'])
+            self.assertIsNotNone(context['prev_page_url'])
+
+            context = self.get_page('/excerpts/', before=self.excerpts[1].id)
+            self.assertIsNotNone(context['next_page_url'])
+
+            response = self.client.get('/excerpts/', {'page_size': 3, 'before': oldest_id})
+            self.assertContains(response, f'/excerpts/search?before={oldest_id}"')
+
+    def test_cursor_pages_are_stable(self):
+        """
+        Test that excerpts added after the first page don't shift later pages.
+        """
+        with self.settings(KEYSET_PAGINATION=True):
+            first = self.get_page('/excerpts/')
+            Excerpt.objects.create(content='Newer excerpt')
+            second = self.client.get(first['next_page_url'], HTTP_HX_REQUEST='true').context
+
+        self.assertEqual([e.content for e in second['page_obj']],
+                         ['Excerpt 3', 'Excerpt 2', 'Excerpt 1'])
+
+    def test_ranked_search_uses_page_numbers(self):
+        """
+        Test that results not ordered by id fall back to numbered pages.
+        """
+        with self.settings(KEYSET_PAGINATION=True):
+            context = self.get_page('/excerpts/', search='excerpt')
+
+        self.assertEqual(context['page_obj'].paginator.count, 7)
+        self.assertIn('page=2', context['next_page_url'])
+
+class RootFlagTests(TestCase):
+    def setUp(self):
+        self.parent = Excerpt.objects.create(content='Parent excerpt')
+        self.child = Excerpt.objects.create(content='Child excerpt')
+
+    def assertRoots(self, *excerpts):
+        self.assertEqual(
+            set(Excerpt.all_objects.filter(is_root=True).values_list('id', flat=True)),
+            set(excerpt.id for excerpt in excerpts),
+        )
+
+    def test_children_add_and_remove(self):
+        """
+        Test that is_root follows children.add(), remove() and clear().
+        """
+        self.parent.children.add(self.child)
+        self.assertRoots(self.parent)
+
+        self.parent.children.remove(self.child)
+        self.assertRoots(self.parent, self.child)
+
+        self.child.parents.add(self.parent)
+        self.assertRoots(self.parent)
+
+        self.parent.children.clear()
+        self.assertRoots(self.parent, self.child)
+
+    def test_relationship_create_and_delete(self):
+        """
+        Test that is_root follows ExcerptRelationship rows and cascades.
+        """
+        ExcerptRelationship.objects.create(parent=self.child, child=self.parent)
+        self.assertRoots(self.parent)
+
+        # A stale copy saved later doesn't overwrite the flag
+        self.child.content = 'Edited child excerpt'
+        self.child.save()
+        self.assertRoots(self.parent)
+
+        self.parent.delete()
+        self.assertRoots(self.child)
+
+    def test_bulk_import(self):
+        """
+        Test that bulk imported children are not roots.
+        """
+        parent = ParserExcerpt(content='Imported parent')
+        parent.children.append(ParserExcerpt(content='Imported child'))
+
+        bulk_actualize_parser_excerpts([parent])
+
+        self.assertEqual(
+            set(Excerpt.objects.filter(is_root=False).values_list('content', flat=True)),
+            {'Imported child'},
+        )
+
+    def test_listing_shows_roots(self):
+        """
+        Test that the excerpt listing only shows root excerpts.
+        """
+        self.parent.children.add(self.child)
+
+        response = self.client.get('/excerpts/', HTTP_HX_REQUEST='true')
+
+        self.assertEqual([e.content for e in response.context['page_obj']],
+                         ['Parent excerpt'])
+
+class LookupIndexTests(TestCase):
+    def setUp(self):
+        self.tag = Tag.objects.create(
+            name='test_tag',
+            type=TagType.objects.create(name='default', description=''),
+            description='Test tag'
+        )
+
+    def test_hot_lookups_use_partial_indexes(self):
+        """
+        Test that the listing, duplicate check and tag lookup search their
+        soft-delete-aware indexes.
+        """
+        if connection.vendor != 'sqlite':
+            self.skipTest('Query plans are checked on SQLite')
+
+        plans = {
+            'excerpt_live_root_idx': Excerpt.objects.filter(is_root=True).order_by('-id')[:10],
+            'excerpt_live_normalized_idx': Excerpt.objects.filter(normalized_hash__in=['a', 'b']),
+            'tag_live_name_idx': Tag.objects.filter(name='test_tag'),
+        }
+
+        for index, queryset in plans.items():
+            self.assertIn(index, queryset.explain())
+
+    def test_excerpt_tag_is_unique(self):
+        """
+        Test that an excerpt can't have the same tag twice.
+        """
+        excerpt = Excerpt.objects.create(content='Tagged excerpt')
+        ExcerptTag.objects.create(excerpt=excerpt, tag=self.tag)
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            ExcerptTag.objects.create(excerpt=excerpt, tag=self.tag)
+
+        # add() skips tags that are already linked
+        excerpt.tags.add(self.tag)
+        self.assertEqual(excerpt.tags.count(), 1)
+
+class NearDuplicateTests(TestCase):
+    def setUp(self):
+        self.lighthouse = Excerpt.objects.create(
+            content='The lighthouse keeper climbed the stairs every evening at dusk.'
+        )
+        self.ships = Excerpt.objects.create(content='Ships in bottles line the shelf.')
+
+    def test_lightly_edited_variants_are_found(self):
+        """
+        Test that near-duplicates are matched to the right excerpt and
+        unrelated contents are not matched.
+        """
+        edited = 'The lighthouse keeper climbed the stairs each evening at dusk.'
+        matches = near_duplicates.find_near_duplicates([edited, 'Nothing like the others.'])
+
+        self.assertEqual(list(matches), [edited])
+        self.assertEqual(matches[edited][0], self.lighthouse)
+        self.assertGreaterEqual(matches[edited][1], near_duplicates.NEAR_DUPLICATE_THRESHOLD)
+
+    def test_signatures_follow_edits_and_deletes(self):
+        """
+        Test that excerpts are signed as they are saved, edited excerpts are
+        re-signed and deleted ones not matched.
+        """
+        self.assertEqual(near_duplicates.sync_minhashes(), 0)
+
+        self.ships.content = 'The lighthouse keeper climbed the stairs every evening.'
+        self.ships.save()
+        self.lighthouse.soft_delete()
+
+        self.assertEqual(near_duplicates.sync_minhashes(), 0)
+
+        with CaptureQueriesContext(connection) as queries:
+            matches = near_duplicates.find_near_duplicates(
+                ['The lighthouse keeper climbed the stairs every evening at dusk!']
+            )
+
+        self.assertEqual([match for match, _ in matches.values()], [self.ships])
+        self.assertFalse([query for query in queries.captured_queries
+                          if not query['sql'].startswith('SELECT')])
+
+        # A queryset update skips Excerpt.save until the signatures are synced
+        Excerpt.objects.filter(id=self.ships.id).update(content_hash='stale')
+        self.assertEqual(near_duplicates.sync_minhashes(), 1)
+
+    def test_bulk_import_signs_new_excerpts(self):
+        """
+        Test that excerpts created by a bulk import are signed.
+        """
+        bulk_actualize_parser_excerpts([ParserExcerpt(content='Ships in bottles line the long shelf.')])
+
+        self.assertEqual(near_duplicates.sync_minhashes(), 0)
+
+    def test_preview_shows_match(self):
+        """
+        Test that the preview keeps the matched excerpt through the cache and
+        shows it next to the new one.
+        """
+        new = ParserExcerpt(content='The lighthouse keeper climbed the stairs every night at dusk.')
+        non_duplicates, _ = check_for_duplicate_excerpts([new])
+
+        cached = ParserExcerpt.from_dict(non_duplicates[0].to_dict())
+        self.assertEqual(cached.near_duplicate['id'], self.lighthouse.id)
+
+        html = render_to_string('excerpts/import/_import_confirmation_excerpt.html',
+                                {'excerpt': cached})
+        self.assertIn('near-duplicate', html)
+        self.assertIn(self.lighthouse.content, html)
+
+class ExcerptTreeTests(TestCase):
+    def create_outline(self, depth):
+        """
+        Create a root with two chains of children depth levels deep.
+        """
+        root = Excerpt.objects.create(content='Root')
+
+        for branch in 'ab':
+            parent = root
+            for level in range(depth):
+                child = Excerpt.objects.create(content=f'{branch}{level}')
+                parent.children.add(child)
+                parent = child
+
+        return root
+
+    def render_contents(self, excerpt):
+        return [excerpt.content, [self.render_contents(child)
+                                  for child in excerpt.children.all()]]
+
+    def test_tree_matches_children(self):
+        """
+        Test that the loaded tree matches children.all() without queries.
+        """
+        root = self.create_outline(3)
+        expected = self.render_contents(Excerpt.objects.get(id=root.id))
+
+        # Deleted excerpts are left out, as children.all() leaves them out
+        Excerpt.objects.get(content='b2').soft_delete()
+        expected[1][1][1][0][1] = []
+
+        loaded = Excerpt.objects.get(id=root.id)
+        load_excerpt_tree([loaded])
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.render_contents(loaded), expected)
+
+    def test_page_queries_do_not_grow_with_depth(self):
+        """
+        Test that rendering deep outlines takes as many queries as flat ones.
+        """
+        self.create_outline(1)
+
+        with CaptureQueriesContext(connection) as shallow:
+            self.client.get('/excerpts/', HTTP_HX_REQUEST='true')
+
+        self.create_outline(12)
+
+        with CaptureQueriesContext(connection) as deep:
+            response = self.client.get('/excerpts/', HTTP_HX_REQUEST='true')
+
+        self.assertContains(response, 'b11')
+        self.assertEqual(len(shallow), len(deep))
+
+    def test_cycles_are_cut(self):
+        """
+        Test that a link back to an ancestor is left out of the tree.
+        """
+        root = self.create_outline(2)
+        last = Excerpt.objects.get(content='a1')
+        last.children.add(Excerpt.objects.get(content='a0'))
+
+        loaded = Excerpt.objects.get(id=root.id)
+        tree = load_excerpt_tree([loaded])
+
+        self.assertEqual(len(tree), 5)
+        self.assertEqual(self.render_contents(loaded)[1][0],
+                         ['a0', [['a1', []]]])
+
+class PickerTests(TestCase):
+    def setUp(self):
+        self.excerpt = Excerpt.objects.create(content='The lighthouse keeper counted ships')
+        self.others = [Excerpt.objects.create(content=f'Lighthouse log {i}') for i in range(5)]
+        self.entity = Entity.objects.create(name='Keeper', description='')
+
+        for name in ['Lighthouse', 'lightship', 'Harbour']:
+            Entity.objects.create(name=name, description='')
+
+    def pick(self, name, **params):
+        response = self.client.get(reverse(name), params)
+        return response, [item.id for item in response.context['results']]
+
+    def test_form_does_not_list_corpus(self):
+        """
+        Test that the relationship form leaves related excerpts to the picker.
+        """
+        response = self.client.get(reverse('relationship_form',
+                                           args=['excerpt-excerpt', self.excerpt.id]))
+
+        self.assertContains(response, reverse('excerpt_picker'))
+        self.assertNotContains(response, 'Lighthouse log')
+
+    def test_excerpt_picker_pages(self):
+        """
+        Test that the excerpt picker matches word prefixes, leaves out the
+        current excerpt and pages its results.
+        """
+        with mock.patch('excerpts.views.relationships.relationship_form_views.PICKER_PAGE_SIZE', 3):
+            response, first = self.pick('excerpt_picker', query='lightho',
+                                        exclude=self.excerpt.id, field='target_excerpt_id')
+            self.assertEqual(len(first), 3)
+            self.assertContains(response, 'name="target_excerpt_id"')
+
+            response, second = self.pick('excerpt_picker', query='lightho',
+                                         exclude=self.excerpt.id, field='target_excerpt_id', page=2)
+
+        self.assertEqual(set(first + second), set(excerpt.id for excerpt in self.others))
+        self.assertIsNone(response.context['next_page_url'])
+
+        response = self.client.get(reverse('excerpt_picker'), {'field': 'content'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_entity_picker_matches_name_prefix(self):
+        """
+        Test that the entity picker matches name prefixes ignoring case, on
+        its index.
+        """
+        _, ids = self.pick('entity_picker', query='LIGHT', field='entity_b_id')
+
+        self.assertEqual([Entity.objects.get(id=id).name for id in ids],
+                         ['Lighthouse', 'lightship'])
+
+        if connection.vendor == 'sqlite':
+            self.assertIn('entity_live_name_idx',
+                          search_index.search_names(Entity.objects.all(), 'light').explain())
+
+    def test_build_prefix_fts_query(self):
+        """
+        Test that only a final plain word becomes a prefix term.
+        """
+        self.assertEqual(search_index.build_fts_query('the keep', prefix=True),
+                         '"the" "keep"*')
+        self.assertEqual(search_index.build_fts_query('"the keep"', prefix=True),
+                         '"the keep"')
+
+class VersionHistoryTests(TestCase):
+    def setUp(self):
+        self.excerpt = Excerpt.objects.create(content='Version 1')
+
+    def edit(self, content):
+        self.excerpt.content = content
+        self.excerpt.save()
+        return version_history.add_version(self.excerpt)
+
+    def test_save_does_not_query_versions(self):
+        """
+        Test that only creating an excerpt touches its versions.
+        """
+        self.assertEqual(self.excerpt.versions.get().content, 'Version 1')
+
+        with CaptureQueriesContext(connection) as queries:
+            self.excerpt.content = 'Edited'
+            self.excerpt.save()
+
+        self.assertFalse([query for query in queries.captured_queries
+                          if 'excerptversion' in query['sql']])
+
+    def test_versions_rebuild_from_snapshots(self):
+        """
+        Test that versions between snapshots are stored as deltas and rebuilt
+        exactly, and that unchanged content adds no version.
+        """
+        contents = [f'The lighthouse keeper counted {number} ships passing the point tonight'
+                    for number in range(1, 25)]
+
+        self.excerpt = Excerpt.objects.create(content=contents[0])
+        for content in contents[1:]:
+            self.edit(content)
+
+        self.assertIsNone(self.edit(contents[-1]))
+
+        versions = list(self.excerpt.versions.order_by('number'))
+        self.assertEqual([version.number for version in versions], list(range(1, 25)))
+        self.assertEqual([version.number for version in versions if version.is_snapshot],
+                         [1, 11, 21])
+
+        self.assertEqual([version.text for version in
+                          version_history.rebuild_versions(self.excerpt.id, 1, 24)],
+                         contents)
+        response = self.client.get(reverse('excerpt_version',
+                                           args=[self.excerpt.id, versions[18].id]))
+        self.assertEqual(response.context['content'], contents[18])
+        self.assertContains(response, contents[18])
+
+        response = self.client.get(reverse('excerpt_version',
+                                           args=[self.excerpt.id + 1, versions[18].id]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_history_pages_lazily(self):
+        """
+        Test that the history view renders the newest versions first and
+        links to the older ones.
+        """
+        for number in range(2, 6):
+            self.edit(f'Version {number}')
+
+        with mock.patch.object(excerpt_views, 'VERSION_PAGE_SIZE', 3):
+            response = self.client.get(reverse('excerpt_versions', args=[self.excerpt.id]))
+
+            self.assertEqual([version.text for version in response.context['versions']],
+                             ['Version 5', 'Version 4', 'Version 3'])
+
+            response = self.client.get(response.context['next_page_url'])
+
+        self.assertEqual([version.text for version in response.context['versions']],
+                         ['Version 2', 'Version 1'])
+        self.assertIsNone(response.context['next_page_url'])
+
+        response = self.client.get(reverse('excerpt_detail', args=[self.excerpt.id]))
+        self.assertContains(response, reverse('excerpt_versions', args=[self.excerpt.id]))
+        self.assertNotContains(response, 'Version 4')
+
+class EmbeddingWorkerCommandTests(TestCase):
+    def test_starts_without_address_setting(self):
+        """
+        Test that the worker listens on the default socket when
+        BARTON_EMBEDDING_WORKER_ADDRESS isn't set.
+        """
+        with mock.patch.object(barton_link, 'embedding_worker', None), \
+                mock.patch.object(barton_link, 'load_sbert', return_value=object()), \
+                mock.patch.object(EmbeddingWorker, 'serve_forever', autospec=True) as serve:
+            call_command('run_embedding_worker', stdout=StringIO())
+
+        self.assertEqual(serve.call_args.args[0].address, WORKER_ADDRESS)
@@ -1,8 +1,8 @@
 from django.urls import path, include
 
 from ..views.excerpts.excerpt_views import (
-    index, search, excerpt, create_excerpt, 
-    add_tag, add_autotag, remove_tag
+    index, search, search_tag_options, excerpt, create_excerpt, 
+    add_tag, add_autotag, remove_tag, excerpt_versions, excerpt_version
 )
 
 # URLs for actions on a specific excerpt
@@ -10,12 +10,15 @@ excerpt_patterns = [
     path("add_tag/<int:tag_id>", add_tag, name="add_tag"),
     path("add_autotag/<int:tag_id>", add_autotag, name="add_autotag"),
     path("remove_tag/<int:tag_id>", remove_tag, name="remove_tag"),
+    path("versions", excerpt_versions, name="excerpt_versions"),
+    path("version/<int:version_id>", excerpt_version, name="excerpt_version"),
 ]
 
 # Main excerpt URL patterns
 urlpatterns = [
     path("", index, name="index"),
     path("search", search, name="search"),
+    path("search/tag-options", search_tag_options, name="search_tag_options"),
     path("excerpt/<int:excerpt_id>", excerpt, name="excerpt_detail"),
     path("excerpt/<int:excerpt_id>/", include(excerpt_patterns), name="excerpt"),
     path("excerpt/create", create_excerpt, name="create_excerpt"),
@@ -2,7 +2,8 @@ from django.urls import path
 
 from ..views.imports.import_views import (
     import_excerpts, import_file, import_text,
-    import_gdocs, import_excerpts_confirm
+    import_gdocs, import_excerpts_confirm,
+    get_import_progress, start_import, stop_import, cancel_import
 )
 from ..views.imports.gdocs_handler import gdocs_test
 
@@ -12,5 +13,9 @@ urlpatterns = [
     path("import/text-paste", import_text, name="import_text_paste"),
     path("import/gdocs", import_gdocs, name="import_gdocs"),
     path("confirm-import", import_excerpts_confirm, name="import_confirm"),
+    path("import/<str:import_id>/progress", get_import_progress, name="import_progress"),
+    path("import/<str:import_id>/start", start_import, name="start_import"),
+    path("import/<str:import_id>/stop", stop_import, name="stop_import"),
+    path("import/<str:import_id>/cancel", cancel_import, name="cancel_import"),
     path("gdocs-test", gdocs_test, name="test"),
 ] 
\ No newline at end of file
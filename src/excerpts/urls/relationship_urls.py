@@ -5,7 +5,8 @@ from ..views.relationships.relationship_views import (
 )
 from ..views.relationships.relationship_form_views import (
     relationship_form, create_relationship_form, 
-    create_entity_relationship_form, relationship_preview
+    create_entity_relationship_form, relationship_preview,
+    excerpt_picker, entity_picker
 )
 from ..views.relationships.relationship_type_views import (
     create_relationship_type
@@ -15,6 +16,8 @@ urlpatterns = [
     path("relationships/create", create_relationship, name="create_relationship"),
     path("relationships/create_type", create_relationship_type, name="create_relationship_type"),
     path("relationships/preview", relationship_preview, name="relationship_preview"),
+    path("relationships/picker/excerpts", excerpt_picker, name="excerpt_picker"),
+    path("relationships/picker/entities", entity_picker, name="entity_picker"),
 
     # Consolidated relationship view - RESTful approach
     # For excerpt-based relationships
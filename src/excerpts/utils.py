@@ -1,4 +1,6 @@
-from .models import RelationshipType
+from django.db.models import Prefetch, prefetch_related_objects
+
+from .models import Excerpt, ExcerptAutoTag, ExcerptRelationship, RelationshipType
 
 def setup_default_relationship_types(force=False):
     """
@@ -136,4 +138,137 @@ def setup_default_relationship_types(force=False):
             existing.save()
             updated_count += 1
     
-    return (created_count, updated_count) 
\ No newline at end of file
+    return (created_count, updated_count) 
+
+# Excerpts below the given roots with the excerpt each sits under. Rows of
+# ExcerptRelationship store the child in the parent column (see
+# bulk_actualize_parser_excerpts). UNION drops repeated rows, so cycles end.
+EXCERPT_TREE_SQL = """
+WITH RECURSIVE tree(id, tree_parent_id, relationship_id) AS (
+    SELECT relationship.parent_id, relationship.child_id, relationship.id
+    FROM {relationship} relationship
+    JOIN {excerpt} excerpt ON excerpt.id = relationship.parent_id
+    WHERE relationship.child_id IN ({roots}) AND NOT excerpt.is_deleted
+
+    UNION
+
+    SELECT relationship.parent_id, relationship.child_id, relationship.id
+    FROM {relationship} relationship
+    JOIN tree ON relationship.child_id = tree.id
+    JOIN {excerpt} excerpt ON excerpt.id = relationship.parent_id
+    WHERE NOT excerpt.is_deleted
+)
+SELECT excerpt.*, tree.tree_parent_id
+FROM tree
+JOIN {excerpt} excerpt ON excerpt.id = tree.id
+ORDER BY tree.relationship_id
+"""
+
+def set_prefetched_children(excerpt, children):
+    """
+    Make excerpt.children.all() return children without a query.
+    """
+
+    #@REVISIT fills the cache prefetch_related_objects would
+    queryset = excerpt.children.all()
+    queryset._result_cache = children
+    queryset._prefetch_done = True
+
+    if not hasattr(excerpt, '_prefetched_objects_cache'):
+        excerpt._prefetched_objects_cache = {}
+
+    excerpt._prefetched_objects_cache['children'] = queryset
+
+def load_excerpt_tree(excerpts):
+    """
+    Load every descendant of excerpts in one recursive query and link them
+    in memory, so children.all() on any excerpt of the tree runs no query.
+
+    Each excerpt is loaded once, however many parents it has. A link back to
+    an ancestor is left out so the tree can be rendered recursively.
+
+    Returns a list of all excerpts of the tree, including excerpts.
+    """
+
+    excerpts = list(excerpts)
+
+    if not excerpts:
+        return []
+
+    instances = {}
+    child_ids = {}
+
+    sql = EXCERPT_TREE_SQL.format(
+        relationship=ExcerptRelationship._meta.db_table,
+        excerpt=Excerpt._meta.db_table,
+        roots=", ".join(["%s"] * len(excerpts)),
+    )
+
+    for row in Excerpt.objects.raw(sql, [excerpt.id for excerpt in excerpts]):
+        instances.setdefault(row.id, row)
+        child_ids.setdefault(row.tree_parent_id, []).append(row.id)
+
+    # Prefer the given instances to loaded copies of them
+    instances.update((excerpt.id, excerpt) for excerpt in excerpts)
+
+    # Link children depth first; "open" excerpts are ancestors of the
+    # excerpt being linked
+    children = {}
+    state = {}
+
+    for excerpt in excerpts:
+        if excerpt.id in state:
+            continue
+
+        state[excerpt.id] = "open"
+        children[excerpt.id] = []
+        stack = [(excerpt.id, iter(child_ids.get(excerpt.id, [])))]
+
+        while stack:
+            excerpt_id, remaining = stack[-1]
+            child_id = next(remaining, None)
+
+            if child_id is None:
+                state[excerpt_id] = "done"
+                stack.pop()
+                continue
+
+            # Leave out links that would close a cycle
+            if state.get(child_id) == "open":
+                continue
+
+            children[excerpt_id].append(instances[child_id])
+
+            if child_id not in state:
+                state[child_id] = "open"
+                children[child_id] = []
+                stack.append((child_id, iter(child_ids.get(child_id, []))))
+
+    for excerpt_id, excerpt_children in children.items():
+        set_prefetched_children(instances[excerpt_id], excerpt_children)
+
+    return [instances[excerpt_id] for excerpt_id in children]
+
+def prefetch_excerpt_list(excerpts):
+    """
+    Load everything an excerpt list renders for a page of excerpts.
+
+    The excerpts' descendants are loaded with load_excerpt_tree, then tags
+    and autotags are prefetched for the whole tree at once, so a page costs
+    a fixed number of queries however deep it nests. Only the tags of the
+    page's excerpts are loaded.
+
+    Returns the excerpts as a list.
+    """
+
+    excerpts = list(excerpts)
+    tree = load_excerpt_tree(excerpts)
+
+    prefetch_related_objects(
+        tree,
+        'tags',
+        Prefetch('autotags',
+                 queryset=ExcerptAutoTag.objects.select_related('tag')),
+    )
+
+    return excerpts
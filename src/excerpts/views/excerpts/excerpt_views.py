@@ -1,59 +1,87 @@
 # from django.shortcuts import render
 
+from urllib.parse import urlencode
+
 from django.http import HttpResponse, HttpResponseNotFound, QueryDict
 from django.urls import reverse
 from django.template import loader
-from django.shortcuts import render, redirect
-from django.core.paginator import Paginator
+from django.shortcuts import render, redirect, get_object_or_404
 
 from ...models import \
         Excerpt,\
         ExcerptVersion,\
         ExcerptSimilarity,\
+        ExcerptTag,\
         Tag,\
         TagType,\
         Entity,\
         ExcerptRelationship
 
+from barton_link import barton_link
+
+from ...pagination import paginate
+from ...utils import prefetch_excerpt_list
+from ...services.search_index import search_excerpts
+from ...services.semantic_index import semantic_search
+from ...services.version_history import rebuild_versions, add_version, version_content
+
+# Versions per page of an excerpt's history
+VERSION_PAGE_SIZE = 10
 
 def index(request):
     return search(request)
 
 def search(request):
-    page_num = request.GET.get("page", 1)
-    page_size = request.GET.get("page_size", 50)
+    page_size = request.GET.get("page_size", "50")
+    page_size = int(page_size) if page_size.isdigit() and int(page_size) > 0 else 50
 
     # Extract search field and filters
     search = request.GET.get("search", "")
+    mode = request.GET.get("mode", "keyword")
+    mode = mode if mode in ("keyword", "semantic") else "keyword"
+    tag_id = request.GET.get("tag", "")
+    tag_id = int(tag_id) if tag_id.isdigit() else None
 
-    # Search for excerpts without parents
-    excerpts = Excerpt.objects.filter(
-        content__icontains=search,
-        parents__isnull=True
-    ).order_by("-id")
+    # Don't make the request wait for the model to load
+    model_loading = mode == "semantic" and not barton_link.is_encoder_ready()
 
-    # excerpts = Excerpt.objects.order_by("-id")
+    if model_loading:
+        barton_link.load_models_in_background()
 
-    paginator = Paginator(excerpts, page_size)
-    page_obj = paginator.get_page(page_num)
+    if mode == "semantic" and search.strip() and not model_loading:
+        # Rank excerpts without parents by embedding similarity to the
+        # search; children are shown under them
+        excerpts = semantic_search(search, tag_id=tag_id, roots_only=True)
 
-    # Build previous and next page links
-    prev_page_url = None
-    next_page_url = None
+    else:
+        excerpts = Excerpt.objects.filter(is_root=True)
+
+        if tag_id:
+            excerpts = excerpts.filter(id__in=ExcerptTag.objects \
+                    .filter(tag_id=tag_id).values('excerpt_id'))
 
-    if page_obj.has_previous():
-        prev_page_url = reverse("search") + \
-                f"?page={page_obj.previous_page_number()}"
+        # Search for excerpts without parents, best matches first
+        excerpts = search_excerpts(excerpts, search)
+
+    # excerpts = Excerpt.objects.order_by("-id")
 
-        if search:
-            prev_page_url += f"&search={search}"
+    # Keep the search and filters in page links
+    link_params = {}
+    if search:
+        link_params["search"] = search
+    if mode == "semantic":
+        link_params["mode"] = mode
+    if tag_id:
+        link_params["tag"] = tag_id
+    if page_size != 50:
+        link_params["page_size"] = page_size
 
-    if page_obj.has_next():
-        next_page_url = reverse("search") + \
-                f"?page={page_obj.next_page_number()}"
+    page_obj, prev_page_url, next_page_url = paginate(
+        request, excerpts, page_size, reverse("search"), link_params
+    )
 
-        if search:
-            next_page_url += f"&search={search}"
+    # Load the page's tags, autotags and children up front
+    page_obj.object_list = prefetch_excerpt_list(page_obj.object_list)
 
     # Render list
     context = {
@@ -64,6 +92,11 @@ def search(request):
         "page_sizes": [10, 25, 50, 100],
         "page_size": page_size,
         "search": search,
+        "mode": mode,
+        "model_loading": model_loading,
+        # The other tags are loaded when the filter is opened
+        "selected_tag": Tag.objects.filter(id=tag_id).first() if tag_id else None,
+        "tag_id": tag_id,
     }
 
     # If HTMX request
@@ -74,6 +107,20 @@ def search(request):
     else:
         return render(request, "excerpts/excerpts/excerpt_search.html", context)
 
+def search_tag_options(request):
+    """
+    Render the options of the search page's tag filter.
+    """
+
+    tag_id = request.GET.get("tag", "")
+
+    context = {
+        "tags": Tag.objects.order_by("name").only("id", "name"),
+        "tag_id": int(tag_id) if tag_id.isdigit() else None,
+    }
+
+    return render(request, "excerpts/excerpts/_tag_options.html", context)
+
 def excerpt(request, excerpt_id):
     # If HTMX request
     if request.headers.get("HX-Request") == "true":
@@ -103,6 +150,61 @@ def excerpt_html(request, excerpt_id):
         # excerpt.delete()
         return HttpResponse(status=204)
 
+def excerpt_versions(request, excerpt_id):
+    """
+    Render a page of an excerpt's versions, newest first, with a link to the
+    older ones if there are any. Only the versions on the page are rebuilt.
+    """
+
+    before = request.GET.get("before", "")
+
+    versions = ExcerptVersion.objects.filter(excerpt_id=excerpt_id)
+    if before.isdigit():
+        versions = versions.filter(number__lt=int(before))
+
+    # Fetch one extra number to know if there is an older page
+    numbers = list(versions.order_by("-number")
+                   .values_list("number", flat=True)[:VERSION_PAGE_SIZE + 1])
+
+    page_numbers = numbers[:VERSION_PAGE_SIZE]
+    page_versions = []
+    next_page_url = None
+
+    if page_numbers:
+        page_versions = rebuild_versions(excerpt_id,
+                                         page_numbers[-1],
+                                         page_numbers[0])[::-1]
+
+    if len(numbers) > VERSION_PAGE_SIZE:
+        next_page_url = reverse("excerpt_versions", args=[excerpt_id]) + "?" \
+                + urlencode({ "before": page_numbers[-1] })
+
+    context = {
+        "excerpt_id": excerpt_id,
+        "versions": page_versions,
+        "first_page": not before,
+        "next_page_url": next_page_url,
+    }
+
+    return render(request, "excerpts/excerpts/_excerpt_versions.html", context)
+
+def excerpt_version(request, excerpt_id, version_id):
+    """
+    Render one version of an excerpt, rebuilt from its nearest snapshot.
+    """
+
+    version = get_object_or_404(ExcerptVersion.objects.select_related("excerpt"),
+                                id=version_id,
+                                excerpt_id=excerpt_id)
+
+    context = {
+        "excerpt": version.excerpt,
+        "version": version,
+        "content": version_content(version),
+    }
+
+    return render(request, "excerpts/excerpts/excerpt_version.html", context)
+
 def excerpt_htmx(request, excerpt_id):
     excerpt = Excerpt.objects.get(id=excerpt_id)
 
@@ -125,7 +227,7 @@ def excerpt_htmx(request, excerpt_id):
             excerpt.save()
 
             # Create new version
-            ExcerptVersion.objects.create(excerpt=excerpt, content=excerpt_text)
+            add_version(excerpt)
 
             # Render excerpt
             context = { "excerpt": excerpt }
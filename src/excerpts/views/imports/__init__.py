@@ -4,6 +4,9 @@ from .import_views import (
     import_text,
     import_gdocs,
     import_excerpts_confirm,
+    get_import_progress,
+    start_import,
+    stop_import,
 )
 
 from .gdocs_handler import gdocs_test
@@ -14,5 +17,8 @@ __all__ = [
     'import_text',
     'import_gdocs',
     'import_excerpts_confirm',
+    'get_import_progress',
+    'start_import',
+    'stop_import',
     'gdocs_test',
 ]
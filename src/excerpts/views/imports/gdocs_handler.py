@@ -1,10 +1,9 @@
 import re
-from django.shortcuts import render
 from django.http import HttpResponse
 from barton_link.gdocs_parser import GDocsParser
 from . import utils
 
-def post_import_gdocs(request, default_tags):
+def post_import_gdocs(request, import_service, default_tags):
     """
     Handle Google Docs imports.
     """
@@ -15,38 +14,9 @@ def post_import_gdocs(request, default_tags):
     doc_id_regex = r"/document/d/([a-zA-Z0-9-_]+)"
     document_ids = [re.search(doc_id_regex, url).group(1) for url in gdoc_urls]
 
-    # Initialize Google Docs API
-    gdocs = GDocsParser()
-
-    # Load credentials
-    gdocs.load_credentials()
-
-    parser_excerpts = []
-
-    # Load and parse each Google Doc
+    # Add each Google Doc to the import; they are loaded in the background
     for document_id in document_ids:
-        # Load document
-        document = gdocs.get_document(document_id)
-        parser_excerpts += gdocs.parse_document(document, default_tags)
-
-    # Check for duplicate excerpts
-    excerpts, duplicates = utils.check_for_duplicate_excerpts(parser_excerpts)
-
-    # Count non-duplicate excerpts
-    non_duplicate_count = sum(1 for e in excerpts if not e.is_duplicate)
-
-    # Save excerpts to cache instead of session and get a preview ID
-    preview_id, all_excerpts, new_tags = utils.save_excerpts_to_cache(excerpts, duplicates)
-
-    # Present confirmation page
-    return render(request, "excerpts/import/_import_confirmation.html", {
-        "excerpts": excerpts,
-        "duplicates": duplicates,
-        "default_tags": default_tags,
-        "new_tags": new_tags,
-        "non_duplicate_count": non_duplicate_count,
-        "preview_id": preview_id,  # Pass the preview ID to the template
-    })
+        import_service.add_gdocs_source(document_id, default_tags)
 
 def gdocs_test(request):
     """
@@ -1,6 +1,7 @@
 from django.http import HttpResponse, HttpResponseNotAllowed, HttpResponseBadRequest, HttpResponseNotFound
 from django.shortcuts import render
 from ...models import Tag, TagType
+from ...services import create_import_service, get_import_service
 from barton_link.parser_excerpt import ParserExcerpt
 from . import utils
 from . import file_handler
@@ -29,15 +30,24 @@ def import_excerpts(request):
             default_tags = request.POST.getlist("toggled_tags[]")
             default_tags = [Tag.objects.get(id=tag_id).name for tag_id in default_tags]
 
+            import_service = create_import_service()
+
+            # Add the sources to the import
             match request.POST.get("import_method"):
                 case "text_paste":
-                    return text_handler.post_import_text(request, default_tags)
+                    text_handler.post_import_text(request,
+                                                  import_service,
+                                                  default_tags)
 
                 case "upload":
-                    return file_handler.post_import_files(request, default_tags)
+                    file_handler.post_import_files(request,
+                                                   import_service,
+                                                   default_tags)
 
                 case "gdocs":
-                    return gdocs_handler.post_import_gdocs(request, default_tags)
+                    gdocs_handler.post_import_gdocs(request,
+                                                    import_service,
+                                                    default_tags)
 
                 case _:
                     print("Invalid import method.")
@@ -45,6 +55,10 @@ def import_excerpts(request):
                         "error": "Invalid import method.",
                     }))
 
+            # Parse and preview the import in the background
+            import_service.start()
+            return get_import_progress(request, import_service.import_id)
+
         case _:
             return HttpResponseNotAllowed(["GET", "POST"])
 
@@ -97,33 +111,88 @@ def import_excerpts_confirm(request):
         return HttpResponseBadRequest(json.dumps({
             "error": "No preview ID provided."
         }))
-    
-    # Retrieve excerpts from cache
-    excerpts, new_tags = utils.retrieve_excerpts_from_cache(preview_id)
-    if not excerpts:
+
+    import_service = get_import_service(preview_id)
+    if not import_service or not import_service.is_finished():
         return HttpResponseBadRequest(json.dumps({
-            "error": "Import preview not found or expired."
+            "error": "Import preview not found or not finished."
         }))
 
     # Get selected tags to create
-    tags_to_create = set(request.POST.getlist("create_tags[]"))
+    tags_to_create = request.POST.getlist("create_tags[]")
 
-    # Convert to ParserExcerpt
-    parser_excerpts = excerpts  # Already converted by retrieve_excerpts_from_cache
+    # Write the excerpts in the background
+    print("Adding excerpts...")
+    import_service.confirm(tags_to_create)
+    import_service.start()
 
-    # Filter out tags that shouldn't be created
-    for excerpt in parser_excerpts:
-        excerpt.tags = [tag for tag in excerpt.tags if tag not in new_tags or tag in tags_to_create]
+    return get_import_progress(request, import_service.import_id)
 
-    print("Adding excerpts...")
-    # Create database Excerpt from ParserExcerpt
-    created_excerpts, duplicate_excerpts = utils.actualize_parser_excerpts(parser_excerpts)
+def get_import_progress(request, import_id):
+    """
+    Get import progress, or the import's outcome once a stage finishes.
+    """
+    import_service = get_import_service(import_id)
+    if not import_service:
+        return HttpResponseNotFound()
+
+    status = import_service.get_status()
+
+    # Present confirmation page once the preview is ready
+    if status["finished"] and status["stage"] == "preview":
+        preview = import_service.get_preview()
+
+        return render(request, "excerpts/import/_import_confirmation.html", {
+            "excerpts": preview["excerpts"],
+            "duplicates": preview["duplicates"],
+            "new_tags": preview["new_tags"],
+            "non_duplicate_count": sum(1 for e in preview["excerpts"]
+                                       if not e.is_duplicate),
+            "preview_id": import_service.import_id,
+        })
 
-    # Remove excerpts from cache
-    utils.delete_excerpts_from_cache(preview_id)
+    # Return import success page once the excerpts are written, then
+    # delete the finished import
+    if status["finished"] and status["stage"] == "confirm":
+        response = render(request, "excerpts/import/_import_success.html",
+                          import_service.get_result())
 
-    # Return import success page
-    return render(request, "excerpts/import/_import_success.html", {
-        "excerpts": created_excerpts,
-        "internal_duplicates": duplicate_excerpts,
+        import_service.delete()
+        return response
+
+    return render(request, "excerpts/import/_import_progress.html", {
+        "status": status,
     })
+
+def start_import(request, import_id):
+    """
+    Resume a stopped import.
+    """
+    import_service = get_import_service(import_id)
+    if not import_service:
+        return HttpResponseNotFound()
+
+    import_service.start()
+    return get_import_progress(request, import_id)
+
+def stop_import(request, import_id):
+    """
+    Stop an import; it can be resumed later.
+    """
+    import_service = get_import_service(import_id)
+    if not import_service:
+        return HttpResponseNotFound()
+
+    import_service.stop()
+    return get_import_progress(request, import_id)
+
+def cancel_import(request, import_id):
+    """
+    Cancel an import, deleting it.
+    """
+    import_service = get_import_service(import_id)
+    if not import_service:
+        return HttpResponseNotFound()
+
+    import_service.cancel()
+    return render(request, "excerpts/import/_import_cancelled.html")
@@ -1,13 +1,59 @@
 from django.http import HttpResponse
-from ...models import Excerpt, Tag, TagType
+from django.db import transaction
+from ...models import Excerpt,\
+        ExcerptRelationship,\
+        ExcerptTag,\
+        ExcerptVersion,\
+        Tag,\
+        TagType
+from ...hashing import content_hash, normalized_content_hash
+from ...services.embedding_store import LOOKUP_CHUNK_SIZE, invalidate_excerpt_flags
+from ...services.near_duplicates import find_near_duplicates, store_minhashes
 from barton_link.parser_excerpt import ParserExcerpt
-import uuid
-from django.core.cache import cache
 
-def check_for_duplicate_excerpts(excerpts):
+def find_existing_excerpts(contents):
+    """
+    Find the existing excerpts that duplicate contents, ignoring whitespace,
+    case and markdown emphasis.
+
+    Returns a dict mapping each content with a duplicate to an exact match
+    if there is one, or else the oldest normalized match. Lookups are by
+    indexed hash, in chunks, so any number of contents is safe.
+    """
+    hashes = {}
+    for content in contents:
+        hashes.setdefault(normalized_content_hash(content), []).append(content)
+
+    hash_list = list(hashes)
+    matches = {}
+
+    for i in range(0, len(hash_list), LOOKUP_CHUNK_SIZE):
+        for excerpt in Excerpt.objects.filter(
+            normalized_hash__in=hash_list[i:i + LOOKUP_CHUNK_SIZE]
+        ).order_by("id"):
+            matches.setdefault(excerpt.normalized_hash, []).append(excerpt)
+
+    existing = {}
+
+    for normalized_hash, excerpts in matches.items():
+        for content in hashes[normalized_hash]:
+            exact_hash = content_hash(content)
+
+            existing[content] = next(
+                (excerpt for excerpt in excerpts if excerpt.content_hash == exact_hash),
+                excerpts[0],
+            )
+
+    return existing
+
+def check_for_duplicate_excerpts(excerpts, seen_hashes=None):
     """
     Check for duplicate excerpts both within the input list and against the database.
     Returns a tuple of (non_duplicates, duplicates).
+
+    Contents are compared ignoring whitespace, case and markdown emphasis,
+    as in find_existing_excerpts. Excerpts that aren't duplicates but nearly
+    match an existing excerpt get its details in near_duplicate.
     
     Note: Even if a parent excerpt is a duplicate, its children might be unique.
     The actualize_parser_excerpt function will handle adding unique children to
@@ -18,6 +64,10 @@ def check_for_duplicate_excerpts(excerpts):
     
     Args:
         excerpts: List of ParserExcerpt objects to check for duplicates
+        seen_hashes: Optional set of the normalized content hashes of
+            excerpts checked before, e.g. in earlier chunks of the same
+            import. Excerpts matching one are duplicates, and the hashes of
+            these excerpts are added to it.
         
     Returns:
         tuple: (non_duplicates, duplicates) where both are lists of ParserExcerpt objects
@@ -25,15 +75,17 @@ def check_for_duplicate_excerpts(excerpts):
     print("Checking for duplicate excerpts...")
     
     # Step 1: Collect all excerpt contents (including children) for duplicate checking
-    all_excerpt_contents = {}  # Maps content to excerpt for all excerpts (including children)
+    all_excerpt_contents = {}  # Maps normalized content hash to excerpts (including children)
     
     # Helper function to collect all excerpt contents recursively
     def collect_all_contents(excerpt, path=""):
         # Add the excerpt to the map
-        if excerpt.content in all_excerpt_contents:
-            all_excerpt_contents[excerpt.content].append((excerpt, path))
+        key = normalized_content_hash(excerpt.content)
+
+        if key in all_excerpt_contents:
+            all_excerpt_contents[key].append((excerpt, path))
         else:
-            all_excerpt_contents[excerpt.content] = [(excerpt, path)]
+            all_excerpt_contents[key] = [(excerpt, path)]
         
         # Recursively collect children
         for i, child in enumerate(excerpt.children):
@@ -44,27 +96,47 @@ def check_for_duplicate_excerpts(excerpts):
         collect_all_contents(excerpt, str(i))
     
     # Step 2: Mark duplicates within the input list
-    seen_contents = {}
     for content, excerpt_list in all_excerpt_contents.items():
         if len(excerpt_list) > 1:
             # Mark all but the first occurrence as duplicates
             for excerpt, _ in excerpt_list[1:]:
                 excerpt.is_duplicate = True
+
+    # Mark duplicates of excerpts checked before, and remember these
+    if seen_hashes is not None:
+        for key, excerpt_list in all_excerpt_contents.items():
+            if key in seen_hashes:
+                for excerpt, _ in excerpt_list:
+                    excerpt.is_duplicate = True
+
+        seen_hashes.update(all_excerpt_contents)
     
     # Step 3: Check for duplicates against the database
-    # Get all unique content strings
-    unique_contents = list(all_excerpt_contents.keys())
+    # Get the first content of each normalized hash not already a duplicate
+    unique_contents = [excerpt_list[0][0].content
+                       for excerpt_list in all_excerpt_contents.values()
+                       if not excerpt_list[0][0].is_duplicate]
     
-    # Query database once for all potential duplicates
-    existing_contents = set(Excerpt.objects.filter(
-        content__in=unique_contents
-    ).values_list('content', flat=True))
+    # Query database in chunks of hashes for all potential duplicates
+    existing_contents = find_existing_excerpts(unique_contents)
     
     # Mark excerpts as duplicates if they exist in the database
     for content in existing_contents:
-        if content in all_excerpt_contents:
-            for excerpt, _ in all_excerpt_contents[content]:
-                excerpt.is_duplicate = True
+        for excerpt, _ in all_excerpt_contents[normalized_content_hash(content)]:
+            excerpt.is_duplicate = True
+    
+    # Flag near-duplicates of existing excerpts among the rest
+    new_contents = [excerpt_list[0][0].content
+                    for excerpt_list in all_excerpt_contents.values()
+                    if not excerpt_list[0][0].is_duplicate]
+
+    for content, (match, similarity) in find_near_duplicates(new_contents).items():
+        for excerpt, _ in all_excerpt_contents[normalized_content_hash(content)]:
+            excerpt.near_duplicate = {
+                'id': match.id,
+                'content': match.content,
+                'similarity': similarity,
+            }
     
     # Step 4: Separate top-level duplicates and non-duplicates
     internal_duplicates = []
@@ -104,111 +176,6 @@ def identify_new_tags(excerpts):
     # Return tags that don't exist in database
     return all_tags - existing_tags
 
-def save_excerpts_to_cache(excerpts, duplicates=None):
-    """
-    Save excerpts to cache for later confirmation.
-    Also saves information about new tags that would be created.
-    
-    Args:
-        excerpts: List of non-duplicate ParserExcerpt objects
-        duplicates: List of duplicate ParserExcerpt objects (optional)
-        
-    Returns:
-        tuple: (preview_id, all_excerpts, new_tags) where preview_id is a unique identifier,
-        all_excerpts is a list of all excerpts including duplicates with unique children,
-        and new_tags is a set of new tag names
-    """
-    # Combine all excerpts for cache storage
-    all_excerpts = list(excerpts)
-    
-    # Include duplicates that have unique children
-    if duplicates:
-        for duplicate in duplicates:
-            # Check if this duplicate has any non-duplicate children
-            has_unique_children = any(not child.is_duplicate for child in duplicate.children)
-            if has_unique_children:
-                all_excerpts.append(duplicate)
-    
-    # Generate a unique ID for this import preview
-    preview_id = str(uuid.uuid4())
-    
-    # Identify new tags from all excerpts
-    new_tags = identify_new_tags(all_excerpts)
-    
-    # Store in cache with expiration (24 hours)
-    cache_data = {
-        'excerpts': [excerpt.to_dict() for excerpt in all_excerpts],
-        'new_tags': list(new_tags)
-    }
-    cache.set(f'import_preview:{preview_id}', cache_data, timeout=86400)  # 24 hours
-    
-    return preview_id, all_excerpts, new_tags
-
-def retrieve_excerpts_from_cache(preview_id):
-    """
-    Retrieve excerpts data from cache using the preview_id.
-    
-    Args:
-        preview_id: The unique identifier for the import preview
-        
-    Returns:
-        tuple: (excerpts, new_tags) where excerpts is a list of ParserExcerpt objects
-        and new_tags is a list of new tag names. Returns (None, None) if not found.
-    """
-    # Get data from cache
-    cache_data = cache.get(f'import_preview:{preview_id}')
-    if not cache_data:
-        return None, None
-    
-    # Convert back to ParserExcerpt objects
-    excerpts = [ParserExcerpt.from_dict(exc) for exc in cache_data['excerpts']]
-    new_tags = cache_data['new_tags']
-    
-    return excerpts, new_tags
-
-def delete_excerpts_from_cache(preview_id):
-    """
-    Delete excerpts data from cache.
-    
-    Args:
-        preview_id: The unique identifier for the import preview
-    """
-    cache.delete(f'import_preview:{preview_id}')
-
-def save_excerpts_to_session(request, excerpts, duplicates=None):
-    """
-    Save excerpts to session for later confirmation.
-    Also saves information about new tags that would be created.
-    
-    Args:
-        request: The HTTP request
-        excerpts: List of non-duplicate ParserExcerpt objects
-        duplicates: List of duplicate ParserExcerpt objects (optional)
-        
-    Returns:
-        tuple: (all_excerpts, new_tags) where all_excerpts is a list of all excerpts 
-        including duplicates with unique children, and new_tags is a set of new tag names
-    """
-    # Combine all excerpts for session storage
-    all_excerpts = list(excerpts)
-    
-    # Include duplicates that have unique children
-    if duplicates:
-        for duplicate in duplicates:
-            # Check if this duplicate has any non-duplicate children
-            has_unique_children = any(not child.is_duplicate for child in duplicate.children)
-            if has_unique_children:
-                all_excerpts.append(duplicate)
-    
-    # Save excerpts
-    request.session["excerpts"] = [excerpt.to_dict() for excerpt in all_excerpts]
-    
-    # Save new tags from all excerpts (including duplicates with unique children)
-    new_tags = identify_new_tags(all_excerpts)
-    request.session["new_tags"] = list(new_tags)
-    
-    return all_excerpts, new_tags
-
 def actualize_parser_excerpts(parser_excerpts: list[ParserExcerpt]):
     """
     Add excerpts from parser excerpt array.
@@ -258,8 +225,12 @@ def actualize_parser_excerpt(parser_excerpt: ParserExcerpt):
 
     # Create excerpt instance or get existing identical instance first
     # This way we know if we're dealing with an existing excerpt before processing children
-    excerpt_instance, created = Excerpt.objects.get_or_create(
-            content=parser_excerpt.content,)
+    excerpt_instance = find_existing_excerpts([parser_excerpt.content]) \
+            .get(parser_excerpt.content)
+    created = excerpt_instance is None
+
+    if created:
+        excerpt_instance = Excerpt.objects.create(content=parser_excerpt.content)
 
     # If not created, mark as duplicate
     if not created:
@@ -295,9 +266,7 @@ def actualize_parser_excerpt(parser_excerpt: ParserExcerpt):
     existing_child_contents = set()
     
     if child_contents:
-        existing_child_contents = set(Excerpt.objects.filter(
-            content__in=child_contents
-        ).values_list('content', flat=True))
+        existing_child_contents = set(find_existing_excerpts(child_contents))
     
     # Now process each child
     for child in parser_excerpt.children:
@@ -327,6 +296,190 @@ def actualize_parser_excerpt(parser_excerpt: ParserExcerpt):
 
     return excerpt_instance, created
 
+def bulk_actualize_parser_excerpts(parser_excerpts: list[ParserExcerpt]):
+    """
+    Add excerpts from parser excerpt array with set-based queries.
+    Returns a tuple of (created_excerpts, duplicate_excerpts).
+
+    Equivalent to actualize_parser_excerpts, but instead of several queries
+    per excerpt and tag, the excerpt tree is flattened, existing excerpts
+    and tags are looked up in chunks, and new excerpts, versions, tags,
+    ExcerptTag and ExcerptRelationship rows are inserted with bulk_create
+    in a single transaction.
+
+    As with actualize_parser_excerpt, an excerpt whose content already
+    exists (in the database or earlier in the import) is marked as a
+    duplicate and reused, and its children are still added to it.
+    """
+    # Flatten the tree in the order actualize_parser_excerpt visits it
+    nodes = []
+
+    def flatten(parser_excerpt):
+        nodes.append(parser_excerpt)
+
+        for child in parser_excerpt.children:
+            flatten(child)
+
+    for parser_excerpt in parser_excerpts:
+        flatten(parser_excerpt)
+
+    contents = list(dict.fromkeys(node.content for node in nodes))
+    tag_names = list(dict.fromkeys(tag for node in nodes for tag in node.tags))
+
+    with transaction.atomic():
+        # Find existing excerpts, matched as in actualize_parser_excerpt
+        instances = find_existing_excerpts(contents)
+
+        existing_ids = set(excerpt.id for excerpt in instances.values())
+
+        # Create excerpts for the first occurrence of each new normalized
+        # content; later variants of it reuse that excerpt
+        new_excerpts = []
+        created_nodes = set()
+        created_hashes = {}
+
+        for node in nodes:
+            if node.content in instances:
+                node.is_duplicate = True
+                continue
+
+            normalized_hash = normalized_content_hash(node.content)
+
+            if normalized_hash in created_hashes:
+                instances[node.content] = created_hashes[normalized_hash]
+                node.is_duplicate = True
+                continue
+
+            excerpt = Excerpt(content=node.content)
+            excerpt.set_content_hashes()
+            instances[node.content] = excerpt
+            created_hashes[normalized_hash] = excerpt
+            new_excerpts.append(excerpt)
+            created_nodes.add(id(node))
+
+        # Every occurrence overwrites the metadata, so the last one wins
+        for node in nodes:
+            instances[node.content].metadata = node.metadata
+
+        print(f"Adding {len(new_excerpts)} excerpts...")
+        Excerpt.objects.bulk_create(new_excerpts, batch_size=LOOKUP_CHUNK_SIZE)
+
+        # bulk_create skips Excerpt.save, so sign the new excerpts here
+        store_minhashes(new_excerpts)
+
+        # Update the metadata of existing excerpts
+        changed_excerpts = list({
+            excerpt.id: excerpt for excerpt in instances.values()
+            if excerpt.id in existing_ids
+        }.values())
+
+        Excerpt.objects.bulk_update(changed_excerpts,
+                                    ["metadata"],
+                                    batch_size=LOOKUP_CHUNK_SIZE)
+
+        # Give the new excerpts their first version; existing excerpts
+        # already have one, from Excerpt.save or an earlier import
+        ExcerptVersion.objects.bulk_create(
+            [
+                ExcerptVersion(excerpt=excerpt, number=1, content=excerpt.content)
+                for excerpt in new_excerpts
+            ],
+            batch_size=LOOKUP_CHUNK_SIZE,
+        )
+
+        # Find existing tags, creating the rest with the default tag type
+        tags = {}
+        for i in range(0, len(tag_names), LOOKUP_CHUNK_SIZE):
+            for tag in Tag.objects.filter(
+                name__in=tag_names[i:i + LOOKUP_CHUNK_SIZE]
+            ).order_by("-id"):
+                tags[tag.name] = tag
+
+        new_tags = [name for name in tag_names if name not in tags]
+
+        if new_tags:
+            default_tag_type = get_or_create_default_tag_type()
+
+            for tag in Tag.objects.bulk_create(
+                [
+                    Tag(name=name, type=default_tag_type, description="")
+                    for name in new_tags
+                ],
+                batch_size=LOOKUP_CHUNK_SIZE,
+            ):
+                tags[tag.name] = tag
+
+        # Find tags and children already linked to existing excerpts
+        #@REVISIT Excerpt.parents is the forward side of ExcerptRelationship,
+        #@ so children.add() stores the child in the parent column and the
+        #@ parent in the child column; the rows below follow suit
+        existing_tag_pairs = set()
+        existing_child_pairs = set()
+        existing_id_list = list(existing_ids)
+
+        for i in range(0, len(existing_id_list), LOOKUP_CHUNK_SIZE):
+            chunk = existing_id_list[i:i + LOOKUP_CHUNK_SIZE]
+
+            existing_tag_pairs.update(ExcerptTag.objects.filter(
+                excerpt_id__in=chunk
+            ).values_list("excerpt_id", "tag_id"))
+
+            existing_child_pairs.update(ExcerptRelationship.objects.filter(
+                child_id__in=chunk
+            ).values_list("child_id", "parent_id"))
+
+        # Link tags and children that aren't linked yet
+        tag_pairs = dict.fromkeys(
+            (instances[node.content].id, tags[tag].id)
+            for node in nodes
+            for tag in node.tags
+        )
+
+        child_pairs = dict.fromkeys(
+            (instances[node.content].id, instances[child.content].id)
+            for node in nodes
+            for child in node.children
+        )
+
+        ExcerptTag.objects.bulk_create(
+            [
+                ExcerptTag(excerpt_id=excerpt_id, tag_id=tag_id)
+                for excerpt_id, tag_id in tag_pairs
+                if (excerpt_id, tag_id) not in existing_tag_pairs
+            ],
+            batch_size=LOOKUP_CHUNK_SIZE,
+        )
+
+        ExcerptRelationship.objects.bulk_create(
+            [
+                ExcerptRelationship(parent_id=child_id, child_id=parent_id)
+                for parent_id, child_id in child_pairs
+                if (parent_id, child_id) not in existing_child_pairs
+            ],
+            batch_size=LOOKUP_CHUNK_SIZE,
+        )
+
+        # bulk_create skips the signals that maintain is_root
+        child_ids = list(set(child_id for _, child_id in child_pairs))
+
+        for i in range(0, len(child_ids), LOOKUP_CHUNK_SIZE):
+            Excerpt.all_objects.filter(
+                id__in=child_ids[i:i + LOOKUP_CHUNK_SIZE]
+            ).update(is_root=False)
+
+        invalidate_excerpt_flags()
+
+    created_excerpts = []
+    duplicate_excerpts = []
+
+    for parser_excerpt in parser_excerpts:
+        if id(parser_excerpt) in created_nodes:
+            created_excerpts.append(parser_excerpt)
+        else:
+            duplicate_excerpts.append(parser_excerpt)
+
+    return created_excerpts, duplicate_excerpts
+
 def get_tags_from_filename(filename: str,
                            regex: str,
                            regex_group_separator = None) -> list[str]:
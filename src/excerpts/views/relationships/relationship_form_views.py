@@ -1,5 +1,6 @@
 from django.shortcuts import render, get_object_or_404
 from django.http import HttpResponse, Http404
+from django.urls import reverse
 
 from ...models import (
     Excerpt, 
@@ -9,12 +10,19 @@ from ...models import (
     EntityRelationship,
     RelationshipType
 )
+from ...services.search_index import search_excerpts, search_names
 
 # Constants for relationship types
 EXCERPT_EXCERPT = 'excerpt-excerpt'
 ENTITY_EXCERPT = 'entity-excerpt'
 ENTITY_ENTITY = 'entity-entity'
 
+# Results per page of a typeahead picker
+PICKER_PAGE_SIZE = 20
+
+# Form fields a picker can fill in
+PICKER_FIELDS = ['target_excerpt_id', 'entity_b_id', 'entity_id']
+
 def relationship_form(request, rel_type, excerpt_id=None, entity_id=None):
     """View for displaying the relationship form based on relationship type"""
     if rel_type == EXCERPT_EXCERPT and excerpt_id:
@@ -33,14 +41,11 @@ def create_relationship_form(request, rel_type, excerpt_id):
         applicable_contexts__contains=RelationshipType.EXCERPT_EXCERPT
     )
     
-    # Get all excerpts except the current one
-    available_excerpts = Excerpt.objects.exclude(id=excerpt_id)
-    
+    # Related excerpts are picked with excerpt_picker
     context = {
         'rel_type': rel_type,
         'excerpt': excerpt,
         'relationship_types': relationship_types,
-        'available_excerpts': available_excerpts,
     }
     
     return render(request, 'excerpts/relationships/_relationship_form.html', context)
@@ -54,18 +59,70 @@ def create_entity_relationship_form(request, rel_type, entity_id):
         applicable_contexts__contains=RelationshipType.ENTITY_ENTITY
     )
     
-    # Get all entities except the current one
-    available_entities = Entity.objects.exclude(id=entity_id)
-    
+    # Related entities are picked with entity_picker
     context = {
         'rel_type': rel_type,
         'entity': entity,
         'relationship_types': relationship_types,
-        'available_entities': available_entities,
     }
     
     return render(request, 'excerpts/relationships/_relationship_form.html', context)
 
+def excerpt_picker(request):
+    """Typeahead results for picking a related excerpt, best matches first"""
+    excerpts = Excerpt.objects.all()
+
+    exclude = request.GET.get('exclude', '')
+    if exclude.isdigit():
+        excerpts = excerpts.exclude(id=int(exclude))
+
+    # Words match as prefixes as the user types; no search lists the newest
+    excerpts = search_excerpts(excerpts, request.GET.get('query', ''), prefix=True)
+
+    return render_picker(request, excerpts, 'excerpt', reverse('excerpt_picker'))
+
+def entity_picker(request):
+    """Typeahead results for picking a related entity, by name prefix"""
+    entities = search_names(Entity.objects.all(), request.GET.get('query', ''))
+
+    exclude = request.GET.get('exclude', '')
+    if exclude.isdigit():
+        entities = entities.exclude(id=int(exclude))
+
+    return render_picker(request, entities, 'entity', reverse('entity_picker'))
+
+def render_picker(request, items, kind, url):
+    """
+    Render one page of picker results as radio buttons named by the field
+    parameter, with a link to the next page if there is one.
+    """
+    field = request.GET.get('field', '')
+    if field not in PICKER_FIELDS:
+        return HttpResponse("Invalid picker field", status=400)
+
+    page = request.GET.get('page', '1')
+    page = int(page) if page.isdigit() and int(page) > 0 else 1
+
+    # Fetch one extra result to know if there is a next page, without a COUNT
+    start = (page - 1) * PICKER_PAGE_SIZE
+    results = list(items[start:start + PICKER_PAGE_SIZE + 1])
+
+    next_page_url = None
+    if len(results) > PICKER_PAGE_SIZE:
+        params = request.GET.copy()
+        params['page'] = page + 1
+        next_page_url = url + '?' + params.urlencode()
+
+    context = {
+        'kind': kind,
+        'field': field,
+        'page': page,
+        'results': results[:PICKER_PAGE_SIZE],
+        'next_page_url': next_page_url,
+    }
+
+    return render(request, 'excerpts/relationships/_picker_results.html', context)
+
 def relationship_preview(request):
     """View for previewing a relationship before creating it"""
     # Get parameters from request
@@ -1,6 +1,5 @@
 from django.http import HttpResponse, HttpResponseNotFound, QueryDict
 from django.shortcuts import render
-from django.core.paginator import Paginator
 from django.urls import reverse
 
 from barton_link import barton_link
@@ -10,6 +9,9 @@ from ...models import Excerpt,\
         TagType,\
         ExcerptAutoTag\
 
+from ...pagination import paginate
+from ...utils import prefetch_excerpt_list
+
 def tags(request):
     # If HTMX request
     if request.headers.get("HX-Request") == "true":
@@ -99,17 +101,30 @@ def tag(request, tag_id):
 def tag_html(request, tag_id):
     tag = Tag.all_objects.get(id=tag_id)
 
-    page_num = request.GET.get("page", 1)
-    page_size = request.GET.get("page_size", 50)
+    page_size = request.GET.get("page_size", "50")
+    page_size = int(page_size) if page_size.isdigit() and int(page_size) > 0 else 50
 
-    # Get excerpts with tag
-    excerpts = tag.excerpts.all()
+    # Get excerpts with tag, newest first
+    excerpts = tag.excerpts.order_by("-id")
 
     # Paginate excerpts
-    paginator = Paginator(excerpts, page_size)
-    page_obj = paginator.get_page(page_num)
-
-    context = { "tag": tag, "page_obj": page_obj }
+    page_obj, prev_page_url, next_page_url = paginate(
+        request,
+        excerpts,
+        page_size,
+        request.path,
+        {"page_size": page_size} if page_size != 50 else {},
+    )
+
+    # Load the page's tags, autotags and children up front
+    page_obj.object_list = prefetch_excerpt_list(page_obj.object_list)
+
+    context = {
+        "tag": tag,
+        "page_obj": page_obj,
+        "prev_page_url": prev_page_url,
+        "next_page_url": next_page_url,
+    }
 
     return render(request, "excerpts/tags/tag_page.html", context)
 
@@ -1,3 +1,5 @@
+import os
+
 from django.http import HttpResponse
 from django.shortcuts import render
 from django.core.paginator import Paginator
@@ -49,7 +51,20 @@ def autotag_excerpts(request):
 def start_autotag(request):
     """
     Start autotagging process.
+
+    GET parameters:
+        engine: Autotag engine to run ("per_excerpt" or "batched")
+        workers: Number of processes to encode excerpts with
     """
+    engine = request.GET.get("engine")
+    workers = request.GET.get("workers", "")
+
+    if engine in autotag.engines:
+        autotag.set_engine(engine)
+
+    if workers.isdigit() and int(workers) >= 1:
+        autotag.set_workers(min(int(workers), os.cpu_count() or 1))
+
     autotag.start()
     return get_autotag_progress(request)
 
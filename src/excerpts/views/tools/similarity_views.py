@@ -1,3 +1,5 @@
+import os
+
 from django.http import HttpResponse
 from django.shortcuts import render
 
@@ -15,7 +17,20 @@ def analyze_similarities(request):
 def start_similarity_analysis(request):
     """
     Start similarity analysis.
+
+    GET parameters:
+        engine: Similarity engine to run ("pairwise", "matrix", "ann" or "top_k")
+        workers: Number of processes to encode excerpts with
     """
+    engine = request.GET.get("engine")
+    workers = request.GET.get("workers", "")
+
+    if engine in similarity_analysis.engines:
+        similarity_analysis.set_engine(engine)
+
+    if workers.isdigit() and int(workers) >= 1:
+        similarity_analysis.set_workers(min(int(workers), os.cpu_count() or 1))
+
     similarity_analysis.start()
     return get_analysis_progress(request)
 
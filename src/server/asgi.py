@@ -14,3 +14,14 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'server.settings')
 
 application = get_asgi_application()
+
+from django.conf import settings
+
+from barton_link import barton_link
+
+if settings.EMBEDDING_WORKER:
+    barton_link.use_embedding_worker(settings.EMBEDDING_WORKER_ADDRESS,
+                                     settings.SECRET_KEY.encode())
+
+elif settings.PRELOAD_MODELS:
+    barton_link.load_models_in_background()
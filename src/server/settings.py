@@ -144,6 +144,25 @@ if DEBUG:
     COMPRESS_OFFLINE = False  # Disable offline compression
     COMPRESS_CACHE_BACKEND = 'django.core.cache.backends.dummy.DummyCache'  # Disable caching
 
+# Load language models in the background when the server starts, instead
+# of on the first request that needs them
+PRELOAD_MODELS = os.environ.get('BARTON_PRELOAD_MODELS', '') == '1'
+
+# Encode through the embedding worker (manage.py run_embedding_worker)
+# instead of in the server process
+EMBEDDING_WORKER = os.environ.get('BARTON_EMBEDDING_WORKER', '') == '1'
+
+# Unix socket of the embedding worker
+from barton_link.embedding_worker import WORKER_ADDRESS
+EMBEDDING_WORKER_ADDRESS = os.environ.get('BARTON_EMBEDDING_WORKER_ADDRESS', WORKER_ADDRESS)
+
+# Number of similar excerpts shown on an excerpt's page
+SIMILAR_EXCERPTS_LIMIT = 50
+
+# Page excerpt lists by id cursor instead of page number, skipping the
+# COUNT(*) and OFFSET; pages then show no total
+KEYSET_PAGINATION = False
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'